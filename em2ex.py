@@ -3,7 +3,10 @@
 # Convert reservoir Earth model to exodus mesh
 
 import numpy as np
-from readers import eclipse, leapfrog
+from readers import eclipse, egrid, leapfrog, slabs
+from readers.compressed import stripCompressionExtension
+from readers.mesh_quality import QUALITY_METRICS, meshQuality, qualityMetrics
+from readers.profiling import stage
 from exodus_model import ExodusModel
 import argparse
 import os
@@ -109,11 +112,26 @@ def get_parser():
         help='YAML config file specifying default values for any of this script\'s options. Values from the config are overridden by command-line flags. Use the option\'s `dest` name as the key (e.g. refine_xy, extract_i, extra_keywords).')
     parser.add_argument('-o', '--output', default = None, dest = 'output_file', help = 'File name for output')
     parser.add_argument('--filetype', default = None, dest = 'filetype',
-        choices = ['eclipse', 'leapfrog'], help = 'Explicitly state the filetype for unknown extensions')
+        choices = ['eclipse', 'egrid', 'leapfrog'], help = 'Explicitly state the filetype for unknown extensions')
     parser.add_argument('--no-nodesets', dest = 'omit_nodesets', action = 'store_true', help = 'Disable addition of nodesets')
     parser.add_argument('--no-sidesets', dest = 'omit_sidesets', action = 'store_true', help = 'Disable addition of sidesets')
     parser.add_argument('-f', '--force', dest = 'force_overwrite', action = 'store_true', help = 'Overwrite filename.e if it exists')
     parser.add_argument('-u', '--use-official-api', dest = 'use_official_api', action = 'store_true', help = 'Use exodus.py to write files')
+    parser.add_argument('--writer', dest = 'writer', default = 'netcdf4', choices = ['netcdf4', 'direct'],
+        help = 'How the built-in Exodus writer writes the file: netcdf4 through the netCDF4 package, or direct, which writes the NetCDF-3 file itself through a memory map, without the netCDF4 package or its copies of the data (default: netcdf4)')
+    parser.add_argument('--netcdf4', dest = 'netcdf4', action = 'store_true',
+        help = 'Write a NetCDF-4 (HDF5) Exodus file, with the coordinates, connectivity, sets and variables stored in compressed chunks (see --compression). Usually several times smaller than the default NetCDF-3 file.')
+    parser.add_argument('--compression', dest = 'compression', default = 'zlib', choices = ['zlib', 'szip', 'none'],
+        help = 'Compression of the chunks of a --netcdf4 file (default: zlib)')
+    parser.add_argument('--compression-level', dest = 'compression_level', default = 4, type = int,
+        choices = range(1, 10), metavar = 'N',
+        help = 'zlib compression level of a --netcdf4 file, from 1 (fastest) to 9 (smallest) (default: 4)')
+    parser.add_argument('--shuffle', dest = 'shuffle', action = 'store_true',
+        help = 'Apply the shuffle filter to the chunks of a --netcdf4 file before compressing them, which often compresses floating point values further')
+    parser.add_argument('--chunk-kb', dest = 'chunk_kb', default = 1024, type = _positive_int, metavar = 'KB',
+        help = 'Size in KB of the chunks each variable of a --netcdf4 file is stored and compressed in (default: 1024)')
+    parser.add_argument('--int64', dest = 'int64', action = 'store_true',
+        help = 'Write the connectivity, sets and ids as 64-bit integers. They are written as 32-bit integers unless the model has more nodes, elements or set entries than 32-bit integers can hold, when 64-bit integers are used anyway.')
     parser.add_argument('--flip', dest = 'flip_z', action = 'store_true', help = 'Flip the sign of the Z coordinates')
     parser.add_argument('--translate', nargs = 2, dest = 'translate', type = float, help = 'Translate the (x, y) coordinates by this amount')
     parser.add_argument('--mapaxes', dest = 'use_mapaxes', action = 'store_true', help = 'Use the MAPAXES coordinates for an Eclipse file')
@@ -134,6 +152,9 @@ def get_parser():
     parser.add_argument('--extra-keywords', nargs = '+', dest = 'extra_keywords',
         type = _eclipse_keyword, metavar = 'KEY',
         help = 'Additional per-cell property keywords to read from the grdecl file (e.g. PVTNUM EQLNUM FIPNUM). Each must be a per-cell scalar of length NX*NY*NZ. Normalised to uppercase. The reader recognises ACTNUM, SATNUM, PORO, PERMX, PERMY, PERMZ, NTG, HEATCR and THCONR by default.')
+    parser.add_argument('--integer-keywords', nargs = '+', dest = 'integer_keywords',
+        type = _eclipse_keyword, metavar = 'KEY',
+        help = 'Additional Eclipse keywords to read as integers rather than floats (e.g. region numbers requested with --extra-keywords). Integer keywords are stored in the smallest integer type that holds their values. ACTNUM and the standard region keywords (SATNUM, PVTNUM, EQLNUM, FIPNUM, ...) are integers by default.')
     parser.add_argument('--fault-sidesets', dest = 'fault_sidesets', action = 'store_true',
         help = 'Emit paired sidesets named "fault_primary" and "fault_secondary" containing the faces on either side of every fault (any internal face where adjacent cells do not share their corner nodes).')
     parser.add_argument('--convert-to-m', dest = 'convert_to_m', action = 'store_true',
@@ -144,6 +165,30 @@ def get_parser():
         help = 'Treat any non-positive element Jacobian as a fatal error and exit non-zero. By default such elements only produce a warning. Useful for CI / scripted workflows.')
     parser.add_argument('--remove-distorted', dest = 'remove_distorted', action = 'store_true',
         help = 'Remove elements with non-positive Jacobians (degenerate or inverted) from the output mesh, reporting a count of those removed. By default such elements are kept and only a warning is printed.')
+    parser.add_argument('--quality-variables', dest = 'quality_variables', nargs = '+', default = None,
+        choices = QUALITY_METRICS, metavar = 'METRIC',
+        help = 'Write mesh quality metrics of each element as element variables of the same name, to review poor elements in e.g. ParaView. METRIC is one or more of min_jacobian (the smallest of the 8 corner Jacobians), volume, aspect_ratio (longest over shortest principal axis) and skew (largest absolute cosine between the principal axes).')
+    parser.add_argument('--pore-volume', dest = 'pore_volume', action = 'store_true',
+        help = 'Write the bulk volume and pore volume (volume * PORO * NTG, with NTG 1 if absent) of each element as element variables volume and pore_volume, and print their totals over the model, each block and each --volume-regions region.')
+    parser.add_argument('--volume-regions', dest = 'volume_regions', nargs = '+', default = None,
+        type = _eclipse_keyword, metavar = 'KEY',
+        help = 'Region keywords (e.g. FIPNUM, read with --extra-keywords) to total the --pore-volume volumes by, as well as by block. Implies --pore-volume.')
+    parser.add_argument('--precision', dest = 'precision', default = 'double', choices = ['double', 'single'],
+        help = 'Floating point precision of the mesh, properties and Exodus file. single halves the memory use and file size (default: double)')
+    parser.add_argument('-j', '--jobs', dest = 'jobs', default = 1, type = _positive_int, metavar = 'N',
+        help = 'Parse the COORD, ZCORN and property blocks of an Eclipse grdecl file (and its INCLUDE files) in N parallel processes, and check for pinched elements and number the nodes of an Eclipse grid in N threads (default: 1)')
+    parser.add_argument('--slab-layers', dest = 'slab_layers', default = None, type = _positive_int, metavar = 'N',
+        help = 'Convert an Eclipse grid N layers at a time, writing the Exodus file as each slab of layers is finished, so the memory used depends on the slab size rather than the model size. For grids too large to fit in memory.')
+    parser.add_argument('--profile', dest = 'profile', action = 'store_true',
+        help = 'Print the wall time, CPU time and peak memory use of each stage of the conversion')
+    parser.add_argument('--profile-json', dest = 'profile_json', default = None, metavar = 'FILE',
+        help = 'Write the --profile report to FILE as JSON (implies --profile)')
+    parser.add_argument('--list-keywords', dest = 'list_keywords', action = 'store_true',
+        help = 'List the keywords in an Eclipse file (and any files it INCLUDEs) with their byte offsets and sizes, then exit without converting anything.')
+    parser.add_argument('--cache-dir', dest = 'cache_dir', default = None, metavar = 'DIR',
+        help = 'Cache the parsed Eclipse data in DIR. Later runs on the same (unchanged) input file, including its INCLUDE files, load the cached arrays instead of parsing the file again.')
+    parser.add_argument('--cache-max-gb', dest = 'cache_max_gb', default = 10.0, type = float, metavar = 'GB',
+        help = 'Maximum size of the --cache-dir cache in GB. The least recently used entries are removed once it is exceeded (default: 10)')
     return parser
 
 def main():
@@ -165,41 +210,139 @@ def main():
     if not args.filename:
         parser.error('filename is required (provide as a positional argument or as `filename: ...` in --config)')
 
+    # exodus.py has no way of creating a file with 64-bit integers
+    if args.use_official_api and args.int64:
+        print('--int64 is only supported by the built-in Exodus writer, so cannot be used with --use-official-api')
+        exit()
+
     # If --use-official-api is passed, then import exodus from exodus.py. Note:
     # this requires that exodus.py is in the $PYTHONPATH environment variable
     if args.use_official_api:
         from exodus import exodus
+        if args.writer != 'netcdf4':
+            print('Note: --writer is only used by the built-in Exodus writer, writing with exodus.py')
+        if args.netcdf4:
+            print('Note: --netcdf4 is only used by the built-in Exodus writer, writing a NetCDF-3 file with exodus.py')
+            args.netcdf4 = False
+    elif args.writer == 'direct' and args.netcdf4:
+        print('--writer direct only writes NetCDF-3 files, so cannot be used with --netcdf4')
+        exit()
+    elif args.writer == 'direct':
+        from pyexodus.pyexodus import exodus_direct as exodus
     else:
         from pyexodus.pyexodus import exodus
 
-    # Extract file name and extension
+    # Extract file name and extension (ignoring any compression extension,
+    # e.g. model.grdecl.gz is read as a compressed .grdecl file)
     filename = args.filename
-    filename_base, file_extension = os.path.splitext(filename)
+    filename_base, file_extension = os.path.splitext(stripCompressionExtension(filename))
 
     # Override the file extension in the input file using the --filetype argument
     if args.filetype == 'eclipse':
         file_extension = '.grdecl'
 
+    elif args.filetype == 'egrid':
+        file_extension = '.egrid'
+
     elif args.filetype == 'leapfrog':
         file_extension = ''
 
+    # Only list the keywords in the file if requested
+    if args.list_keywords:
+        if file_extension.lower() == '.grdecl':
+            keywords = eclipse.DEFAULT_KEYWORDS + tuple(args.extra_keywords or ())
+            eclipse.listKeywords(filename, keywords)
+        elif file_extension.lower() in ('.egrid', '.grid'):
+            egrid.listKeywords(filename)
+        else:
+            print('--list-keywords is only supported for Eclipse files')
+        return
+
+    # Slabs are written with the partial writes of pyexodus, and only Eclipse
+    # grids (which are layered) can be split into slabs
+    if args.slab_layers:
+        if args.use_official_api:
+            print('Note: --slab-layers is not supported by the official Exodus API, converting in memory')
+            args.slab_layers = None
+        elif file_extension.lower() not in ('.grdecl', '.egrid', '.grid'):
+            print('--slab-layers is only supported for Eclipse files')
+            exit()
+
+    # Record the time and memory use of each stage of the conversion if requested
+    profile = None
+    if args.profile or args.profile_json:
+        from readers.profiling import enableProfile
+        profile = enableProfile()
+
     # Parse the reservoir model using the appropriate reader
-    if file_extension.lower() == ".grdecl":
-        model = eclipse.parseEclipse(filename, args)
+    with stage('parse'):
+        if file_extension.lower() == ".grdecl" and args.slab_layers:
+            model = slabs.parseEclipseSlabs(filename, args)
 
-    elif file_extension == '':
-        model = leapfrog.parseLeapfrog(filename, args)
+        elif file_extension.lower() == ".grdecl":
+            model = eclipse.parseEclipse(filename, args)
 
-    else:
-        print('File extension ', file_extension, ' not supported')
-        exit()
+        elif file_extension.lower() in ('.egrid', '.grid') and args.slab_layers:
+            model = slabs.parseEclipseSlabs(filename, args, reader=egrid.readEgrid)
+
+        elif file_extension.lower() in ('.egrid', '.grid'):
+            model = eclipse.parseEclipse(filename, args, reader=egrid.readEgrid)
+
+        elif file_extension == '':
+            model = leapfrog.parseLeapfrog(filename, args)
+
+        else:
+            print('File extension ', file_extension, ' not supported')
+            exit()
+
+    # A grid converted in slabs is written slab by slab, after the rest of the file
+    slabbed = isinstance(model, slabs.SlabModel)
 
     # Mesh quality: check element Jacobians before writing the Exodus file.
     # Default is to warn but continue; --strict-jacobians upgrades to a fatal
-    # error; --no-check-jacobians skips the check entirely.
-    if getattr(args, 'check_jacobians', True):
-        from readers.reader_utils import checkElementJacobians
-        checkElementJacobians(model, strict=getattr(args, 'strict_jacobians', False))
+    # error; --no-check-jacobians skips the check entirely. (Grids converted in
+    # slabs are checked slab by slab as they are parsed.)
+    if getattr(args, 'check_jacobians', True) and not slabbed:
+        with stage('jacobian check'):
+            from readers.reader_utils import checkElementJacobians
+            checkElementJacobians(model, strict=getattr(args, 'strict_jacobians', False),
+                                  jobs=args.jobs)
+
+    # Bulk and pore volumes of the elements, with the totals used to reconcile
+    # the mesh with the simulator's pore volumes. (Grids converted in slabs
+    # find them slab by slab.)
+    if (args.pore_volume or args.volume_regions) and not slabbed:
+        with stage('volumes'):
+            from readers.volumes import poreVolumes, VolumeTotals
+            props = model.elemVars or {}
+            regions = args.volume_regions or ()
+            for keyword in regions:
+                if keyword not in props:
+                    print('--volume-regions: keyword {} was not read (add it with --extra-keywords)'.format(keyword))
+                    exit()
+
+            volume = meshQuality(model, qualityMetrics(args), jobs=args.jobs).volume
+            pore_volume = poreVolumes(volume, props)
+            totals = VolumeTotals(regions)
+            totals.add(volume, pore_volume, model.blockIds, {keyword: props[keyword] for keyword in regions})
+            totals.report()
+
+            if model.elemVars is None:
+                model.elemVars = {}
+            model.elemVars['VOLUME'] = volume
+            if pore_volume is not None:
+                model.elemVars['PORE_VOLUME'] = pore_volume
+
+    # Mesh quality metrics requested as element variables (already computed
+    # for the Jacobian check or --remove-distorted are reused). Grids converted
+    # in slabs find them slab by slab.
+    if args.quality_variables and not slabbed:
+        with stage('mesh quality'):
+            quality = meshQuality(model, qualityMetrics(args), jobs=args.jobs)
+            if model.elemVars is None:
+                model.elemVars = {}
+            for metric in args.quality_variables:
+                model.elemVars[metric.upper()] = quality.metric(metric)
 
     # After parsing the reservoir model, the Exodus file can be written
     # Model dimension (default is 3)
@@ -211,11 +354,25 @@ def main():
     numNodeSets = model.numNodeSets
     numSideSets = model.numSideSets
 
+    # Connectivity, sets and ids are written as 64-bit integers if there are
+    # more nodes, elements or set entries than 32-bit integers can hold
+    setSizes = [len(nodes) for nodes in (model.nodeSets or [])] + [len(elems) for elems in (model.sideSets or [])]
+    int64 = args.int64 or max([numNodes, numElems] + setSizes) > np.iinfo(np.int32).max
+    if int64 and args.use_official_api:
+        print('The model has more nodes, elements or set entries than 32-bit integers can hold, which exodus.py cannot write. Run without --use-official-api to write it with 64-bit integers.')
+        exit()
+
     # The number of blocks is equal to the unique numbers of block ids
-    blocks = model.blockIds
-    block_ids = np.unique(blocks)
+    if slabbed:
+        block_ids, block_sizes = model.blocks, model.blockSizes
+    else:
+        blocks = model.blockIds
+        block_ids, block_sizes = np.unique(blocks, return_counts=True)
     numBlocks = len(block_ids)
 
+    # Names of the elemental variables
+    elemVarNames = model.elemVarNames if slabbed else list(model.elemVars or ())
+
     exodusTitle = 'Converted from ' + filename + ' by em2ex.py'
 
     coordNames = ["x", "y", "z"]
@@ -235,105 +392,182 @@ def main():
         except:
             print("Cannot delete ", output_file)
 
-    # Write the exodus file using the exodus python API
-    exodusFile = exodus(output_file,
-                        'w',
-                        'numpy',
-                        exodusTitle,
-                        numDim,
-                        numNodes,
-                        numElems,
-                        numBlocks,
-                        numNodeSets,
-                        numSideSets)
-
-    exodusFile.put_coord_names(coordNames)
-    exodusFile.put_coords(model.xcoords, model.ycoords, model.zcoords)
-
-    exodusFile.put_elem_blk_names(block_ids.astype(str))
-
-    # Put all the element connectivities per block
-    for blkid in block_ids:
-        numElemsInBlock = blocks[blocks==blkid].size
-        exodusFile.put_elem_blk_info(blkid, elemType, numElemsInBlock, nodesPerElem, 0)
-        exodusFile.put_elem_connectivity(blkid, model.elemNodes[blocks.flatten()==blkid].flatten())
-
-    if not args.omit_nodesets:
-        exodusFile.put_node_set_names(model.nodeSetNames)
-
-        for i in range(numNodeSets):
-                exodusFile.put_node_set_params(i, len(model.nodeSets[i]))
-                exodusFile.put_node_set(i, model.nodeSets[i])
-
-    if not args.omit_sidesets:
-        exodusFile.put_side_set_names(model.sideSetNames)
-
-        for i in range(numSideSets):
-                exodusFile.put_side_set_params(i, len(model.sideSets[i]), 0)
-                exodusFile.put_side_set(i, model.sideSets[i], model.sideSetSides[i])
-
-    # Only want a single time step (t = 0) for this exodus file
-    timestep = 1
-    time = 0
-    exodusFile.put_time(timestep, time)
-
-    # Add any elemental reservoir properties as elemental variables
-    if model.elemVars:
-        exodusFile.set_element_variable_number(len(model.elemVars))
-
-        var_counter = 1
-        for var in model.elemVars:
-            exodusFile.put_element_variable_name(var.lower(), var_counter)
-            var_counter += 1
-
-        for blkid in block_ids:
-            for var in model.elemVars:
-                exodusFile.put_element_variable_values(blkid, var.lower(), timestep, model.elemVars[var][blocks==blkid])
-
-        # Add elemental variables to sidesets as well if required
-        if not args.omit_sidesets:
-            exodusFile.set_side_set_variable_number(len(model.elemVars))
-
-            var_counter = 1
-            for var in model.elemVars:
-                exodusFile.put_side_set_variable_name(var.lower(), var_counter)
-                var_counter += 1
-
-            # Add elemental variable values at each side in each sideset
-            for var in model.elemVars:
-                for i in range(numSideSets):
-                    exodusFile.put_side_set_variable_values(i, var.lower(), timestep, model.elemVars[var].take(np.asarray(model.sideSets[i]) - 1))
-
-    # Add any nodal variable values
-    if model.nodeVars:
-        exodusFile.set_node_variable_number(len(model.nodeVars))
-
-        var_counter = 1
-        for var in model.nodeVars:
-            exodusFile.put_node_variable_name(var.lower(), var_counter)
-            var_counter += 1
+    # Integer size and storage of a NetCDF-4 file (only passed to the
+    # built-in writer)
+    writer_options = {}
+    if not args.use_official_api:
+        writer_options['int64'] = int64
+    if args.netcdf4:
+        writer_options.update(file_format = 'NETCDF4',
+                              compression = None if args.compression == 'none' else args.compression,
+                              complevel = args.compression_level,
+                              shuffle = args.shuffle,
+                              chunk_bytes = args.chunk_kb * 1024)
 
-        for var in model.nodeVars:
-            exodusFile.put_node_variable_values(var.lower(), timestep, model.nodeVars[var])
+    # Write the exodus file using the exodus python API
+    with stage('write'):
+        exodusFile = exodus(output_file,
+                            'w',
+                            'numpy',
+                            exodusTitle,
+                            numDim,
+                            numNodes,
+                            numElems,
+                            numBlocks,
+                            numNodeSets,
+                            numSideSets,
+                            io_size = 4 if args.precision == 'single' else 8,
+                            **writer_options)
+
+        # Define the whole layout of the file - the blocks, sets, variables
+        # and their names - before writing any data, so the file is defined
+        # in one pass and each array is then written straight to its place
+        with stage('layout'):
+            exodusFile.put_coord_names(coordNames)
+            exodusFile.put_elem_blk_names(block_ids.astype(str))
+
+            for blkid, numElemsInBlock in zip(block_ids, block_sizes):
+                exodusFile.put_elem_blk_info(blkid, elemType, numElemsInBlock, nodesPerElem, 0)
+
+            if not args.omit_nodesets:
+                exodusFile.put_node_set_names(model.nodeSetNames)
 
-        # Add nodal variables to nodesets as well if required
-        if not args.omit_nodesets:
-            exodusFile.set_node_set_variable_number(len(model.nodeVars))
+                for i in range(numNodeSets):
+                        exodusFile.put_node_set_params(i, len(model.nodeSets[i]))
 
-            var_counter = 1
-            for var in model.nodeVars:
-                exodusFile.put_node_set_variable_name(var.lower(), var_counter)
-                var_counter += 1
+            if not args.omit_sidesets:
+                exodusFile.put_side_set_names(model.sideSetNames)
 
-            # Add nodal variable values at each node in each nodeset
-            for var in model.nodeVars:
+                for i in range(numSideSets):
+                        exodusFile.put_side_set_params(i, len(model.sideSets[i]), 0)
+
+            # Add any elemental reservoir properties as elemental variables
+            if elemVarNames:
+                exodusFile.set_element_variable_number(len(elemVarNames))
+
+                var_counter = 1
+                for var in elemVarNames:
+                    exodusFile.put_element_variable_name(var.lower(), var_counter)
+                    var_counter += 1
+
+                # Add elemental variables to sidesets as well if required
+                if not args.omit_sidesets:
+                    exodusFile.set_side_set_variable_number(len(elemVarNames))
+
+                    var_counter = 1
+                    for var in elemVarNames:
+                        exodusFile.put_side_set_variable_name(var.lower(), var_counter)
+                        var_counter += 1
+
+            # Add any nodal variables
+            if model.nodeVars:
+                exodusFile.set_node_variable_number(len(model.nodeVars))
+
+                var_counter = 1
+                for var in model.nodeVars:
+                    exodusFile.put_node_variable_name(var.lower(), var_counter)
+                    var_counter += 1
+
+                # Add nodal variables to nodesets as well if required
+                if not args.omit_nodesets:
+                    exodusFile.set_node_set_variable_number(len(model.nodeVars))
+
+                    var_counter = 1
+                    for var in model.nodeVars:
+                        exodusFile.put_node_set_variable_name(var.lower(), var_counter)
+                        var_counter += 1
+
+        with stage('mesh'):
+            # Put the coordinates and all the element connectivities per block
+            # (written slab by slab below for a grid converted in slabs)
+            if not slabbed:
+                exodusFile.put_coords(model.xcoords, model.ycoords, model.zcoords)
+
+                for blkid in block_ids:
+                    exodusFile.put_elem_connectivity(blkid, model.elemNodes[blocks.flatten()==blkid].flatten())
+
+        with stage('sets'):
+            if not args.omit_nodesets:
                 for i in range(numNodeSets):
-                    exodusFile.put_node_set_variable_values(i, var.lower(), timestep, model.nodeVars[var].take(np.asarray(model.nodeSets[i]) - 1))
+                        exodusFile.put_node_set(i, model.nodeSets[i])
 
-    # Finally, close the exodus file
-    exodusFile.close()
+            if not args.omit_sidesets:
+                for i in range(numSideSets):
+                        exodusFile.put_side_set(i, model.sideSets[i], model.sideSetSides[i])
+
+        with stage('variables'):
+            # Only want a single time step (t = 0) for this exodus file
+            timestep = 1
+            time = 0
+            exodusFile.put_time(timestep, time)
+
+            # Values of the elemental variables in each block (written slab
+            # by slab below for a grid converted in slabs). The built-in
+            # writer is given all of the variables at once, and exodus.py
+            # one variable of one block or set at a time.
+            if elemVarNames:
+                names = [var.lower() for var in elemVarNames]
+                if not slabbed:
+                    if args.use_official_api:
+                        for blkid in block_ids:
+                            in_block = blocks == blkid
+                            for var in model.elemVars:
+                                exodusFile.put_element_variable_values(blkid, var.lower(), timestep, model.elemVars[var][in_block])
+                    else:
+                        exodusFile.put_all_element_variable_values(timestep, {var.lower(): model.elemVars[var] for var in model.elemVars}, blocks)
+
+                # Add elemental variable values at each side in each sideset
+                if not args.omit_sidesets:
+                    for i in range(numSideSets):
+                        if slabbed:
+                            values = [model.sideSetValues(var, i) for var in elemVarNames]
+                        else:
+                            elems = np.asarray(model.sideSets[i]) - 1
+                            values = [model.elemVars[var].take(elems) for var in elemVarNames]
+
+                        if args.use_official_api:
+                            for name, var_values in zip(names, values):
+                                exodusFile.put_side_set_variable_values(i, name, timestep, var_values)
+                        else:
+                            exodusFile.put_side_set_variable_values_block(i, names, timestep, values)
+
+            # Add any nodal variable values
+            if model.nodeVars:
+                names = [var.lower() for var in model.nodeVars]
+                if args.use_official_api:
+                    for var in model.nodeVars:
+                        exodusFile.put_node_variable_values(var.lower(), timestep, model.nodeVars[var])
+                else:
+                    exodusFile.put_all_node_variable_values(timestep, {var.lower(): model.nodeVars[var] for var in model.nodeVars})
+
+                # Add nodal variable values at each node in each nodeset
+                if not args.omit_nodesets:
+                    for i in range(numNodeSets):
+                        nodes = np.asarray(model.nodeSets[i]) - 1
+                        values = [model.nodeVars[var].take(nodes) for var in model.nodeVars]
+
+                        if args.use_official_api:
+                            for name, var_values in zip(names, values):
+                                exodusFile.put_node_set_variable_values(i, name, timestep, var_values)
+                        else:
+                            exodusFile.put_node_set_variable_values_block(i, names, timestep, values)
+
+        # Write the coordinates, connectivities and elemental variables of a
+        # grid converted in slabs, one slab at a time
+        if slabbed:
+            with stage('slabs'):
+                model.writeSlabs(exodusFile, timestep)
+            model.close()
+
+        # Finally, close the exodus file
+        exodusFile.close()
 
     print('Exodus file written to {}'.format(output_file))
 
+    if profile:
+        profile.report()
+        if args.profile_json:
+            profile.writeJson(args.profile_json, input_file=filename, output_file=output_file)
+
 if __name__ == '__main__':
     main()
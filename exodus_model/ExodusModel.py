@@ -23,6 +23,7 @@ class ExodusModel(object):
         self._numElems = None
         self._numSideSets = None
         self._numNodeSets = None
+        self._quality = None
 
     # Dimension
     @property
@@ -192,3 +193,13 @@ class ExodusModel(object):
     @numNodeSets.setter
     def numNodeSets(self, num):
         self._numNodeSets = num
+
+    # Mesh quality metrics of the elements (a readers.mesh_quality.MeshQuality),
+    # computed once and shared by everything that uses them
+    @property
+    def quality(self):
+        return self._quality
+
+    @quality.setter
+    def quality(self, quality):
+        self._quality = quality
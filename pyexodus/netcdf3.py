@@ -0,0 +1,349 @@
+'''
+A minimal writer of NetCDF-3 64-bit offset (CDF-2) and 64-bit data (CDF-5)
+files
+
+This provides the parts of the netCDF4 Dataset interface that pyexodus uses
+to write an Exodus II file, without the netCDF4 package. The whole layout of
+the file (its dimensions, variables and attributes) is defined first. Then
+the header and the offsets of the variables are computed here, and the data
+are written straight into a memory map of the file: each array is converted
+to big-endian as it is copied into place, with no other copies.
+
+Only writing is supported, and nothing can be defined once the layout has
+been written (see exodus_direct in pyexodus).
+'''
+
+import numpy as np
+
+# Tags of the header lists, and the header type codes of each data type
+_NC_DIMENSION = 10
+_NC_VARIABLE = 11
+_NC_ATTRIBUTE = 12
+_NC_TYPES = {'S1': 2, 'i1': 1, 'i2': 3, 'i4': 4, 'f4': 5, 'f8': 6, 'i8': 10}
+
+# Largest size of a variable that fits its vsize header entry in a CDF-2 file
+_MAX_VSIZE = 2**32 - 4
+
+# The magic number (version) of each format
+_VERSIONS = {'NETCDF3_64BIT': 2, 'NETCDF3_64BIT_OFFSET': 2, 'NETCDF3_64BIT_DATA': 5}
+
+def _pad4(n):
+    ''' n rounded up to a multiple of 4 '''
+    return (n + 3) // 4 * 4
+
+def _dtype(datatype):
+    ''' The numpy dtype of a data type name (e.g. 'f8' or 'S1') '''
+    dtype = np.dtype(datatype)
+    key = 'S1' if dtype.kind == 'S' else dtype.kind + str(dtype.itemsize)
+    assert key in _NC_TYPES, 'Data type {} is not supported in a NetCDF-3 file'.format(datatype)
+    return dtype
+
+def _typeCode(dtype):
+    return _NC_TYPES['S1' if dtype.kind == 'S' else dtype.kind + str(dtype.itemsize)]
+
+def _attributeValues(value, version):
+    ''' The values of an attribute as a 1D array of a NetCDF-3 data type.
+    Strings are characters, and (as in netCDF4) 64-bit integers are 32 bit
+    unless the file (of format `version`) can hold them. '''
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype='S1')
+    values = np.atleast_1d(np.asarray(value))
+    if values.dtype.kind == 'i' and values.dtype.itemsize == 8 and version != 5:
+        values = values.astype(np.int32)
+    _dtype(values.dtype)
+    return values.reshape(-1)
+
+class _Header(object):
+    '''Class building the big-endian bytes of a NetCDF-3 header. Counts,
+    lengths and sizes are 64 bit in a CDF-5 file, and 32 bit otherwise.'''
+
+    def __init__(self, version):
+        self._parts = []
+        self._version = version
+
+    def raw(self, data):
+        self._parts.append(data)
+
+    def int32(self, n):
+        self._parts.append(np.array(n, dtype='>i4').tobytes())
+
+    def int64(self, n):
+        self._parts.append(np.array(n, dtype='>i8').tobytes())
+
+    def count(self, n):
+        if self._version == 5:
+            self.int64(n)
+        else:
+            self.int32(n)
+
+    def absent(self):
+        # An empty list
+        self.int32(0)
+        self.count(0)
+
+    def name(self, name):
+        data = name.encode('utf-8')
+        self.count(len(data))
+        self.raw(data + b'\0' * (_pad4(len(data)) - len(data)))
+
+    def attributes(self, attributes):
+        if not attributes:
+            self.absent()
+            return
+        self.int32(_NC_ATTRIBUTE)
+        self.count(len(attributes))
+        for name, values in attributes.items():
+            self.name(name)
+            self.int32(_typeCode(values.dtype))
+            self.count(len(values))
+            data = values.astype(values.dtype.newbyteorder('>')).tobytes()
+            self.raw(data + b'\0' * (_pad4(len(data)) - len(data)))
+
+    def tobytes(self):
+        return b''.join(self._parts)
+
+class Dimension(object):
+    '''Class holding a dimension of the file (size None if unlimited)'''
+
+    def __init__(self, dataset, name, size):
+        self._dataset = dataset
+        self.name = name
+        self._size = size
+
+    def isunlimited(self):
+        return self._size is None
+
+    @property
+    def size(self):
+        return self._dataset._numrecs if self._size is None else self._size
+
+class Variable(object):
+    '''Class holding a variable of the file. Values are written with
+    variable[key] = values, as in netCDF4, and other attributes set on it
+    are written as netCDF attributes.'''
+
+    def __init__(self, dataset, name, dtype, dimensions):
+        self.__dict__.update(_dataset=dataset, name=name, dtype=dtype,
+                             dimensions=dimensions, _attributes={})
+        self.__dict__.update(_begin=None, _vsize=None)
+
+    def __setattr__(self, name, value):
+        self.setncattr(name, value)
+
+    def setncattr(self, name, value):
+        assert self._dataset.defining, 'Attributes must be set before the layout is written'
+        self._attributes[name] = _attributeValues(value, self._dataset._version)
+
+    def ncattrs(self):
+        return list(self._attributes)
+
+    @property
+    def isrecord(self):
+        return bool(self.dimensions) and self._dataset.dimensions[self.dimensions[0]].isunlimited()
+
+    @property
+    def shape(self):
+        return tuple(self._dataset.dimensions[d].size for d in self.dimensions)
+
+    @property
+    def _itemShape(self):
+        # Shape of the variable in a single record (or all of it if fixed)
+        dims = self.dimensions[1:] if self.isrecord else self.dimensions
+        return tuple(self._dataset.dimensions[d].size for d in dims)
+
+    @property
+    def _nbytes(self):
+        return int(np.prod(self._itemShape, dtype=np.int64)) * self.dtype.itemsize
+
+    def __setitem__(self, key, values):
+        dataset = self._dataset
+        assert not dataset.defining, 'Values can only be written once the layout has been defined'
+
+        if self.isrecord:
+            # Add any records written to for the first time
+            first = key[0] if isinstance(key, tuple) else key
+            if isinstance(first, slice):
+                end = first.stop if first.stop is not None else dataset._numrecs
+            else:
+                end = first + 1
+            dataset._addRecords(end)
+
+        dataset._array(self)[key] = values
+
+class Dataset(object):
+    '''
+    A NetCDF-3 64-bit offset (format NETCDF3_64BIT) or 64-bit data
+    (NETCDF3_64BIT_DATA, which also holds 64-bit integers) file being
+    written, with the netCDF4 Dataset methods that pyexodus uses. The layout
+    is defined until end_definitions(), which writes the header and maps the
+    file so the values of the variables can be written.
+    '''
+
+    def __init__(self, filename, mode='w', format='NETCDF3_64BIT'):
+        assert mode == 'w', 'Mode must be w (to write)'
+        assert format in _VERSIONS, 'Only NETCDF3_64BIT and NETCDF3_64BIT_DATA files can be written'
+
+        self.__dict__.update(_version=_VERSIONS[format], _filename=filename, _dimensions={}, _variables={}, _attributes={})
+        self.__dict__.update(_defining=True, _numrecs=0, _recsize=0, _file=None, _map=None)
+
+    def __setattr__(self, name, value):
+        self.setncattr(name, value)
+
+    def setncattr(self, name, value):
+        assert self._defining, 'Attributes must be set before the layout is written'
+        self._attributes[name] = _attributeValues(value, self._version)
+
+    def ncattrs(self):
+        return list(self._attributes)
+
+    @property
+    def dimensions(self):
+        return self._dimensions
+
+    @property
+    def variables(self):
+        return self._variables
+
+    @property
+    def defining(self):
+        return self._defining
+
+    def set_fill_off(self):
+        # The data are never filled with fill values: every value is written
+        return
+
+    def createDimension(self, name, size=None):
+        assert self._defining, 'Dimension {} defined after the layout was written'.format(name)
+        assert name not in self._dimensions, 'Dimension {} already defined'.format(name)
+        if size is None:
+            assert not any(d.isunlimited() for d in self._dimensions.values()), 'Only one dimension can be unlimited'
+        self._dimensions[name] = Dimension(self, name, size)
+        return self._dimensions[name]
+
+    def createVariable(self, name, datatype, dimensions=(), fill_value=None):
+        assert self._defining, 'Variable {} defined after the layout was written'.format(name)
+        assert name not in self._variables, 'Variable {} already defined'.format(name)
+
+        if isinstance(dimensions, str):
+            dimensions = (dimensions,)
+        dimensions = tuple(dimensions)
+        for i, d in enumerate(dimensions):
+            assert d in self._dimensions, 'Dimension {} not defined'.format(d)
+            assert i == 0 or not self._dimensions[d].isunlimited(), 'Only the first dimension can be unlimited'
+
+        var = Variable(self, name, _dtype(datatype), dimensions)
+        assert var.dtype.itemsize < 8 or var.dtype.kind == 'f' or self._version == 5, \
+            '64-bit integers need a NETCDF3_64BIT_DATA file'
+        if fill_value is not None:
+            var.setncattr('_FillValue', np.array(fill_value, dtype=var.dtype))
+        self._variables[name] = var
+        return var
+
+    def begin_definitions(self):
+        # The layout is defined until end_definitions() anyway
+        return
+
+    def _header(self):
+        ''' The header of the file, with the current offsets of the variables '''
+        header = _Header(self._version)
+        header.raw(b'CDF' + bytes([self._version]))
+        header.count(self._numrecs)
+
+        if self._dimensions:
+            header.int32(_NC_DIMENSION)
+            header.count(len(self._dimensions))
+            for dim in self._dimensions.values():
+                header.name(dim.name)
+                header.count(0 if dim.isunlimited() else dim.size)
+        else:
+            header.absent()
+
+        header.attributes(self._attributes)
+
+        dim_ids = {name: i for i, name in enumerate(self._dimensions)}
+        if self._variables:
+            header.int32(_NC_VARIABLE)
+            header.count(len(self._variables))
+            for var in self._variables.values():
+                header.name(var.name)
+                header.count(len(var.dimensions))
+                for d in var.dimensions:
+                    header.count(dim_ids[d])
+                header.attributes(var._attributes)
+                header.int32(_typeCode(var.dtype))
+                vsize = var._vsize or 0
+                header.count(vsize if self._version == 5 else min(vsize, _MAX_VSIZE))
+                header.int64(var._begin or 0)
+        else:
+            header.absent()
+
+        return header.tobytes()
+
+    def end_definitions(self):
+        ''' Lay out the variables after the header (the fixed size variables
+        in the order they were defined, then the records of the record
+        variables), write the header and map the file '''
+        if not self._defining:
+            return
+
+        fixed = [v for v in self._variables.values() if not v.isrecord]
+        records = [v for v in self._variables.values() if v.isrecord]
+        for var in self._variables.values():
+            # A single record variable isn't padded between records
+            var.__dict__['_vsize'] = var._nbytes if records == [var] else _pad4(var._nbytes)
+
+        offset = _pad4(len(self._header()))
+        for var in fixed:
+            var.__dict__['_begin'] = offset
+            offset += var._vsize
+        recsize = 0
+        for var in records:
+            var.__dict__['_begin'] = offset + recsize
+            recsize += var._vsize
+
+        self.__dict__.update(_defining=False, _recsize=recsize, _begin_rec=offset)
+        self.__dict__['_file'] = open(self._filename, 'w+b')
+        self._file.write(self._header())
+        self._resize()
+
+    def _size(self):
+        return self._begin_rec + self._recsize * self._numrecs
+
+    def _resize(self):
+        # (Re)map the whole file at its current size
+        self.__dict__['_map'] = None
+        self._file.truncate(self._size())
+        self._file.flush()
+        if self._size() > 0:
+            self.__dict__['_map'] = np.memmap(self._file, dtype=np.uint8, mode='r+', shape=(self._size(),))
+
+    def _addRecords(self, numrecs):
+        ''' Extend the file to hold at least numrecs records '''
+        if numrecs > self._numrecs:
+            if self._map is not None:
+                self._map.flush()
+            self.__dict__['_numrecs'] = numrecs
+            self._resize()
+            numrecs = np.array(numrecs, dtype='>i8' if self._version == 5 else '>i4')
+            self._map[4:4 + numrecs.itemsize] = np.frombuffer(numrecs.tobytes(), dtype=np.uint8)
+
+    def _array(self, var):
+        ''' A big-endian array over the values of var in the memory map '''
+        dtype = var.dtype if var.dtype.kind == 'S' else var.dtype.newbyteorder('>')
+        shape = var._itemShape
+        strides = tuple(int(np.prod(shape[i + 1:], dtype=np.int64)) * dtype.itemsize
+                        for i in range(len(shape)))
+        if var.isrecord:
+            shape = (self._numrecs,) + shape
+            strides = (self._recsize,) + strides
+        return np.ndarray(shape, dtype=dtype, buffer=self._map, offset=var._begin, strides=strides)
+
+    def close(self):
+        if self._defining:
+            self.end_definitions()
+        if self._map is not None:
+            self._map.flush()
+        self.__dict__['_map'] = None
+        self._file.close()
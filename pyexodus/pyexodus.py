@@ -1,5 +1,84 @@
-from netCDF4 import Dataset
+import re
 import numpy as np
+from pyexodus import netcdf3
+
+try:
+    from netCDF4 import Dataset, __version__ as _netcdf4_version
+except ImportError:
+    # Without netCDF4, only exodus_direct can write files
+    Dataset = None
+
+# The netCDF4 versions (from, up to but not including) whose Dataset has been
+# tested to leave define mode through its private _enddef method, which
+# _Dataset overrides. Other versions are used as they are, so work but define
+# the layout of a NETCDF3 file in time quadratic in its number of variables.
+_NETCDF4_VERSIONS = ((1, 5), (1, 8))
+
+def _version(version):
+    ''' The (major, minor) numbers of a version string '''
+    return tuple(int(n) for n in re.findall(r'\d+', version)[:2])
+
+if Dataset is not None:
+    _OVERRIDE_ENDDEF = hasattr(Dataset, '_enddef') and \
+        _NETCDF4_VERSIONS[0] <= _version(_netcdf4_version) < _NETCDF4_VERSIONS[1]
+
+    class _Dataset(Dataset):
+        '''
+        A netCDF4 Dataset that stays in define mode until told otherwise
+
+        netCDF4 leaves define mode after every dimension, variable and attribute
+        it defines in a NETCDF3 file. Each time the header has grown, the netCDF
+        library then moves all of the variables defined so far along the file,
+        so defining many variables takes time quadratic in their number (even
+        before any data is written). netCDF4 has no public way of staying in
+        define mode, so here its _enddef calls are skipped while defining, and
+        define mode is only left at end_definitions() once begin_definitions()
+        has been called, so the whole layout is defined in one pass. This is
+        only done for the tested netCDF4 versions (_NETCDF4_VERSIONS).
+        '''
+
+        # The flag is kept in the instance's __dict__ (netCDF4 stores attributes
+        # set as usual as netCDF attributes)
+        @property
+        def defining(self):
+            return self.__dict__.get('_defining', False)
+
+        def begin_definitions(self):
+            self.__dict__['_defining'] = True
+
+        def end_definitions(self):
+            self.__dict__['_defining'] = False
+            if _OVERRIDE_ENDDEF:
+                Dataset._enddef(self)
+
+        def _enddef(self):
+            if not (self.defining and _OVERRIDE_ENDDEF):
+                Dataset._enddef(self)
+
+# int64_status of a file storing all of its integers as 64-bit integers
+# (EX_ALL_INT64_DB: maps, entity ids and bulk data such as connectivity)
+_EX_ALL_INT64_DB = 0x1C00
+
+# Largest node, element or set entry count that 32-bit integers can hold
+_MAX_INT32 = np.iinfo(np.int32).max
+
+# The block or set kind, description and id label of each kind of variable,
+# and the names of the variable holding its values and of its dimension
+# (given the 1-based indices of the variable and of its block or set)
+_VALUES = {
+    'elem': ('eb', 'element', 'Block', 'vals_elem_var{}eb{}', 'num_el_in_blk{}'),
+    'sset': ('ss', 'sideset', 'Sideset', 'vals_sset_var{}ss{}', 'num_side_ss{}'),
+    'nod': (None, 'nodal', None, 'vals_nod_var{}', 'num_nodes'),
+    'nset': ('ns', 'nodeset', 'Nodeset', 'vals_nset_var{}ns{}', 'num_nod_ns{}'),
+}
+
+def _char_table(names, num_names, length):
+    ''' The netCDF character array of shape (num_names, length) of `names`,
+    padded with null characters '''
+    table = np.zeros((num_names, length), dtype='S1')
+    for i, name in enumerate(names):
+        table[i, 0:len(name)] = [c for c in name]
+    return table
 
 class exodus(object):
     '''
@@ -9,28 +88,102 @@ class exodus(object):
     and contains only the functionality required by em2ex. It allows
     em2ex to be used even if Exodus isn't installed (by itself or as part
     of the SEACAS package).
+
+    The file is written in two phases. The put_* calls defining the layout
+    of the file (the blocks, sets, variables and their names) are only
+    recorded until the first call writing any data (coordinates,
+    connectivity, sets, times or variable values). Then every dimension and
+    variable is defined at once, the recorded names and ids are written,
+    and each array is then written once, straight to its place in the file.
+    Calls defining the layout after data has been written still work, but
+    each one can move all of the data written so far along the file.
+
+    The file is a NetCDF-3 64-bit offset file, or with file_format NETCDF4 a
+    NetCDF-4 (HDF5) file whose coordinates, connectivity, sets and variable
+    values are stored in chunks of about chunk_bytes, compressed with zlib
+    (at level complevel) or szip, optionally after the shuffle filter.
+
+    The connectivity, sets and ids are 32-bit integers, or 64-bit integers
+    with int64 (by default, if there are more nodes or elements than 32-bit
+    integers can hold), in which case the file's int64_status marks it as
+    such and a NetCDF-3 file uses the 64-bit data (CDF-5) format.
+
+    Besides the put_*_variable_values calls of the official API, which write
+    one variable at a time, the values of several variables can be written
+    at once: those of a block or set as a (num_vars, num_entries) array with
+    the put_*_variable_values_block calls, and those of all of the elements
+    or nodes as a dict of arrays by variable name with the put_all_* calls.
+    The variables are looked up once for all of them, and the values of each
+    variable are written in one piece.
     '''
 
     def __init__(self, file, mode='w', array_type='numpy', title=None,
                  numDims=None, numNodes=None, numElems=None, numBlocks=None,
-                 numNodeSets=None, numSideSets=None):
+                 numNodeSets=None, numSideSets=None, io_size=0,
+                 file_format='NETCDF3_64BIT', compression='zlib', complevel=4,
+                 shuffle=False, chunk_bytes=1 << 20, int64=None):
 
         assert mode in ['w'], 'Mode must be w (to write)'
         assert array_type == 'numpy', 'array_type must be numpy'
         assert numDims in [1, 2, 3], 'numDims must be 1, 2 or 3'
-
-        # Open the netCDF4 file for reading/writing
-        self._rootgrp = Dataset(file, mode, format = 'NETCDF3_64BIT')
+        assert io_size in [0, 4, 8], 'io_size must be 0 (default), 4 or 8'
+        assert file_format in ['NETCDF3_64BIT', 'NETCDF4'], 'file_format must be NETCDF3_64BIT or NETCDF4'
+        assert compression in [None, 'zlib', 'szip'], 'compression must be None, zlib or szip'
+
+        # Connectivity, sets and ids are stored as integers: 32-bit, or 64-bit
+        # if int64 (by default, if there are too many nodes or elements for
+        # 32-bit integers). Only the CDF-5 NetCDF-3 format and the (non
+        # classic) NetCDF-4 format hold 64-bit integers
+        if int64 is None:
+            int64 = max(numNodes or 0, numElems or 0) > _MAX_INT32
+        self._int64 = int64
+        self._int_type = 'i8' if int64 else 'i4'
+
+        # A NETCDF4 (HDF5) file is written in the classic data model (unless
+        # int64), as the Exodus library does, with its bulk data variables
+        # split into chunks of about chunk_bytes, each compressed with the
+        # given filters
+        if file_format == 'NETCDF4':
+            self._file_format = 'NETCDF4' if int64 else 'NETCDF4_CLASSIC'
+        else:
+            self._file_format = 'NETCDF3_64BIT_DATA' if int64 else file_format
+        self._chunk_bytes = chunk_bytes
+        self._filters = {}
+        if file_format == 'NETCDF4':
+            self._filters['shuffle'] = shuffle
+            if compression == 'zlib':
+                self._filters.update(compression = 'zlib', complevel = complevel)
+            elif compression == 'szip':
+                self._filters.update(compression = 'szip', szip_coding = 'nn', szip_pixels_per_block = 8)
+
+        # Floating point word size of the file: 4 (single) or 8 (double,
+        # the default, as for io_size = 0 in the official API)
+        self._word_size = 4 if io_size == 4 else 8
+        self._float_type = 'f{}'.format(self._word_size)
+
+        # Open the netCDF file for writing. Every array is written in
+        # full, so the file doesn't need to be filled with fill values first
+        self._rootgrp = self._open(file, mode)
+        self._rootgrp.set_fill_off()
+        self._rootgrp.begin_definitions()
+
+        # The layout of the file, kept here rather than read back from it:
+        # the ids of the blocks, sidesets and nodesets in the order they are
+        # defined, the names of each kind of variable, and the small arrays
+        # to write once the layout has been defined (by netCDF variable name)
+        self._ids = {'eb': [], 'ss': [], 'ns': []}
+        self._var_names = {}
+        self._pending = {}
 
         if mode == 'w':
             # Write global attributes
             self._rootgrp.title = title
             self._rootgrp.version = np.float32(7.16)
             self._rootgrp.api_version = np.float32(7.16)
-            self._rootgrp.floating_point_word_size = np.int32(8)
+            self._rootgrp.floating_point_word_size = np.int32(self._word_size)
             self._rootgrp.maximum_name_length = np.int32(32)
             self._rootgrp.file_size = 1
-            self._rootgrp.int64_status = 0
+            self._rootgrp.int64_status = np.int32(_EX_ALL_INT64_DB if int64 else 0)
 
             # Create dimensions
             self._rootgrp.createDimension('len_string', 32)
@@ -42,38 +195,161 @@ class exodus(object):
             self._rootgrp.createDimension('time_step', None)
 
             # Create variables
-            self._rootgrp.createVariable('time_whole', 'f8', 'time_step')
+            self._rootgrp.createVariable('time_whole', self._float_type, 'time_step')
             self._rootgrp.createVariable('coor_names', 'S1', ('num_dim', 'len_name'))
-            self._rootgrp.createVariable('coordx', 'f8', ('num_nodes'))
-            self._rootgrp.createVariable('coordy', 'f8', ('num_nodes'))
-            self._rootgrp.createVariable('coordz', 'f8', ('num_nodes'))
+            self._create_variable('coordx', self._float_type, ('num_nodes'))
+            self._create_variable('coordy', self._float_type, ('num_nodes'))
+            self._create_variable('coordz', self._float_type, ('num_nodes'))
             self._rootgrp.createVariable('eb_status', 'i4', 'num_el_blk', fill_value = 0)
-            self._rootgrp.createVariable('eb_prop1', 'i4', 'num_el_blk')
+            self._rootgrp.createVariable('eb_prop1', self._int_type, 'num_el_blk')
             self._rootgrp.variables['eb_prop1'].setncattr('name', 'ID')
             self._rootgrp.createVariable('eb_names', 'S1', ('num_el_blk', 'len_name'))
+            self._put_ids('eb')
+            self._put_names('eb_names', [])
 
 
             if numSideSets:
                 self._rootgrp.createDimension('num_side_sets', numSideSets)
                 self._rootgrp.createVariable('ss_status', 'i4', 'num_side_sets', fill_value = 0)
-                self._rootgrp.createVariable('ss_prop1', 'i4', 'num_side_sets')
+                self._rootgrp.createVariable('ss_prop1', self._int_type, 'num_side_sets')
                 self._rootgrp.variables['ss_prop1'].setncattr('name', 'ID')
                 self._rootgrp.createVariable('ss_names', 'S1', ('num_side_sets', 'len_name'))
+                self._put_ids('ss')
+                self._put_names('ss_names', [])
 
             if numNodeSets:
                 self._rootgrp.createDimension('num_node_sets', numNodeSets)
                 self._rootgrp.createVariable('ns_status', 'i4', 'num_node_sets', fill_value = 0)
-                self._rootgrp.createVariable('ns_prop1', 'i4', 'num_node_sets')
+                self._rootgrp.createVariable('ns_prop1', self._int_type, 'num_node_sets')
                 self._rootgrp.variables['ns_prop1'].setncattr('name', 'ID')
                 self._rootgrp.createVariable('ns_names', 'S1', ('num_node_sets', 'len_name'))
+                self._put_ids('ns')
+                self._put_names('ns_names', [])
+
+    def _open(self, file, mode):
+
+        # The netCDF file to write
+        assert Dataset is not None, 'The netCDF4 package is needed to write Exodus files with exodus (or use exodus_direct)'
+        return _Dataset(file, mode, format = self._file_format)
+
+    def _create_variable(self, var_name, datatype, dimensions):
+
+        # A variable holding bulk data (coordinates, connectivity, sets or
+        # variable values), chunked and compressed in a NETCDF4 file
+        if self._file_format.startswith('NETCDF3'):
+            return self._rootgrp.createVariable(var_name, datatype, dimensions)
+
+        return self._rootgrp.createVariable(var_name, datatype, dimensions,
+                                            chunksizes = self._chunks(datatype, dimensions),
+                                            **self._filters)
+
+    def _chunks(self, datatype, dimensions):
+
+        # Chunk sizes of a variable: a single record (time step), and as many
+        # entries (e.g. nodes or elements) as fill about chunk_bytes, with all
+        # of any further dimensions (e.g. the nodes of each element)
+        if isinstance(dimensions, str):
+            dimensions = (dimensions,)
+        dims = [self._rootgrp.dimensions[d] for d in dimensions]
+        chunks = [1 if d.isunlimited() else d.size for d in dims]
+
+        first = 1 if dims[0].isunlimited() else 0
+        if first < len(dims):
+            entry_bytes = np.dtype(datatype).itemsize * int(np.prod(chunks[first + 1:], dtype=np.int64))
+            chunks[first] = max(1, min(chunks[first], self._chunk_bytes // entry_bytes))
+
+        return chunks
+
+    def _put(self, var_name, values):
+
+        # Write values to the whole of a variable now, or once the layout has
+        # been defined
+        if self._rootgrp.defining:
+            self._pending[var_name] = values
+        else:
+            self._rootgrp.variables[var_name][:] = values
+
+        return
+
+    def _put_names(self, var_name, names):
+
+        var = self._rootgrp.variables[var_name]
+        self._put(var_name, _char_table(names, *var.shape))
+
+        return
+
+    def _put_ids(self, kind):
+
+        # The status (1 for each one defined) and ids of the blocks, sidesets
+        # or nodesets
+        ids = self._ids[kind]
+        size = self._rootgrp.variables['{}_prop1'.format(kind)].shape[0]
+        status = np.zeros(size, dtype=np.int32)
+        status[:len(ids)] = 1
+        prop1 = np.zeros(size, dtype=self._int_type)
+        prop1[:len(ids)] = ids
+
+        self._put('{}_status'.format(kind), status)
+        self._put('{}_prop1'.format(kind), prop1)
+
+        return
+
+    def _index(self, kind, id):
+
+        # The 0-based index of block, sideset or nodeset `id`
+        return self._ids[kind].index(id)
+
+    def _end_definitions(self):
+
+        # Define the variables holding the values of the element, sideset,
+        # nodal and nodeset variables (in the order em2ex writes them), leave
+        # define mode, and write the recorded names and ids in file order
+        if not self._rootgrp.defining:
+            return
+
+        num_blocks = len(self._ids['eb'])
+        for idx in range(num_blocks):
+            for var_idx in range(len(self._var_names.get('elem', ()))):
+                self._create_values('vals_elem_var{}eb{}'.format(var_idx + 1, idx + 1),
+                                    'num_el_in_blk{}'.format(idx + 1))
+
+        for var_idx in range(len(self._var_names.get('sset', ()))):
+            for idx in range(len(self._ids['ss'])):
+                self._create_values('vals_sset_var{}ss{}'.format(var_idx + 1, idx + 1),
+                                    'num_side_ss{}'.format(idx + 1))
+
+        for var_idx in range(len(self._var_names.get('nod', ()))):
+            self._create_values('vals_nod_var{}'.format(var_idx + 1), 'num_nodes')
+
+        for var_idx in range(len(self._var_names.get('nset', ()))):
+            for idx in range(len(self._ids['ns'])):
+                self._create_values('vals_nset_var{}ns{}'.format(var_idx + 1, idx + 1),
+                                    'num_nod_ns{}'.format(idx + 1))
+
+        self._rootgrp.end_definitions()
+
+        order = list(self._rootgrp.variables)
+        for var_name in sorted(self._pending, key=order.index):
+            self._rootgrp.variables[var_name][:] = self._pending[var_name]
+        self._pending = {}
+
+        return
+
+    def _create_values(self, var_name, dim_name):
+
+        # The variable holding values over dimension dim_name, created if it
+        # doesn't exist yet
+        if var_name not in self._rootgrp.variables:
+            self._create_variable(var_name, self._float_type, ('time_step', dim_name))
+
+        return self._rootgrp.variables[var_name]
 
     def put_coord_names(self, names):
 
         num_dim = self._rootgrp.dimensions['num_dim'].size
         assert len(names) == num_dim, 'The length of the names array must be equal to the number of dimensions'
 
-        for i in range(num_dim):
-            self._rootgrp.variables['coor_names'][i, 0:len(names[i])] = [c for c in names[i]]
+        self._put_names('coor_names', names)
 
         return
 
@@ -83,13 +359,30 @@ class exodus(object):
         assert len(ycoords) == self._rootgrp.dimensions['num_nodes'].size, 'Number of Y coords must be equal to numNodes'
         assert len(zcoords) == self._rootgrp.dimensions['num_nodes'].size, 'Number of Z coords must be equal to numNodes'
 
+        self._end_definitions()
         self._rootgrp.variables['coordx'][:] = xcoords
         self._rootgrp.variables['coordy'][:] = ycoords
         self._rootgrp.variables['coordz'][:] = zcoords
 
         return
 
+    def put_partial_coords(self, start, xcoords, ycoords, zcoords):
+
+        # Coordinates of the nodes numbered start to start + len(xcoords) - 1 (1-based)
+        num_nodes = self._rootgrp.dimensions['num_nodes'].size
+        assert len(xcoords) == len(ycoords) == len(zcoords), 'Number of X, Y and Z coords must be equal'
+        assert start >= 1 and start - 1 + len(xcoords) <= num_nodes, 'Nodes must be in the range 1 to numNodes'
+
+        self._end_definitions()
+        end = start - 1 + len(xcoords)
+        self._rootgrp.variables['coordx'][start - 1:end] = xcoords
+        self._rootgrp.variables['coordy'][start - 1:end] = ycoords
+        self._rootgrp.variables['coordz'][start - 1:end] = zcoords
+
+        return
+
     def put_time(self, step, value):
+        self._end_definitions()
         self._rootgrp.variables['time_whole'][step - 1] = value
         return
 
@@ -98,22 +391,19 @@ class exodus(object):
         num_el_blk = self._rootgrp.dimensions['num_el_blk'].size
         assert len(names) == num_el_blk, 'The length of the names array must be equal to the number of blocks'
 
-        for i in range(num_el_blk):
-            self._rootgrp.variables['eb_names'][i, 0:len(names[i])] = [c for c in names[i]]
+        self._put_names('eb_names', names)
 
         return
 
     def put_elem_blk_info(self, blk_id, elem_type, num_blk_elems, num_elem_nodes, num_elem_attrs):
 
         assert num_elem_attrs == 0, 'No element attributes are used (num_elem_attrs must be 0)'
+        assert len(self._ids['eb']) < self._rootgrp.dimensions['num_el_blk'].size, 'All blocks have already been defined'
 
-        # Find first free position in eb_status (first 0 value)
-        eb_status = self._rootgrp.variables['eb_status']
-        eb_status.set_auto_mask(False)
-        idx = np.where(eb_status[:] == 0)[0][0]
-
-        self._rootgrp.variables['eb_status'][idx] = 1
-        self._rootgrp.variables['eb_prop1'][idx] = blk_id
+        # The block goes in the first free position
+        idx = len(self._ids['eb'])
+        self._ids['eb'].append(blk_id)
+        self._put_ids('eb')
 
         num_elem_in_blk_name = 'num_el_in_blk{}'.format(idx + 1)
         num_nodes_per_elem_name = 'num_nod_per_el{}'.format(idx + 1)
@@ -121,17 +411,17 @@ class exodus(object):
         self._rootgrp.createDimension(num_nodes_per_elem_name, num_elem_nodes)
 
         var_name = 'connect{}'.format(idx + 1)
-        self._rootgrp.createVariable(var_name, 'f8', (num_elem_in_blk_name, num_nodes_per_elem_name))
+        self._create_variable(var_name, self._int_type, (num_elem_in_blk_name, num_nodes_per_elem_name))
         self._rootgrp.variables[var_name].elem_type = str(elem_type).upper()
 
         return
 
     def put_elem_connectivity(self, blk_id, connectivity):
 
-        assert blk_id in self._rootgrp.variables['eb_prop1'][:], 'blk_id not in list of block ids'
+        assert blk_id in self._ids['eb'], 'blk_id not in list of block ids'
 
         # Get idx corresponding to blk_id
-        idx = np.where(self._rootgrp.variables['eb_prop1'][:] == blk_id)[0][0]
+        idx = self._index('eb', blk_id)
 
         num_elem_in_blk_name = 'num_el_in_blk{}'.format(idx + 1)
         num_nodes_per_elem_name = 'num_nod_per_el{}'.format(idx + 1)
@@ -139,18 +429,38 @@ class exodus(object):
         num_nodes_per_elem = self._rootgrp.dimensions[num_nodes_per_elem_name].size
         assert connectivity.size == num_elem_in_blk * num_nodes_per_elem, 'Incorrect number of nodes in connectivity'
 
+        self._end_definitions()
         var_name = 'connect{}'.format(idx + 1)
         self._rootgrp.variables[var_name][:] = connectivity.reshape(num_elem_in_blk, num_nodes_per_elem)
 
         return
 
+    def put_partial_elem_connectivity(self, blk_id, start, connectivity):
+
+        assert blk_id in self._ids['eb'], 'blk_id not in list of block ids'
+
+        # Get idx corresponding to blk_id
+        idx = self._index('eb', blk_id)
+
+        # Connectivity of the elements numbered start to start + n - 1 (1-based) in the block
+        num_elem_in_blk = self._rootgrp.dimensions['num_el_in_blk{}'.format(idx + 1)].size
+        num_nodes_per_elem = self._rootgrp.dimensions['num_nod_per_el{}'.format(idx + 1)].size
+        assert connectivity.size % num_nodes_per_elem == 0, 'Incorrect number of nodes in connectivity'
+        num_elems = connectivity.size // num_nodes_per_elem
+        assert start >= 1 and start - 1 + num_elems <= num_elem_in_blk, 'Elements must be in the block'
+
+        self._end_definitions()
+        var_name = 'connect{}'.format(idx + 1)
+        self._rootgrp.variables[var_name][start - 1:start - 1 + num_elems] = connectivity.reshape(num_elems, num_nodes_per_elem)
+
+        return
+
     def put_side_set_names(self, names):
 
         num_side_sets = self._rootgrp.dimensions['num_side_sets'].size
         assert len(names) == num_side_sets, 'The length of the names array must be equal to the number of sidesets'
 
-        for i in range(num_side_sets):
-            self._rootgrp.variables['ss_names'][i, 0:len(names[i])] = [c for c in names[i]]
+        self._put_names('ss_names', names)
 
         return
 
@@ -159,71 +469,59 @@ class exodus(object):
         num_node_sets = self._rootgrp.dimensions['num_node_sets'].size
         assert len(names) == num_node_sets, 'The length of the names array must be equal to the number of nodesets'
 
-        for i in range(num_node_sets):
-            self._rootgrp.variables['ns_names'][i, 0:len(names[i])] = [c for c in names[i]]
+        self._put_names('ns_names', names)
 
         return
 
     def put_side_set_params(self, id, num_side_set_elems, num_side_sets_dist_factor = 0):
 
         assert num_side_sets_dist_factor == 0, 'num_side_sets_dist_factor not used'
-        assert id not in self._rootgrp.variables['ss_prop1'][:], 'Sideset id {} already in use'.format(id)
+        assert id not in self._ids['ss'], 'Sideset id {} already in use'.format(id)
 
-        # Find first free position in ss_status (first 0 value)
-        ss_status = self._rootgrp.variables['ss_status']
-        ss_status.set_auto_mask(False)
-        idx = np.where(ss_status[:] == 0)[0][0]
-
-        self._rootgrp.variables['ss_status'][idx] = 1
-        self._rootgrp.variables['ss_prop1'][idx] = id
+        # The sideset goes in the first free position
+        idx = len(self._ids['ss'])
+        self._ids['ss'].append(id)
+        self._put_ids('ss')
 
         num_side_ss_name = 'num_side_ss{}'.format(idx + 1)
         elem_ss_name = 'elem_ss{}'.format(idx + 1)
         side_ss_name = 'side_ss{}'.format(idx + 1)
 
         self._rootgrp.createDimension(num_side_ss_name, num_side_set_elems)
-        self._rootgrp.createVariable(elem_ss_name, 'i4', num_side_ss_name)
-        self._rootgrp.createVariable(side_ss_name, 'i4', num_side_ss_name)
-
-        self._rootgrp.variables['ss_status'][idx] = 1
-        self._rootgrp.variables['ss_prop1'][idx] = id
+        self._create_variable(elem_ss_name, self._int_type, num_side_ss_name)
+        self._create_variable(side_ss_name, self._int_type, num_side_ss_name)
 
         return
 
     def put_node_set_params(self, id, num_node_set_nodes, num_node_sets_dist_factor = 0):
 
         assert num_node_sets_dist_factor == 0, 'num_node_sets_dist_factor not used'
-        assert id not in self._rootgrp.variables['ns_prop1'][:], 'Nodeset id {} already in use'.format(id)
+        assert id not in self._ids['ns'], 'Nodeset id {} already in use'.format(id)
 
-        # Find first free position in ss_status (first 0 value)
-        ns_status = self._rootgrp.variables['ns_status']
-        ns_status.set_auto_mask(False)
-        idx = np.where(ns_status[:] == 0)[0][0]
-
-        self._rootgrp.variables['ns_status'][idx] = 1
-        self._rootgrp.variables['ns_prop1'][idx] = id
+        # The nodeset goes in the first free position
+        idx = len(self._ids['ns'])
+        self._ids['ns'].append(id)
+        self._put_ids('ns')
 
         num_node_ns_name = 'num_nod_ns{}'.format(idx + 1)
         node_ns_name = 'node_ns{}'.format(idx + 1)
 
         self._rootgrp.createDimension(num_node_ns_name, num_node_set_nodes)
-        self._rootgrp.createVariable(node_ns_name, 'i4', num_node_ns_name)
-
-        self._rootgrp.variables['ns_status'][idx] = 1
-        self._rootgrp.variables['ns_prop1'][idx] = id
+        self._create_variable(node_ns_name, self._int_type, num_node_ns_name)
 
         return
 
     def put_side_set(self, id, side_set_elems, side_set_sides):
 
-        assert id in self._rootgrp.variables['ss_prop1'][:], 'Sideset id {} not present'.format(id)
+        assert id in self._ids['ss'], 'Sideset id {} not present'.format(id)
 
         # Get idx corresponding to id
-        idx = np.where(self._rootgrp.variables['ss_prop1'][:] == id)[0][0]
+        idx = self._index('ss', id)
 
         elem_ss_name = 'elem_ss{}'.format(idx + 1)
         side_ss_name = 'side_ss{}'.format(idx + 1)
 
+        self._end_definitions()
         self._rootgrp.variables[elem_ss_name][:] = side_set_elems
         self._rootgrp.variables[side_ss_name][:] = side_set_sides
 
@@ -231,178 +529,261 @@ class exodus(object):
 
     def put_node_set(self, id, node_set_nodes):
 
-        assert id in self._rootgrp.variables['ns_prop1'][:], 'Nodeset id {} not present'.format(id)
+        assert id in self._ids['ns'], 'Nodeset id {} not present'.format(id)
 
         # Get idx corresponding to id
-        idx = np.where(self._rootgrp.variables['ns_prop1'][:] == id)[0][0]
+        idx = self._index('ns', id)
 
         node_ns_name = 'node_ns{}'.format(idx + 1)
 
+        self._end_definitions()
         self._rootgrp.variables[node_ns_name][:] = node_set_nodes
 
         return
 
+    def _set_variable_number(self, kind, dim_name, number):
+
+        # Define `number` variables of a kind (elem, nod, sset or nset), with
+        # empty names until they are given
+        self._rootgrp.createDimension(dim_name, number)
+        self._rootgrp.createVariable('name_{}_var'.format(kind), 'S1', (dim_name, 'len_name'))
+        self._var_names[kind] = [''] * number
+        self._put_names('name_{}_var'.format(kind), self._var_names[kind])
+
+        return
+
+    def _put_variable_name(self, kind, name, index):
+
+        self._var_names[kind][index - 1] = name
+        self._put_names('name_{}_var'.format(kind), self._var_names[kind])
+
+        return
+
     def set_element_variable_number(self, number):
 
-        self._rootgrp.createDimension('num_elem_var', number)
-        self._rootgrp.createVariable('name_elem_var', 'S1', ('num_elem_var', 'len_name'))
+        self._set_variable_number('elem', 'num_elem_var', number)
 
         return
 
     def put_element_variable_name(self, name, index):
 
-        self._rootgrp.variables['name_elem_var'][index - 1, 0:len(name)] = [c for c in name]
+        self._put_variable_name('elem', name, index)
         return
 
     def get_element_variable_name(self):
 
-        name_elem_var = self._rootgrp.variables['name_elem_var']
-        name_elem_var.set_auto_mask(False)
-
-        names = [b''.join(c).strip().decode() for c in name_elem_var[:]]
-        return names
+        return list(self._var_names.get('elem', []))
 
     def put_element_variable_values(self, blk_id, name, step, values):
 
-        var_names = self.get_element_variable_name()
-        block_ids = self._rootgrp.variables['eb_prop1'][:]
-        assert name in var_names, 'Variable {} not found in list of element variables'.format(name)
-        assert blk_id in block_ids, 'Block id {} not found'.format(blk_id)
+        self._put_values_block('elem', blk_id, [name], step, None, [values])
 
-        idx = np.where(block_ids == blk_id)[0][0]
-        var_idx = var_names.index(name)
+        return
 
-        var_name = 'vals_elem_var{}eb{}'.format(var_idx + 1, idx + 1)
-        num_elem_in_blk = 'num_el_in_blk{}'.format(idx + 1)
+    def put_partial_element_variable_values(self, blk_id, name, step, start, values):
 
-        if var_name not in self._rootgrp.variables:
-            self._rootgrp.createVariable(var_name, 'f8', ('time_step', num_elem_in_blk))
+        # Values of the elements numbered start to start + len(values) - 1 (1-based) in the block
+        self._put_values_block('elem', blk_id, [name], step, start, [values])
+
+        return
+
+    def _variable_indices(self, kind, names, description):
+
+        # The 0-based indices of the variables `names` of a kind
+        lookup = {name: i for i, name in enumerate(self._var_names.get(kind, []))}
+        for name in names:
+            assert name in lookup, 'Variable {} not found in list of {} variables'.format(name, description)
+
+        return [lookup[name] for name in names]
 
-        self._rootgrp.variables[var_name][step - 1] = values
+    def _set_index(self, kind, id):
+
+        # The 1-based index of the block or set id holding variables of a
+        # kind (None for nodal variables)
+        set_kind, _, label = _VALUES[kind][:3]
+        if set_kind is None:
+            return None
+        assert id in self._ids[set_kind], '{} id {} not found'.format(label, id)
+
+        return self._index(set_kind, id) + 1
+
+    def _put_values(self, kind, var_idx, idx, step, start, values):
+
+        # Values of the (0-based) variable var_idx of a kind in the block or
+        # set idx (1-based), over its entries numbered start to
+        # start + len(values) - 1 (1-based), or all of them if start is None
+        label, var_name, dim_name = _VALUES[kind][2:]
+        var = self._create_values(var_name.format(var_idx + 1, idx), dim_name.format(idx))
+        if start is None:
+            assert len(values) == var.shape[1], 'Values must be given for every entry'
+            start = 1
+        assert start >= 1 and start - 1 + len(values) <= var.shape[1], \
+            'Entries must be in the {}'.format(label.lower() if label else 'model')
+
+        if len(values):
+            var[step - 1, start - 1:start - 1 + len(values)] = values
+
+        return
+
+    def _put_values_block(self, kind, id, names, step, start, values):
+
+        # Values of the variables `names` of a kind in block or set id, as a
+        # (len(names), n) array over its entries numbered start to
+        # start + n - 1 (1-based), or all of them if start is None
+        var_idxs = self._variable_indices(kind, names, _VALUES[kind][1])
+        idx = self._set_index(kind, id)
+        assert len(values) == len(names), 'Values must be given for each variable'
+
+        self._end_definitions()
+        for var_idx, var_values in zip(var_idxs, values):
+            self._put_values(kind, var_idx, idx, step, start, var_values)
+
+        return
+
+    def put_element_variable_values_block(self, blk_id, names, step, values):
+
+        # Values of the element variables `names` in block blk_id, as a
+        # (len(names), num_elems_in_block) array
+        self._put_values_block('elem', blk_id, names, step, None, values)
+
+        return
+
+    def put_partial_element_variable_values_block(self, blk_id, names, step, start, values):
+
+        # Values of the element variables `names` of the elements numbered
+        # start to start + n - 1 (1-based) in the block, as a (len(names), n) array
+        self._put_values_block('elem', blk_id, names, step, start, values)
+
+        return
+
+    def put_all_element_variable_values(self, step, values, elem_blk_ids):
+
+        # Values of the element variables in the dict `values` by name, each
+        # an array over all of the elements, whose block ids are
+        # elem_blk_ids. The elements are grouped by block once, then each
+        # variable is put in block order and written a block at a time.
+        names = list(values)
+        var_idxs = self._variable_indices('elem', names, 'element')
+
+        elem_blk_ids = np.asarray(elem_blk_ids).reshape(-1)
+        order = np.argsort(elem_blk_ids, kind='stable')
+        blk_ids, starts, counts = np.unique(elem_blk_ids[order], return_index=True, return_counts=True)
+        idxs = [self._set_index('elem', blk_id) for blk_id in blk_ids.tolist()]
+
+        self._end_definitions()
+        for name, var_idx in zip(names, var_idxs):
+            var_values = np.asarray(values[name]).reshape(-1)[order]
+            for idx, start, count in zip(idxs, starts, counts):
+                self._put_values('elem', var_idx, idx, step, None, var_values[start:start + count])
 
         return
 
     def set_node_variable_number(self, number):
 
-        self._rootgrp.createDimension('num_nod_var', number)
-        self._rootgrp.createVariable('name_nod_var', 'S1', ('num_nod_var', 'len_name'))
+        self._set_variable_number('nod', 'num_nod_var', number)
 
         return
 
     def put_node_variable_name(self, name, index):
 
-        self._rootgrp.variables['name_nod_var'][index - 1, 0:len(name)] = [c for c in name]
+        self._put_variable_name('nod', name, index)
         return
 
     def get_node_variable_name(self):
 
-        name_node_var = self._rootgrp.variables['name_nod_var']
-        name_node_var.set_auto_mask(False)
-
-        names = [b''.join(c).strip().decode() for c in name_node_var[:]]
-
-        return names
+        return list(self._var_names.get('nod', []))
 
     def put_node_variable_values(self, name, step, values):
 
-        var_names = self.get_node_variable_name()
-        assert name in var_names, 'Variable {} not found in list of nodal variables'.format(name)
-
-        var_idx = var_names.index(name)
+        self._put_values_block('nod', None, [name], step, None, [values])
 
-        var_name = 'vals_nod_var{}'.format(var_idx + 1)
+        return
 
-        if var_name not in self._rootgrp.variables:
-            self._rootgrp.createVariable(var_name, 'f8', ('time_step', 'num_nodes'))
+    def put_all_node_variable_values(self, step, values):
 
-        self._rootgrp.variables[var_name][step - 1] = values
+        # Values of the nodal variables in the dict `values` by name, each an
+        # array over all of the nodes
+        names = list(values)
+        self._put_values_block('nod', None, names, step, None, [values[name] for name in names])
 
         return
 
     def set_side_set_variable_number(self, number):
 
-        self._rootgrp.createDimension('num_sset_var', number)
-        self._rootgrp.createVariable('name_sset_var', 'S1', ('num_sset_var', 'len_name'))
+        self._set_variable_number('sset', 'num_sset_var', number)
 
         return
 
     def put_side_set_variable_name(self, name, index):
 
-        self._rootgrp.variables['name_sset_var'][index - 1, 0:len(name)] = [c for c in name]
+        self._put_variable_name('sset', name, index)
 
         return
 
     def get_side_set_variable_name(self):
 
-        name_side_set_var = self._rootgrp.variables['name_sset_var']
-        name_side_set_var.set_auto_mask(False)
-
-        names = [b''.join(c).strip().decode() for c in name_side_set_var[:]]
-
-        return names
+        return list(self._var_names.get('sset', []))
 
     def put_side_set_variable_values(self, id, name, step, values):
 
-        var_names = self.get_side_set_variable_name()
-        sideset_ids = self._rootgrp.variables['ss_prop1'][:]
-        assert name in var_names, 'Variable {} not found in list of sideset variables'.format(name)
-        assert id in sideset_ids, 'Sideset id {} not found'.format(id)
-
-        idx = np.where(sideset_ids == id)[0][0]
-        var_idx = var_names.index(name)
+        self._put_values_block('sset', id, [name], step, None, [values])
 
-        var_name = 'vals_sset_var{}ss{}'.format(var_idx + 1, idx + 1)
-        num_elem_in_ss = 'num_side_ss{}'.format(idx + 1)
+        return
 
-        if var_name not in self._rootgrp.variables:
-            self._rootgrp.createVariable(var_name, 'f8', ('time_step', num_elem_in_ss))
+    def put_side_set_variable_values_block(self, id, names, step, values):
 
-        self._rootgrp.variables[var_name][step - 1] = values
+        # Values of the sideset variables `names` in sideset id, as a
+        # (len(names), num_side_set_elems) array
+        self._put_values_block('sset', id, names, step, None, values)
 
         return
 
     def set_node_set_variable_number(self, number):
 
-        self._rootgrp.createDimension('num_nset_var', number)
-        self._rootgrp.createVariable('name_nset_var', 'S1', ('num_nset_var', 'len_name'))
+        self._set_variable_number('nset', 'num_nset_var', number)
 
         return
 
     def put_node_set_variable_name(self, name, index):
 
-        self._rootgrp.variables['name_nset_var'][index - 1, 0:len(name)] = [c for c in name]
+        self._put_variable_name('nset', name, index)
 
         return
 
     def get_node_set_variable_name(self):
 
-        name_node_set_var = self._rootgrp.variables['name_nset_var']
-        name_node_set_var.set_auto_mask(False)
-
-        names = [b''.join(c).strip().decode() for c in name_node_set_var[:]]
-
-        return names
+        return list(self._var_names.get('nset', []))
 
     def put_node_set_variable_values(self, id, name, step, values):
 
-        var_names = self.get_node_set_variable_name()
-        nodeset_ids = self._rootgrp.variables['ns_prop1'][:]
-        assert name in var_names, 'Variable {} not found in list of nodeset variables'.format(name)
-        assert id in nodeset_ids, 'Nodeset id {} not found'.format(id)
-
-        idx = np.where(nodeset_ids == id)[0][0]
-        var_idx = var_names.index(name)
+        self._put_values_block('nset', id, [name], step, None, [values])
 
-        var_name = 'vals_nset_var{}ns{}'.format(var_idx + 1, idx + 1)
-        num_nodes_in_ns = 'num_nod_ns{}'.format(idx + 1)
+        return
 
-        if var_name not in self._rootgrp.variables:
-            self._rootgrp.createVariable(var_name, 'f8', ('time_step', num_nodes_in_ns))
+    def put_node_set_variable_values_block(self, id, names, step, values):
 
-        self._rootgrp.variables[var_name][step - 1] = values
+        # Values of the nodeset variables `names` in nodeset id, as a
+        # (len(names), num_node_set_nodes) array
+        self._put_values_block('nset', id, names, step, None, values)
 
         return
 
     def close(self):
+        self._end_definitions()
         self._rootgrp.close()
         return
+
+class exodus_direct(exodus):
+    '''
+    Create an Exodus II file, writing the NetCDF-3 file directly
+
+    The same as exodus, but the file is written by pyexodus.netcdf3 rather
+    than the netCDF4 package (which isn't needed): the header is computed
+    once the layout has been defined, and every array is written straight
+    into a memory map of the file. The whole layout must be defined before
+    any data is written, as em2ex does.
+    '''
+
+    def _open(self, file, mode):
+        assert self._file_format.startswith('NETCDF3'), 'exodus_direct only writes NetCDF-3 files'
+        return netcdf3.Dataset(file, mode, format = self._file_format)
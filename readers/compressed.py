@@ -0,0 +1,63 @@
+# Detection and streaming decompression of compressed input files
+
+import os
+
+# Leading bytes of each supported compression format
+_MAGIC = ((b'\x1f\x8b', 'gzip'),
+          (b'BZh', 'bz2'),
+          (b'\xfd7zXZ\x00', 'xz'),
+          (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+# File extensions of each supported compression format, used when the magic
+# bytes are not recognised (e.g. an empty file)
+_EXTENSIONS = {'.gz': 'gzip',
+               '.bz2': 'bz2',
+               '.xz': 'xz',
+               '.zst': 'zstd'}
+
+def compression(f):
+    ''' The compression format of file f ('gzip', 'bz2', 'xz' or 'zstd'),
+    detected from its magic bytes or else its extension, or None if the file
+    is not compressed '''
+    with open(f, 'rb') as fid:
+        head = fid.read(6)
+    for magic, name in _MAGIC:
+        if head.startswith(magic):
+            return name
+    return _EXTENSIONS.get(os.path.splitext(f)[1].lower())
+
+def stripCompressionExtension(f):
+    ''' File name f without a trailing compression extension (e.g.
+    model.grdecl.gz -> model.grdecl) '''
+    base, ext = os.path.splitext(f)
+    return base if ext.lower() in _EXTENSIONS else f
+
+def openCompressed(f, fmt=None):
+    ''' Open a compressed file for reading, returning a binary file object that
+    decompresses the data as it is read. Nothing is decompressed to disk.
+    The format is detected if `fmt` is not given. zstd requires the optional
+    zstandard package. '''
+    fmt = fmt or compression(f)
+
+    if fmt == 'gzip':
+        import gzip
+        return gzip.open(f, 'rb')
+
+    elif fmt == 'bz2':
+        import bz2
+        return bz2.open(f, 'rb')
+
+    elif fmt == 'xz':
+        import lzma
+        return lzma.open(f, 'rb')
+
+    elif fmt == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            print("Reading zstd compressed file", f, "requires the zstandard package")
+            exit()
+        import io
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(f, 'rb'), closefd=True))
+
+    return open(f, 'rb')
@@ -1,8 +1,12 @@
 # Functions to read Eclipse grdecl files and parse the input
 
+from itertools import combinations
 import numpy as np
+import re
 from exodus_model.ExodusModel import ExodusModel
 from readers.reader_utils import *
+from readers.compressed import compression, openCompressed
+from readers.profiling import stage
 import os
 
 
@@ -19,6 +23,8 @@ class EclipseData(object):
         self._coord = None
         self._zcorn = None
         self._elemProps = {}
+        self._files = []
+        self._integerKeywords = set(INTEGER_KEYWORDS)
 
     # Grid size data from SPECGRID
     @property
@@ -96,34 +102,149 @@ class EclipseData(object):
         else:
             self._elemProps[prop] = value
 
-def readBlock(f):
-    '''Reads block of data and returns it as a list'''
-    block = []
-    while True:
-        line = next(f)
-        # Skip comments and blank lines
-        if line.startswith('--') or not line.strip():
-            continue
-        data = processData(line)
-        block.extend(data)
-        # End read if line ends with /
-        if block[-1] == '/':
-            block.pop()
-            block = list(map(float, block))
-            break
+    # Files the data was read from (the main file and any INCLUDEs)
+    @property
+    def files(self):
+        return self._files
+
+    @files.setter
+    def files(self, files):
+        self._files = files
+
+    # Keywords read as integer arrays rather than floats
+    @property
+    def integerKeywords(self):
+        return self._integerKeywords
+
+    @integerKeywords.setter
+    def integerKeywords(self, keywords):
+        self._integerKeywords = set(keywords)
+
+    def dtype(self, keyword):
+        ''' The dtype a keyword's data is read as '''
+        return np.int32 if keyword in self._integerKeywords else float
+
+# Approximate number of characters of block text parsed at a time. Bounds the
+# temporary memory needed on top of the block's final array.
+_CHUNK_CHARS = 1 << 22
+
+# Trailing or whole-line comments in raw block text
+_COMMENT = re.compile(rb'--[^\n]*')
+
+def _regionChunks(buf, start, end):
+    '''Yields the data between byte offsets start and end of buf (a bytes-like
+    object, e.g. a memory-mapped file) as a sequence of 1D float ndarrays, each
+    parsed from roughly _CHUNK_CHARS bytes. Comments are removed from each
+    chunk with a single regex substitution rather than line by line'''
+    pos = start
+    while pos < end:
+        stop = min(pos + _CHUNK_CHARS, end)
+        if stop < end:
+            # Chunks always end on a line boundary, so a token is never split
+            nl = buf.find(b'\n', stop, end)
+            stop = end if nl < 0 else nl + 1
+        text = _COMMENT.sub(b'', buf[pos:stop]).decode('latin-1')
+        yield processData(text)
+        pos = stop
+
+def _fillArray(chunks, out, keyword):
+    '''Fills the preallocated 1D array `out` from the chunks of a block.
+    Returns None on success, or a message naming `keyword` if the block is too
+    long (detected as soon as the overflowing chunk is parsed) or too short'''
+    size = out.size
+    integer = out.dtype.kind == 'i'
+    filled = 0
+    for chunk in chunks:
+        if filled + chunk.size > size:
+            return "The number of {} entries read is not correct (expected {}, found more)".format(
+                keyword, size)
+        if integer and not _isIntegral(chunk):
+            return "Non-integer value found in integer keyword {}".format(keyword)
+        out[filled:filled + chunk.size] = chunk
+        filled += chunk.size
+
+    if filled != size:
+        return "The number of {} entries read is not correct (expected {}, found {})".format(
+            keyword, size, filled)
+
+    return None
+
+def _fillBlock(chunks, size, keyword, dtype=float):
+    '''Collects the chunks of a block into a single 1D ndarray of `dtype`.
+
+    If the expected number of entries `size` is known, the array is allocated
+    once and filled chunk by chunk, and a block that is too long or too short
+    is reported (using `keyword` in the message) as soon as it is detected'''
+    if size is None:
+        chunks = list(chunks)
+        if not chunks:
+            return np.empty(0, dtype=dtype)
+        block = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        if np.dtype(dtype).kind == 'i' and not _isIntegral(block):
+            print("Non-integer value found in integer keyword {}".format(keyword))
+            exit()
+        return block.astype(dtype, copy=False)
+
+    block = np.empty(size, dtype=dtype)
+    error = _fillArray(chunks, block, keyword)
+    if error:
+        print(error)
+        exit()
+
     return block
 
-def processData(line):
-    '''Expands shorthand notation N*data to N copies of data'''
-    data = []
-    for t in line.split():
-        if t.find('*') == -1:
-            data.append(t)
-        else:
-            tmp = t.split('*')
-            expanded = [tmp[1]] * int(tmp[0])
-            data.extend(expanded)
-    return data
+def readRegion(buf, start, end, size=None, keyword='data', dtype=float):
+    '''Reads the block of data between byte offsets start and end of buf (as
+    found by indexEclipse) and returns it as a 1D ndarray (see _fillBlock
+    for `size` and `dtype`)'''
+    return _fillBlock(_regionChunks(buf, start, end), size, keyword, dtype)
+
+def _isIntegral(values):
+    ''' True if every value of a float array is a whole number '''
+    return bool(np.all(np.mod(values, 1) == 0))
+
+def compactIntegers(values):
+    ''' Returns an integer array in the smallest signed integer dtype that
+    holds all of its values (e.g. int8 for ACTNUM). Float arrays of whole
+    numbers (as stored by other readers) are converted as well. '''
+    values = np.asarray(values)
+    if values.dtype.kind == 'f' and not _isIntegral(values):
+        return values
+    lo, hi = (values.min(), values.max()) if values.size else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return values.astype(dtype, copy=False)
+
+def _expectedSize(eclipse, keyword):
+    '''Number of entries SPECGRID implies for the keyword (COORD, ZCORN or a
+    per-cell property), or None if SPECGRID hasn't been read yet'''
+    if not eclipse.specgrid:
+        return None
+    nx, ny, nz = eclipse.nx, eclipse.ny, eclipse.nz
+    if keyword == 'COORD':
+        return 6 * (nx + 1) * (ny + 1)
+    elif keyword == 'ZCORN':
+        return 8 * nx * ny * nz
+    else:
+        return nx * ny * nz
+
+# A data token without the N*data shorthand (no '*' anywhere in it)
+_PLAIN_TOKEN = re.compile(r'(?<!\S)([^\s*]+)(?!\S)')
+
+def processData(text):
+    '''Converts whitespace-separated data to a 1D float ndarray, expanding
+    shorthand notation N*data to N copies of data.
+
+    Plain blocks are parsed directly by np.fromstring. Blocks containing the
+    shorthand are rewritten so that every token is a (count, value) pair
+    (plain tokens get a count of 1), parsed in one go and expanded with
+    np.repeat, so no per-token Python work is done in either case.'''
+    if '*' not in text:
+        return np.fromstring(text, sep=' ')
+    pairs = np.fromstring(_PLAIN_TOKEN.sub(r'1*\1', text).replace('*', ' '),
+                          sep=' ').reshape(-1, 2)
+    return np.repeat(pairs[:, 1], pairs[:, 0].astype(np.int64))
 
 # Per-cell scalar property keywords the reader recognises out of the box.
 # Any additional keywords (e.g. PVTNUM, EQLNUM, FIPNUM) can be passed by the
@@ -133,6 +254,12 @@ DEFAULT_KEYWORDS = ('ACTNUM', 'SATNUM', 'PORO',
                     'PERMX', 'PERMY', 'PERMZ',
                     'NTG', 'HEATCR', 'THCONR')
 
+# Keywords that hold integer flags or region numbers. These are kept as
+# (compact) integer arrays rather than floats; --integer-keywords adds more.
+INTEGER_KEYWORDS = ('ACTNUM', 'SATNUM', 'PVTNUM', 'EQLNUM', 'FIPNUM',
+                    'IMBNUM', 'ROCKNUM', 'MULTNUM', 'FLUXNUM', 'OPERNUM',
+                    'MISCNUM', 'ENDNUM', 'KRNUM', 'IMBNUMMF')
+
 # Recognised length units for the GRIDUNIT keyword and the factor that
 # converts them to metres. Files that omit GRIDUNIT default to METRES.
 GRIDUNIT_TO_METRES = {
@@ -141,131 +268,604 @@ GRIDUNIT_TO_METRES = {
     'CM':     0.01,
 }
 
+# Keywords whose data block is always read. Any keyword in a file is assumed
+# to have a data block (up to the next /) unless it is immediately followed by
+# another keyword line (e.g. GRID, NOECHO), but these are never assumed empty.
+_BLOCK_KEYWORDS = ('SPECGRID', 'MAPAXES', 'GRIDUNIT', 'COORD', 'ZCORN', 'INCLUDE')
+
+# A keyword line: an uppercase keyword alone on its line (apart from an
+# optional trailing comment)
+_KEYWORD_LINE = re.compile(rb'^[ \t]*([A-Z][A-Z0-9_]*)[ \t]*(?:--[^\n]*)?\r?$', re.MULTILINE)
+
+# A blank line or whole-line comment
+_SKIP_LINE = re.compile(rb'(?:[ \t]*(?:--[^\n]*)?\r?\n)*')
+
+def _mapFile(f):
+    ''' Memory-map a file for reading (returns empty bytes for an empty file) '''
+    import mmap
+    with open(f, 'rb') as fid:
+        if os.fstat(fid.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _findTerminator(buf, pos):
+    ''' Byte offset of the / ending the block that starts at pos, ignoring
+    any / in a comment or inside a quoted string. Returns -1 if the block is
+    not terminated. '''
+    while True:
+        slash = buf.find(b'/', pos)
+        if slash < 0:
+            return -1
+        line = buf[buf.rfind(b'\n', 0, slash) + 1:slash]
+        if b'--' in line:
+            nl = buf.find(b'\n', slash)
+            if nl < 0:
+                return -1
+            pos = nl
+        elif line.count(b"'") % 2 or line.count(b'"') % 2:
+            pos = slash + 1
+        else:
+            return slash
+
+def indexEclipse(buf, block_keywords=()):
+    ''' Pre-scan a grdecl file (the memory-mapped contents, buf) and return an
+    index of its keywords, as a list of dicts with the keyword name, the byte
+    offset of the keyword line, and the byte range [start, end) of its data
+    (up to, but not including, the terminating /).
+
+    Only the keyword lines and terminators are looked for: the data blocks in
+    between are skipped with a single search for the next /, so building the
+    index costs far less than parsing the file. Keywords in `block_keywords`
+    (as well as _BLOCK_KEYWORDS) always have a data block; any other keyword
+    directly followed by another keyword line is recorded with an empty block
+    (e.g. section headers like GRID). INCLUDE entries are not followed. '''
+    block_keywords = set(_BLOCK_KEYWORDS) | set(block_keywords)
+    index = []
+    pos = 0
+    while True:
+        match = _KEYWORD_LINE.search(buf, pos)
+        if not match:
+            break
+        keyword = match.group(1).decode('ascii')
+        start = match.end()
+        data = _SKIP_LINE.match(buf, start + 1).end() if start < len(buf) else start
+
+        if keyword not in block_keywords and (data >= len(buf) or _KEYWORD_LINE.match(buf, data)):
+            # No data block
+            end = start
+            pos = start
+        else:
+            end = _findTerminator(buf, start)
+            if end < 0:
+                end = len(buf)
+            pos = end + 1
+
+        index.append({'keyword': keyword, 'offset': match.start(1), 'start': start, 'end': end})
+
+    return index
+
+def _tokens(buf, start, end):
+    ''' The whitespace-separated tokens between start and end, without comments '''
+    return _COMMENT.sub(b'', buf[start:end]).decode('latin-1').split()
+
+def listKeywords(f, keywords=DEFAULT_KEYWORDS):
+    ''' Print the keyword index of a grdecl file and the files it INCLUDEs,
+    without parsing any of the data arrays '''
+    print('{:<10} {:>14} {:>14}  {}'.format('Keyword', 'Offset', 'Bytes', 'File'))
+    _listKeywords(f, keywords)
+    return
+
+def _listKeywords(f, keywords):
+    if compression(f):
+        print('{:<10} {:>14} {:>14}  {} ({} compressed, not indexed)'.format('-', '-', '-', f, compression(f)))
+        return
+    buf = _mapFile(f)
+    for entry in indexEclipse(buf, keywords):
+        print('{:<10} {:>14} {:>14}  {}'.format(entry['keyword'], entry['offset'],
+                                                 entry['end'] - entry['start'], f))
+        if entry['keyword'] == 'INCLUDE':
+            include_file = _tokens(buf, entry['start'], entry['end'])[0].strip("'\"")
+            _listKeywords(os.path.join(os.path.split(f)[0], include_file), keywords)
+    return
+
+class _StreamReader(object):
+    '''Binary stream (e.g. a decompressing file object) with push-back, so
+    that data read past the end of a block can be returned to the stream'''
+
+    def __init__(self, fid):
+        self._fid = fid
+        self._pending = b''
+        self._pos = 0
+
+    def unread(self, data):
+        self._pending = data + self._pending[self._pos:]
+        self._pos = 0
+
+    def read(self, n):
+        if self._pos < len(self._pending):
+            data = self._pending[self._pos:self._pos + n]
+            self._pos += len(data)
+            return data
+        return self._fid.read(n)
+
+    def readline(self):
+        if self._pos < len(self._pending):
+            nl = self._pending.find(b'\n', self._pos)
+            if nl >= 0:
+                line = self._pending[self._pos:nl + 1]
+                self._pos = nl + 1
+                return line
+            line = self._pending[self._pos:]
+            self._pos = len(self._pending)
+            return line + self._fid.readline()
+        return self._fid.readline()
+
+def _streamChunks(stream):
+    '''Yields the data of a block read from a _StreamReader up to the
+    terminating / as 1D float ndarrays, like _regionChunks. The stream is
+    read roughly _CHUNK_CHARS bytes at a time (always ending on a line
+    boundary), and anything after the / is pushed back onto the stream'''
+    while True:
+        text = stream.read(_CHUNK_CHARS)
+        if not text:
+            return
+        text = _COMMENT.sub(b'', text + stream.readline())
+        slash = text.find(b'/')
+        if slash >= 0:
+            stream.unread(text[slash + 1:])
+            yield processData(text[:slash].decode('latin-1'))
+            return
+        yield processData(text.decode('latin-1'))
+
+def _skipStream(stream):
+    ''' Skip a data block of a _StreamReader up to its terminating /, reading
+    roughly _CHUNK_CHARS bytes at a time '''
+    while True:
+        text = stream.read(_CHUNK_CHARS)
+        if not text:
+            return
+        text = _COMMENT.sub(b'', text + stream.readline())
+        end = _findTerminator(text, 0)
+        if end >= 0:
+            stream.unread(text[end + 1:])
+            return
+
+def _unquotedSlash(line):
+    ''' Index of the first / in a line (with comments removed) that is not
+    inside a quoted string, or -1 '''
+    quote = None
+    for i, c in enumerate(line):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c == '/':
+            return i
+    return -1
+
+def _streamTokens(stream):
+    ''' The tokens of a (short) block read from a _StreamReader, up to the
+    terminating / '''
+    tokens = []
+    line = stream.readline()
+    while line:
+        line = _COMMENT.sub(b'', line).decode('latin-1')
+        slash = _unquotedSlash(line)
+        if slash >= 0:
+            stream.unread(line[slash + 1:].encode('latin-1'))
+            return tokens + line[:slash].split()
+        tokens += line.split()
+        line = stream.readline()
+    return tokens
+
+def _readEclipseStream(f, stream, eclipse, keywords, extra_keywords):
+    ''' Read a grdecl file from a _StreamReader, for files that can't be
+    memory-mapped (e.g. compressed files). Keywords are recognised line by
+    line as in indexEclipse, and the data blocks are parsed in bounded chunks
+    as they are read, so the file is never held in memory as a whole. '''
+    block_keywords = set(_BLOCK_KEYWORDS) | keywords
+    line = stream.readline()
+    while line:
+        match = _KEYWORD_LINE.fullmatch(line.rstrip(b'\n'))
+        if not match:
+            line = stream.readline()
+            continue
+        keyword = match.group(1).decode('ascii')
+
+        if keyword == 'SPECGRID':
+            eclipse.specgrid = _streamTokens(stream)
+
+        elif keyword == 'MAPAXES':
+            eclipse.mapaxes = _fillBlock(_streamChunks(stream), None, 'MAPAXES')
+
+        elif keyword == 'GRIDUNIT':
+            eclipse.gridunit = [t.strip("'\"") for t in _streamTokens(stream)]
+
+        elif keyword == 'INCLUDE':
+            include_file = _streamTokens(stream)[0].strip("'\"")
+            readEclipse(os.path.join(os.path.split(f)[0], include_file), eclipse,
+                        extra_keywords=extra_keywords)
+
+        elif keyword in ('COORD', 'ZCORN') or keyword in keywords:
+            block = _fillBlock(_streamChunks(stream), _expectedSize(eclipse, keyword), keyword,
+                               eclipse.dtype(keyword))
+            if keyword == 'COORD':
+                eclipse.coord = block
+            elif keyword == 'ZCORN':
+                eclipse.zcorn = block
+            else:
+                eclipse.elemProps[keyword] = block
+
+        elif keyword not in block_keywords:
+            # An unknown keyword has no data if the next keyword follows
+            # directly, otherwise its data block is skipped
+            line = stream.readline()
+            while line and _SKIP_LINE.fullmatch(line):
+                line = stream.readline()
+            if _KEYWORD_LINE.fullmatch(line.rstrip(b'\n')):
+                continue
+            stream.unread(line)
+            _skipStream(stream)
+
+        line = stream.readline()
+
+    return
+
 def readEclipse(f, eclipse, extra_keywords=()):
     ''' Read an Eclipse grdecl file and store the data in an Eclipse object.
     `extra_keywords` is an iterable of additional uppercase keyword names to
-    read as per-cell properties on top of DEFAULT_KEYWORDS. '''
+    read as per-cell properties on top of DEFAULT_KEYWORDS.
+
+    The file is memory-mapped and indexed first (see indexEclipse), then only
+    the blocks that are needed are parsed; everything else is skipped.
+    Compressed files (gzip, bz2, xz or zstd, see readers.compressed) are
+    decompressed as they are read instead. '''
 
     keywords = set(DEFAULT_KEYWORDS) | {k.upper() for k in extra_keywords}
+    eclipse.files.append(f)
 
-    # Open the .grdecl file for reading
-    with open(f, 'r') as file:
-        for line in file:
+    if compression(f):
+        with openCompressed(f) as fid:
+            _readEclipseStream(f, _StreamReader(fid), eclipse, keywords, extra_keywords)
+        return
 
-            if line.startswith('--') or  not line.strip():
-                # Skip comments and blank lines
-                continue
+    buf = _mapFile(f)
+    for entry in indexEclipse(buf, keywords):
+        keyword, start, end = entry['keyword'], entry['start'], entry['end']
 
-            elif line.startswith('SPECGRID'):
-                eclipse.specgrid = next(file).split()
+        if keyword == 'SPECGRID':
+            eclipse.specgrid = _tokens(buf, start, end)
 
-            elif line.startswith('MAPAXES'):
-                eclipse.mapaxes = readBlock(file)
+        elif keyword == 'MAPAXES':
+            eclipse.mapaxes = readRegion(buf, start, end)
 
-            elif line.startswith('GRIDUNIT'):
-                # Eclipse string keywords are conventionally written with
-                # single quotes (e.g. 'METRES' 'MAP' /). Strip the quotes so
-                # downstream comparisons against bare values like 'METRES' or
-                # 'GRID' work whether the file quotes the strings or not.
-                tokens = next(file).split()
-                tokens.pop()   # drop the trailing '/'
-                eclipse.gridunit = [t.strip("'\"") for t in tokens]
+        elif keyword == 'GRIDUNIT':
+            # Eclipse string keywords are conventionally written with
+            # single quotes (e.g. 'METRES' 'MAP' /). Strip the quotes so
+            # downstream comparisons against bare values like 'METRES' or
+            # 'GRID' work whether the file quotes the strings or not.
+            eclipse.gridunit = [t.strip("'\"") for t in _tokens(buf, start, end)]
 
-            elif line.startswith('COORD') and 'COORDSYS' not in line:
-                eclipse.coord = readBlock(file)
+        elif keyword == 'COORD':
+            eclipse.coord = readRegion(buf, start, end, _expectedSize(eclipse, 'COORD'), 'COORD')
 
-            elif line.startswith('ZCORN'):
-                eclipse.zcorn = readBlock(file)
+        elif keyword == 'ZCORN':
+            eclipse.zcorn = readRegion(buf, start, end, _expectedSize(eclipse, 'ZCORN'), 'ZCORN')
 
-            elif line.startswith('INCLUDE'):
-                include_file = next(file).split()[0]
-                filepath = os.path.split(f)[0]
-                readEclipse(os.path.join(filepath, include_file), eclipse,
-                            extra_keywords=extra_keywords)
+        elif keyword == 'INCLUDE':
+            include_file = _tokens(buf, start, end)[0].strip("'\"")
+            filepath = os.path.split(f)[0]
+            readEclipse(os.path.join(filepath, include_file), eclipse,
+                        extra_keywords=extra_keywords)
 
-            elif line.split()[0] in keywords:
-                # Read in all per-cell property arrays whose keyword is recognised
-                prop = line.split()[0]
-                eclipse.elemProps[prop] = np.asarray(readBlock(file))
+        elif keyword in keywords:
+            # Read in all per-cell property arrays whose keyword is recognised
+            eclipse.elemProps[keyword] = readRegion(buf, start, end, _expectedSize(eclipse, keyword),
+                                                    keyword, eclipse.dtype(keyword))
 
-            else:
-                # Skip all unknown sections
-                continue
+        # All unknown sections are skipped
+
+    return
+
+
+def _collectBlocks(f, eclipse, keywords, blocks):
+    ''' Index a grdecl file and its INCLUDEs, reading the small keywords
+    (SPECGRID, MAPAXES, GRIDUNIT) straight away and recording the location
+    (file, start, end) of every COORD, ZCORN and property block in `blocks`,
+    keyed by keyword. As in readEclipse, a later block replaces an earlier
+    one with the same keyword. Returns False if a compressed file (which
+    can't be indexed) was found. '''
+    if compression(f):
+        return False
+    eclipse.files.append(f)
+    buf = _mapFile(f)
+    for entry in indexEclipse(buf, keywords):
+        keyword, start, end = entry['keyword'], entry['start'], entry['end']
+
+        if keyword == 'SPECGRID':
+            eclipse.specgrid = _tokens(buf, start, end)
+
+        elif keyword == 'MAPAXES':
+            eclipse.mapaxes = readRegion(buf, start, end)
+
+        elif keyword == 'GRIDUNIT':
+            eclipse.gridunit = [t.strip("'\"") for t in _tokens(buf, start, end)]
+
+        elif keyword == 'INCLUDE':
+            include_file = _tokens(buf, start, end)[0].strip("'\"")
+            if not _collectBlocks(os.path.join(os.path.split(f)[0], include_file),
+                                  eclipse, keywords, blocks):
+                return False
+
+        elif keyword in ('COORD', 'ZCORN') or keyword in keywords:
+            blocks[keyword] = (f, start, end)
+
+    return True
+
+def _readRegionInto(f, start, end, out_file, size, keyword, dtype=float):
+    ''' Worker for readEclipseParallel: parse the block between byte offsets
+    start and end of file f into the memory-mapped array in out_file (of
+    `size` entries of `dtype`). Returns None, or an error message. '''
+    out = np.memmap(out_file, dtype=dtype, mode='r+', shape=(size,))
+    return _fillArray(_regionChunks(_mapFile(f), start, end), out, keyword)
+
+def readEclipseParallel(f, eclipse, extra_keywords=(), jobs=2):
+    ''' Read an Eclipse grdecl file like readEclipse, but parse the COORD,
+    ZCORN and property blocks (wherever they are in the file and its
+    INCLUDEs) in a pool of `jobs` processes.
+
+    The file tree is indexed first, so every block's size is known from
+    SPECGRID. Each block's array is then created as a memory-mapped temporary
+    file that a worker fills in place, so the results never have to be
+    pickled back to this process. Falls back to readEclipse if the file has
+    no SPECGRID, or if it or any of its INCLUDEs is compressed. '''
+    from concurrent.futures import ProcessPoolExecutor
+    import shutil
+    import tempfile
+
+    keywords = set(DEFAULT_KEYWORDS) | {k.upper() for k in extra_keywords}
+    blocks = {}
+    if not _collectBlocks(f, eclipse, keywords, blocks) or not eclipse.specgrid:
+        eclipse.files = []
+        readEclipse(f, eclipse, extra_keywords=extra_keywords)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='em2ex-')
+    try:
+        arrays = {}
+        futures = {}
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # Largest blocks first, so they don't end up waiting for a free worker
+            order = sorted(blocks, key=lambda k: _expectedSize(eclipse, k), reverse=True)
+            for keyword in order:
+                block_file, start, end = blocks[keyword]
+                size = _expectedSize(eclipse, keyword)
+                out_file = os.path.join(tmpdir, keyword)
+                dtype = eclipse.dtype(keyword)
+                arrays[keyword] = np.memmap(out_file, dtype=dtype, mode='w+', shape=(size,))
+                futures[keyword] = pool.submit(_readRegionInto, block_file, start, end,
+                                               out_file, size, keyword, dtype)
+
+            for keyword in order:
+                error = futures[keyword].result()
+                if error:
+                    print(error)
+                    exit()
+    finally:
+        # The arrays stay mapped after their files are removed
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for keyword in blocks:
+        if keyword == 'COORD':
+            eclipse.coord = arrays[keyword]
+        elif keyword == 'ZCORN':
+            eclipse.zcorn = arrays[keyword]
+        else:
+            eclipse.elemProps[keyword] = arrays[keyword]
 
     return
 
 
-def parseEclipse(f, args):
-    '''Parse the ECLIPSE file and return node coordinates and material properties'''
+class GridLayers(object):
+    '''Class giving the ZCORN and per-cell property data of a grid a range of
+    layers at a time. The data is held as (views of) the arrays as read, with
+    any subsetting and flipping already applied as views; the precision, unit
+    conversion, z flip and lateral refinement are applied to each range of
+    layers as it is taken. Only the layers asked for are read and transformed,
+    so a grid too large for memory can be processed in slabs.'''
+
+    def __init__(self, zcorn, elemProps, nx, ny, nz, float_type=np.float64,
+                 scale=None, flip_z=False, refine=None):
+        self._zcorn = zcorn
+        self._elemProps = elemProps
+        self._nx = nx
+        self._ny = ny
+        self._nz = nz
+        self._float_type = float_type
+        self._scale = scale
+        self._flip_z = flip_z
+        self._refine = tuple(refine) if refine else (1, 1)
+
+    # Number of elements (after lateral refinement)
+    @property
+    def nx(self):
+        return self._nx * self._refine[0]
+
+    @property
+    def ny(self):
+        return self._ny * self._refine[1]
+
+    @property
+    def nz(self):
+        return self._nz
+
+    # Names of the element properties
+    @property
+    def keywords(self):
+        return list(self._elemProps)
+
+    def props(self, k0, k1, keywords=None):
+        ''' Per-cell properties of layers k0 to k1 - 1, as flat arrays. Only
+        the properties in `keywords` are returned, if given. '''
+        props = {}
+        for prop, values in self._elemProps.items():
+            if keywords is not None and prop not in keywords:
+                continue
+            values = values[k0:k1]
+            # Integer keywords keep their own dtype; float properties follow the precision
+            if values.dtype.kind == 'f':
+                values = values.astype(self._float_type, copy=False)
+            props[prop] = values
+
+        rx, ry = self._refine
+        if rx > 1 or ry > 1:
+            return refineProps(props, self._nx, self._ny, k1 - k0, rx, ry)
+
+        return {prop: values.reshape(-1) for prop, values in props.items()}
+
+    def layers(self, k0, k1):
+        ''' ZCORN data, of shape (2 * (k1 - k0), 2 * ny, 2 * nx), and per-cell
+        properties of layers k0 to k1 - 1 '''
+        zcorn = np.asarray(self._zcorn[2*k0:2*k1], dtype=self._float_type)
+
+        if self._scale is not None:
+            zcorn = zcorn * self._scale
+
+        if self._flip_z:
+            zcorn = - zcorn
+
+        rx, ry = self._refine
+        if rx > 1 or ry > 1:
+            zcorn = refineZcorn(zcorn, self._nx, self._ny, k1 - k0, rx, ry)
+
+        return zcorn, self.props(k0, k1)
+
+def loadEclipse(f, args, reader=readEclipse, out_of_core=False):
+    '''Read the ECLIPSE file and check the data, returning an EclipseData object.
+    `reader` fills the EclipseData object from the file: readEclipse for ASCII
+    grdecl files, or readers.egrid.readEgrid for binary EGRID/GRID files.
+    If `out_of_core`, the arrays of a grdecl file are parsed into disk-backed
+    temporary files and integer keywords are kept as read, so that the data
+    doesn't have to fit in memory'''
 
     # Eclipse data object
     eclipse = EclipseData()
 
-    # Read the Eclipse grdecl file (with any user-supplied extra property keywords)
+    # Integer keywords: the built-in table plus any from --integer-keywords
+    integer_keywords = [k.upper() for k in getattr(args, 'integer_keywords', None) or ()]
+    eclipse.integerKeywords = set(INTEGER_KEYWORDS) | set(integer_keywords)
+
+    # Read the Eclipse file (with any user-supplied extra property keywords),
+    # unless an up-to-date copy of the parsed data is in the --cache-dir cache
     extra_keywords = getattr(args, 'extra_keywords', None) or ()
-    readEclipse(f, eclipse, extra_keywords=extra_keywords)
+    cache_dir = getattr(args, 'cache_dir', None)
+    cache_hit = False
+    with stage('read'):
+        if cache_dir:
+            from readers.parse_cache import loadParseCache
+            cache_hit = loadParseCache(cache_dir, f, eclipse, reader, extra_keywords, integer_keywords)
+        if not cache_hit:
+            jobs = getattr(args, 'jobs', 1) or 1
+            if (jobs > 1 or out_of_core) and reader is readEclipse:
+                # Also used with a single job out of core, as the blocks are
+                # parsed into memory-mapped temporary files
+                readEclipseParallel(f, eclipse, extra_keywords=extra_keywords, jobs=jobs)
+            else:
+                reader(f, eclipse, extra_keywords=extra_keywords)
 
-    # Check that required SPECGRID, COORD and ZCORN data has been supplied
-    if not eclipse.specgrid:
-        print("No SPECGRID data found in ", f)
-        exit()
+    with stage('validate'):
+        # Check that required SPECGRID, COORD and ZCORN data has been supplied
+        if not eclipse.specgrid:
+            print("No SPECGRID data found in ", f)
+            exit()
 
-    if not eclipse.coord:
-        print("No COORD data found in ", f)
-        exit()
+        if eclipse.coord is None:
+            print("No COORD data found in ", f)
+            exit()
 
-    if not eclipse.zcorn:
-        print("No ZCORN data found in ", f)
-        exit()
+        if eclipse.zcorn is None:
+            print("No ZCORN data found in ", f)
+            exit()
 
-    # Surface typos: any --extra-keywords value the file (or its INCLUDEs)
-    # never provided. Reported all at once so the user fixes them in one go.
-    missing = [k for k in extra_keywords if k not in eclipse.elemProps]
-    if missing:
-        print("--extra-keywords requested {} but the keyword was not found in {}".format(
-            ', '.join(missing), f))
-        exit()
+        # Surface typos: any --extra-keywords value the file (or its INCLUDEs)
+        # never provided. Reported all at once so the user fixes them in one go.
+        missing = [k for k in extra_keywords if k not in eclipse.elemProps]
+        if missing:
+            print("--extra-keywords requested {} but the keyword was not found in {}".format(
+                ', '.join(missing), f))
+            exit()
 
-    # Check the optional MAPAXES data
-    if args.use_mapaxes:
-        if eclipse.mapaxes:
-            if len(list(eclipse.mapaxes)) != 6:
-                print("The number of MAPAXES entries read is not correct")
-                exit()
+        # Check the optional MAPAXES data
+        if args.use_mapaxes:
+            if eclipse.mapaxes is not None:
+                if eclipse.mapaxes.size != 6:
+                    print("The number of MAPAXES entries read is not correct")
+                    exit()
+
+            if eclipse.gridunit:
+                if len(list(eclipse.gridunit)) > 2:
+                    print("The number of GRIDUNIT entries read is not correct")
+                    exit()
+
+                # The second element is either MAP or blank - if blank make it GRID
+                if len(list(eclipse.gridunit)) == 1:
+                    eclipse.gridunit.append("GRID")
+
+        # The number of elements in the x, y and z directions
+        nx = eclipse.nx
+        ny = eclipse.ny
+        nz = eclipse.nz
+
+        # Check the number of COORD entries parsed is correct (6 points per entry)
+        if (nx+1)*(ny+1)*6 != eclipse.coord.size:
+            print("The number of COORD entries read is not correct")
+            exit()
 
-        if eclipse.gridunit:
-            if len(list(eclipse.gridunit)) > 2:
-                print("The number of GRIDUNIT entries read is not correct")
+        # Check the number of ZCORN entries parsed is correct
+        if (2 * nx)*(2 * ny) *(2 * nz) != eclipse.zcorn.size:
+            print("The number of ZCORN entries read is not correct")
+            exit()
+
+        # Check all of the elemental properties that have been parsed
+        for prop in eclipse.elemProps:
+            if eclipse.elemProps[prop].size != nx * ny * nz:
+                print("The number of " + prop + " entries read is not correct")
                 exit()
 
-            # The second element is either MAP or blank - if blank make it GRID
-            if len(list(eclipse.gridunit)) == 1:
-                eclipse.gridunit.append("GRID")
+        # Store integer keywords in the smallest integer dtype that holds them.
+        # Extraction, refinement and flipping all preserve the dtype. Out of
+        # core, they are left in the (disk-backed) arrays they were read into.
+        if not out_of_core:
+            for prop in eclipse.elemProps:
+                if prop in eclipse.integerKeywords:
+                    eclipse.elemProps[prop] = compactIntegers(eclipse.elemProps[prop])
+
+    # Store the validated data in the cache before anything below modifies it
+    if cache_dir and not cache_hit:
+        with stage('save cache'):
+            from readers.parse_cache import saveParseCache
+            max_size = getattr(args, 'cache_max_gb', None)
+            saveParseCache(cache_dir, f, eclipse, reader, extra_keywords, integer_keywords,
+                           max_size=None if max_size is None else int(max_size * 1024**3))
+
+    # Notify user that parsing has finished
+    print("Finished parsing Eclipse file")
+
+    return eclipse
+
+def transformGrid(eclipse, args):
+    '''Apply the unit conversion, subsetting, coordinate-system normalisation,
+    translation, MAPAXES transform, z flip and lateral refinement requested in
+    args to the Eclipse data. Returns the transformed pillar (COORD) data, of
+    shape (ny+1, nx+1, 6), and a GridLayers object giving the transformed
+    ZCORN and per-cell property data a range of layers at a time'''
 
     # The number of elements in the x, y and z directions
     nx = eclipse.nx
     ny = eclipse.ny
     nz = eclipse.nz
 
-    # Check the number of COORD entries parsed is correct (6 points per entry)
-    if (nx+1)*(ny+1)*6 != len(list(eclipse.coord)):
-        print("The number of COORD entries read is not correct")
-        exit()
-
-    # Check the number of ZCORN entries parsed is correct
-    if (2 * nx)*(2 * ny) *(2 * nz) != len(list(eclipse.zcorn)):
-        print("The number of ZCORN entries read is not correct")
-        exit()
-
-    # Check all of the elemental properties that have been parsed
-    for prop in eclipse.elemProps:
-        if eclipse.elemProps[prop].size != nx * ny * nz:
-            print("The number of " + prop + " entries read is not correct")
-            exit()
-
-    # Notify user that parsing has finished
-    print("Finished parsing Eclipse file")
-
     # Determine the grid's length unit from GRIDUNIT (default METRES if absent).
     # Print an info note for any recognised non-METRES unit so the user is aware,
     # plus a hint about --convert-to-m if they want the output in SI.
@@ -285,24 +885,31 @@ def parseEclipse(f, args):
         print("--convert-to-m: unrecognised GRIDUNIT value {!r}; cannot convert.".format(grid_unit))
         exit()
 
+    # Floating point type of the geometry and properties from here on:
+    # float32 with --precision single, halving the memory of every array
+    float_type = np.float32 if getattr(args, 'precision', 'double') == 'single' else np.float64
+
     # Now the data can be reshaped and processed for easy use
     # The COORD data has six entries for each of the (nx+1)*(ny+1) nodes
-    coord = np.asarray(eclipse.coord).reshape(ny+1, nx+1, 6)
+    coord = np.asarray(eclipse.coord, dtype=float_type).reshape(ny+1, nx+1, 6)
 
     # Reshape ZCORN early so subsetting (--extract-*) can slice it. The reshape
     # is independent of any later coord transforms (flip / translate / mapaxes /
     # flip_z), all of which leave the (k, j, i) cell indexing unchanged.
+    # ZCORN and the properties are only sliced and flipped here (as views);
+    # their values are transformed by GridLayers as layers are taken.
     zcorn = np.asarray(eclipse.zcorn).reshape(2*nz, 2*ny, 2*nx)
+    elemProps = {prop: np.asarray(values).reshape(nz, ny, nx)
+                 for prop, values in eclipse.elemProps.items()}
 
     # Apply --convert-to-m if requested: rescale every length-valued array by
     # the GRIDUNIT->metres factor. coord stores x/y/z for both pillar
-    # endpoints (all 6 entries are coordinates); zcorn stores z values only.
-    # Done here, before extract/refine/flip, so the rest of the pipeline
-    # operates in metres.
+    # endpoints (all 6 entries are coordinates); zcorn stores z values only
+    # (and is rescaled by GridLayers).
+    factor = None
     if do_convert:
         factor = GRIDUNIT_TO_METRES[grid_unit]
         coord = coord * factor
-        zcorn = zcorn * factor
         print("Converted {} -> metres on output (factor {}).".format(grid_unit, factor))
 
     # Apply --extract-i/-j/-k subsetting if requested. Indices are 1-based
@@ -317,8 +924,8 @@ def parseEclipse(f, args):
         i_lo, i_hi = _resolve_extract_range(extract_i, nx, 'i')
         j_lo, j_hi = _resolve_extract_range(extract_j, ny, 'j')
         k_lo, k_hi = _resolve_extract_range(extract_k, nz, 'k')
-        coord, zcorn, eclipse.elemProps, nx, ny, nz = extractSubgrid(
-            coord, zcorn, eclipse.elemProps, nx, ny, nz,
+        coord, zcorn, elemProps, nx, ny, nz = extractSubgrid(
+            coord, zcorn, elemProps, nx, ny, nz,
             i_lo, i_hi, j_lo, j_hi, k_lo, k_hi)
 
     # The exodus node numbering relies on a right-hand coordinate system, with
@@ -328,7 +935,6 @@ def parseEclipse(f, args):
     # exodus mesh is created. Therefore, we flip the decreasing coordinate, create
     # the grid, then flip the coordinate again.
 
-    flip_x, flip_y = False, False
     if (coord[:,:,0][0,-1] - coord[:,:,0][0,0] < 0):
         # x coordinates are in decreasing order — reverse all pillar data along column axis
         coord = coord[:, ::-1, :]
@@ -338,10 +944,7 @@ def parseEclipse(f, args):
         # cell — exactly the transformation a mirror-in-x requires.
         zcorn = zcorn[:, :, ::-1]
         # Flip every per-cell property so they stay consistent with coord.
-        for _prop in list(eclipse.elemProps):
-            eclipse.elemProps[_prop] = np.flip(
-                eclipse.elemProps[_prop].reshape(nz, ny, nx), 2).flatten()
-        flip_x = True
+        elemProps = {prop: values[:, :, ::-1] for prop, values in elemProps.items()}
 
     if (coord[:,:,1][-1,0] - coord[:,:,1][0,0] < 0):
         # y coordinates are in decreasing order — reverse all pillar data along row axis
@@ -349,10 +952,7 @@ def parseEclipse(f, args):
         # Flip zcorn along the y-axis (same logic as x above).
         zcorn = zcorn[:, ::-1, :]
         # Flip every per-cell property along y.
-        for _prop in list(eclipse.elemProps):
-            eclipse.elemProps[_prop] = np.flip(
-                eclipse.elemProps[_prop].reshape(nz, ny, nx), 1).flatten()
-        flip_y = True
+        elemProps = {prop: values[:, ::-1, :] for prop, values in elemProps.items()}
 
     # Translate the coordinates if the translate commandline option is specified
     if args.translate:
@@ -364,7 +964,7 @@ def parseEclipse(f, args):
     # MAPAXES exists and GRIDUNIT exists and GRIDUNIT = GRID
     if args.use_mapaxes:
 
-        if not eclipse.mapaxes:
+        if eclipse.mapaxes is None:
             print("No MAPAXES keyword exists, so don't specify --mapaxes")
             exit()
 
@@ -397,196 +997,285 @@ def parseEclipse(f, args):
                 coord[:,:,xi] = xorigin + xdata * xvec[0] + ydata * yvec[0]
                 coord[:,:,yi] = yorigin + xdata * xvec[1] + ydata * yvec[1]
 
-    # Flip the Z coordinates if specified
-    if args.flip_z:
-        zcorn = - zcorn
-
     # Apply lateral (x, y) refinement if requested. Pillars are linearly
-    # interpolated; per-cell tops and bottoms are bilinearly interpolated within
-    # each parent (which preserves faults); element properties are inherited by
-    # all child cells of each parent.
-    if getattr(args, 'refine_xy', None):
-        rx, ry = args.refine_xy
-        coord, zcorn, eclipse.elemProps, nx, ny = refineLaterally(
-            coord, zcorn, eclipse.elemProps, nx, ny, nz, rx, ry)
-
-    # Transform coord data to zcorn format (so that there is an x and y coordinate
-    # for each node in the grid)
-    xcorn, ycorn = coordToCorn(coord, nz)
-
-    # Now transform all of the coordinate arrays into element-ordered array, where
-    # each row corresponds to a single element containing eight corners
-    elemcornx = elemCornerCoords(xcorn)
-    elemcorny = elemCornerCoords(ycorn)
-    elemcornz = elemCornerCoords(zcorn)
-
-    # Some elements may be inactive (ACTNUM = 0), so don't count them
-    if 'ACTNUM' in eclipse.elemProps:
-        active_elements = eclipse.elemProps['ACTNUM'].reshape(nz, ny, nx).astype(int)
-    else:
-        # All elements are active
-        active_elements = np.ones((nz, ny, nx), dtype = int)
-
-    # Check for pinched elements (coincident corners within pinch_tol).
-    # Always detect so a count can be reported; only remove when --pinch is passed.
-    distorted = distortedElem(elemcornx, elemcorny, elemcornz, args.pinch_tol).reshape(nz, ny, nx)
-    n_pinched = int((distorted & (active_elements > 0)).sum())
-    if args.no_pinch:
-        if n_pinched > 0:
-            print('{} pinched element(s) removed'.format(n_pinched))
-        active_elements[distorted] = 0
-    elif n_pinched > 0:
-        print('Note: {} element(s) have coincident corners (pinched) and will be '
-              'invalid in FEM solvers. Use --pinch to remove them.'.format(n_pinched))
+    # interpolated here; per-cell tops and bottoms are bilinearly interpolated
+    # within each parent by GridLayers (which preserves faults); element
+    # properties are inherited by all child cells of each parent.
+    refine = getattr(args, 'refine_xy', None)
+    if refine:
+        coord = refineCoord(coord, *refine)
+
+    grid = GridLayers(zcorn, elemProps, nx, ny, nz, float_type=float_type,
+                      scale=factor, flip_z=args.flip_z, refine=refine)
+
+    return coord, grid
+
+def parseEclipse(f, args, reader=readEclipse):
+    '''Parse the ECLIPSE file and return node coordinates and material properties.
+    `reader` fills the EclipseData object from the file: readEclipse for ASCII
+    grdecl files, or readers.egrid.readEgrid for binary EGRID/GRID files'''
+
+    eclipse = loadEclipse(f, args, reader)
+
+    with stage('transform geometry'):
+        coord, grid = transformGrid(eclipse, args)
+        nx, ny, nz = grid.nx, grid.ny, grid.nz
+        zcorn, eclipse.elemProps = grid.layers(0, nz)
+
+    with stage('active cells'):
+        # Some elements may be inactive (ACTNUM = 0). From here on only the
+        # active cells are gathered, checked and numbered, so the work and
+        # memory scale with the number of active cells rather than the grid.
+        if 'ACTNUM' in eclipse.elemProps:
+            active_elements = (eclipse.elemProps['ACTNUM'].reshape(nz, ny, nx) > 0).astype(np.int8)
+        else:
+            # All elements are active
+            active_elements = np.ones((nz, ny, nx), dtype = np.int8)
+
+        # Flat (k, j, i) indices of the active cells
+        cells = np.flatnonzero(active_elements)
+
+    with stage('corner coordinates'):
+        # Gather the corner z coordinates of the active elements into an
+        # element-ordered array, where each row contains the eight corners of
+        # an element. The x and y coordinates of the corners are those of
+        # their pillars, so are gathered from the coord data as needed.
+        geometry = CornerGeometry(coord, zcorn, cells)
+
+    def removeCells(remove):
+        # Deactivate the active cells flagged in remove
+        active_elements.reshape(-1)[cells[remove]] = 0
+        geometry.remove(remove)
+        return geometry.cells
+
+    with stage('pinch check'):
+        # Check for pinched elements (coincident corners within pinch_tol).
+        # Always detect so a count can be reported; only remove when --pinch is passed.
+        distorted = geometry.mapChunks(lambda x, y, z: distortedElem(x, y, z, args.pinch_tol),
+                                       jobs=getattr(args, 'jobs', 1) or 1)
+        n_pinched = int(distorted.sum())
+        if args.no_pinch:
+            if n_pinched > 0:
+                print('{} pinched element(s) removed'.format(n_pinched))
+            cells = removeCells(distorted)
+        elif n_pinched > 0:
+            print('Note: {} element(s) have coincident corners (pinched) and will be '
+                  'invalid in FEM solvers. Use --pinch to remove them.'.format(n_pinched))
 
     # Optionally remove elements with non-positive Jacobian (degenerate or inverted).
     # Off by default (faithful conversion); enabled with --remove-distorted.
+    quality = None
     if getattr(args, 'remove_distorted', False):
-        from readers.reader_utils import nonPositiveJacobianElems
-        # When z is flipped, the top/bottom corner swap applied later to elemNodes
-        # (corners [4,5,6,7,0,1,2,3]) restores positive Jacobians. Apply the same
-        # permutation here so the check reflects the final assembled element orientation.
-        cx, cy, cz = elemcornx, elemcorny, elemcornz
-        if args.flip_z:
-            perm = [4, 5, 6, 7, 0, 1, 2, 3]
-            cx, cy, cz = cx[:, perm], cy[:, perm], cz[:, perm]
-        bad_jac = nonPositiveJacobianElems(cx, cy, cz).reshape(nz, ny, nx)
-        newly_removed = bad_jac & (active_elements > 0)
-        n_removed = int(newly_removed.sum())
-        if n_removed > 0:
-            n_active = int((active_elements > 0).sum())
-            if n_removed == n_active:
-                print('Warning: --remove-distorted would remove all {} active element(s). '
-                      'Skipping removal — check grid orientation (try --flip).'.format(n_active))
-            else:
-                print('{} element(s) with zero or negative element Jacobian removed'.format(n_removed))
-                active_elements[bad_jac] = 0
-
-    # The number of active elements is
-    num_active_elements = np.count_nonzero(active_elements)
-
-    # Generate the connection data by numbering all unique nodes in the mesh
-    elemNodes = numberNodesInElems(elemcornz, active_elements)
-
-    # Construct the nodeIds for all corners in all elements. Inactive cells
-    # contribute zeros (no node IDs written), matching the per-cell loop's
-    # behaviour. Permute the per-cell corner axis into (kk, jj, ii) flat order,
-    # zero inactive cells, then interleave the (kk, jj, ii) sub-axis into
-    # (2*nz, 2*ny, 2*nx).
-    permuted = np.zeros_like(elemNodes)
-    permuted[..., _CORNER_TO_KJI] = elemNodes
-    permuted *= active_elements.astype(bool)[..., None]
-    nodeIds = (permuted.reshape(nz, ny, nx, 2, 2, 2)
-                       .transpose(0, 3, 1, 4, 2, 5)
-                       .reshape(2 * nz, 2 * ny, 2 * nx)
-                       .astype(float))
+        with stage('remove distorted'):
+            from readers.mesh_quality import MeshQuality, qualityMetrics
+            # When z is flipped, the top/bottom corner swap applied later to elemNodes
+            # (corners [4,5,6,7,0,1,2,3]) restores positive Jacobians. Apply the same
+            # permutation here so the check reflects the final assembled element orientation.
+            # All of the mesh quality metrics needed later are found at the same time,
+            # and kept (for the elements that remain) for the Jacobian check and output.
+            perm = [4, 5, 6, 7, 0, 1, 2, 3] if args.flip_z else None
+            quality = MeshQuality(len(cells))
+            quality.compute(lambda rows: geometry.corners(rows, perm), qualityMetrics(args),
+                            jobs=getattr(args, 'jobs', 1) or 1)
+            bad_jac = quality.minJacobian <= 0
+            n_removed = int(bad_jac.sum())
+            if n_removed > 0:
+                n_active = len(cells)
+                if n_removed == n_active:
+                    print('Warning: --remove-distorted would remove all {} active element(s). '
+                          'Skipping removal — check grid orientation (try --flip).'.format(n_active))
+                else:
+                    print('{} element(s) with zero or negative element Jacobian removed'.format(n_removed))
+                    cells = removeCells(bad_jac)
+                    quality.remove(bad_jac)
+
+    with stage('number nodes'):
+        # The number of active elements is
+        num_active_elements = len(cells)
+
+        # Generate the connection data by numbering all unique nodes of the
+        # active elements. The nodes of a conforming (unfaulted) grid are the
+        # points of a structured lattice, so they are numbered without
+        # merging corners.
+        levels = conformingLevels(zcorn)
+        if levels is not None:
+            with stage('lattice'):
+                elemNodes, first_corners = numberLatticeNodes(levels, cells, (nz, ny, nx))
+        else:
+            with stage('merge corners'):
+                elemNodes, first_corners, _ = numberActiveNodes(geometry.z, cells, (nz, ny, nx),
+                                                                jobs=getattr(args, 'jobs', 1) or 1)
 
-    # The number of active nodes is
-    num_active_nodes = np.max(nodeIds).astype(int)
+        # The number of active nodes is
+        num_active_nodes = len(first_corners)
 
-    # Also require the element ids for setting the sidesets. Note that the internal
-    # exodus element numbering is for each block in turn (ie. all elements in block 1
-    # are numbered consecutively, then all elements in the next block, etc.)
+    with stage('element ids'):
+        # Also require the element ids for setting the sidesets. Note that the internal
+        # exodus element numbering is for each block in turn (ie. all elements in block 1
+        # are numbered consecutively, then all elements in the next block, etc.)
 
-    # Block IDs (needed to provide correct element numbering)
-    if 'SATNUM' in eclipse.elemProps:
-        blocks = eclipse.elemProps['SATNUM'].astype(int).reshape((nz, ny, nx))
-    else:
-        blocks = np.zeros((nz, ny, nx), dtype=int)
-
-    # Give each active element an ID from 1 to num_active_elements. Numbering
-    # walks block IDs in ascending order (matching np.unique(blocks)); within
-    # each block, cells are visited in (k, j, i) C-order. A stable sort by
-    # block ID preserves that within-block order, and a cumulative count over
-    # the sorted active mask assigns the sequential IDs in one pass.
-    flat_blocks = blocks.flatten()
-    flat_active = active_elements.flatten() > 0
-    order = np.argsort(flat_blocks, kind='stable')
-    active_sorted = flat_active[order]
-    ids_sorted = np.zeros(flat_blocks.size, dtype=int)
-    ids_sorted[active_sorted] = np.arange(1, int(active_sorted.sum()) + 1)
-    elemIds = np.empty(flat_blocks.size, dtype=int)
-    elemIds[order] = ids_sorted
-    elemIds = elemIds.reshape(nz, ny, nx)
-
-    # Detect fault faces while elemNodes is still 4D and elemIds is in (k,j,i)
-    # layout. Recorded here, appended as paired sidesets after addSideSets runs.
+        # Block IDs (needed to provide correct element numbering) of the active elements
+        if 'SATNUM' in eclipse.elemProps:
+            blocks = eclipse.elemProps['SATNUM'].reshape(-1)[cells]
+        else:
+            blocks = np.zeros(len(cells), dtype=np.int8)
+
+        # Give each active element an ID from 1 to num_active_elements. Numbering
+        # walks block IDs in ascending order (matching np.unique(blocks)); within
+        # each block, cells are visited in (k, j, i) C-order, which a stable sort
+        # by block ID preserves.
+        order = np.argsort(blocks, kind='stable')
+        ids = np.empty(len(cells), dtype=int)
+        ids[order] = np.arange(1, len(cells) + 1)
+        elemIds = np.zeros(nz * ny * nx, dtype=int)
+        elemIds[cells] = ids
+        elemIds = elemIds.reshape(nz, ny, nx)
+
+    # Detect fault faces from the (k, j, i) layout of the element nodes and ids.
+    # Recorded here, appended as paired sidesets after addSideSets runs.
     if getattr(args, 'fault_sidesets', False):
-        fault_data = _detectFaultFaces(elemNodes, elemIds, active_elements)
+        with stage('fault faces'):
+            fault_data = _detectFaultFaces(scatterElemNodes(elemNodes, cells, (nz, ny, nx)),
+                                           elemIds, active_elements)
     else:
         fault_data = None
 
-    # Order the coordinates according to the node numbering
-    elemNodes = elemNodes.reshape(nz*ny*nx, 8)
-
-    xcoords = elemCornToCoord(elemcornx, elemNodes)
-    ycoords = elemCornToCoord(elemcorny, elemNodes)
-    zcoords = elemCornToCoord(elemcornz, elemNodes)
-
-    # Remove any zeros (nodes start at 1)
-    elemNodes = elemNodes[~np.any(elemNodes == 0, axis=1)]
+    with stage('node coordinates'):
+        # Each node is at its first active corner, which the numbering gives
+        # in node order, so the coordinates are gathered in a single pass
+        if levels is not None:
+            xcoords, ycoords, zcoords = latticeNodeCoords(coord, levels, cells, first_corners)
+        else:
+            xcoords, ycoords, zcoords = geometry.cornerCoords(first_corners)
 
-    # Reorder elemNodes for correct ordering if flipped
-    if args.flip_z:
-        elemNodes = elemNodes[:, [4, 5, 6, 7, 0, 1, 2, 3]]
+        # Reorder elemNodes for correct ordering if flipped
+        connectivity = elemNodes
+        if args.flip_z:
+            connectivity = elemNodes[:, [4, 5, 6, 7, 0, 1, 2, 3]]
 
-    # Strip inactive elements from every property. Properties (and active_elements
-    # itself) were already flipped consistently with coord at the flip-detection
-    # step above, so no further spatial reordering is needed here.
-    active_mask = active_elements.flatten() > 0
-    for prop in eclipse.elemProps:
-        eclipse.elemProps[prop] = eclipse.elemProps[prop][active_mask]
+        # Keep only the active elements' properties. Properties (and active_elements
+        # itself) were already flipped consistently with coord at the flip-detection
+        # step above, so no further spatial reordering is needed here.
+        for prop in eclipse.elemProps:
+            eclipse.elemProps[prop] = eclipse.elemProps[prop].reshape(-1)[cells]
 
     # Add data to the ExodusModel object
     model = ExodusModel()
     model.xcoords = xcoords
     model.ycoords = ycoords
     model.zcoords = zcoords
-    model.nodeIds = nodeIds
     model.elemIds = elemIds
-    model.elemNodes = elemNodes
+    model.elemNodes = connectivity
     model.elemVars = eclipse.elemProps
     model.numElems = num_active_elements
     model.numNodes = num_active_nodes
-    model.blockIds = blocks.flatten()[active_elements.flatten()>0]
+    model.blockIds = blocks
+    model.quality = quality
+
+    with stage('sidesets'):
+        addBoundarySideSets(model, args, fault_data)
+
+    with stage('nodesets'):
+        # The node ids of the corners are only needed a few layers at a time
+        nodeSets = None
+        if not args.omit_nodesets:
+            nodeSets = activeNodeSets(elemNodes, cells, active_elements)
+        addBoundaryNodeSets(model, args, nodeSets)
+
+    return model
+
+def cornerNodeIds(elemNodes, active_elements):
+    ''' The node ids of all corners of all elements, of shape (2*nz, 2*ny, 2*nx)
+    in the zcorn layout. Inactive cells contribute zeros (no node IDs written),
+    matching the per-cell loop's behaviour. '''
+    nz, ny, nx = active_elements.shape
+
+    # Permute the per-cell corner axis into (kk, jj, ii) flat order, zero
+    # inactive cells, then interleave the (kk, jj, ii) sub-axis into
+    # (2*nz, 2*ny, 2*nx).
+    permuted = np.zeros_like(elemNodes)
+    permuted[..., _CORNER_TO_KJI] = elemNodes
+    permuted *= active_elements.astype(bool)[..., None]
+    return (permuted.reshape(nz, ny, nx, 2, 2, 2)
+                    .transpose(0, 3, 1, 4, 2, 5)
+                    .reshape(2 * nz, 2 * ny, 2 * nx))
+
+def scatterElemNodes(elemNodes, cells, shape):
+    ''' The node ids of the active elements, with flat (k, j, i) indices
+    `cells`, laid out on the grid of `shape` (nz, ny, nx): an array of shape
+    (nz, ny, nx, 8) with zeros for inactive cells '''
+    grid = np.zeros(tuple(shape) + (8,), dtype=elemNodes.dtype)
+    grid.reshape(-1, 8)[cells] = elemNodes
+    return grid
+
+def activeNodeSets(elemNodes, cells, active_elements):
+    ''' The bottom, front, left, right, back and top nodesets that addNodeSets
+    finds from the corner node ids (see cornerNodeIds), from the node ids of
+    the active elements with flat (k, j, i) indices `cells`. The corner node
+    ids are built a few layers at a time, so are never held for the whole
+    grid. '''
+    nz, ny, nx = active_elements.shape
+    layers = max(1, _NODE_CHUNK_CORNERS // max(1, 8 * ny * nx))
+    node_sets = BoundarySets()
+    for k0 in range(0, nz, layers):
+        k1 = min(k0 + layers, nz)
+        lo, hi = np.searchsorted(cells, [k0 * ny * nx, k1 * ny * nx])
+        slab = scatterElemNodes(elemNodes[lo:hi], cells[lo:hi] - k0 * ny * nx, (k1 - k0, ny, nx))
+        node_sets.add(cornerNodeIds(slab, active_elements[k0:k1]))
+    return node_sets.sets()
+
+def addBoundarySideSets(model, args, fault_data=None, sideSets=None):
+    ''' Add the sidesets on the boundaries of the model, unless --no-sidesets
+    is given, followed by the fault sidesets if `fault_data` (as returned by
+    _detectFaultFaces) is given. The boundary sidesets are found from
+    model.elemIds unless they are given as `sideSets`. '''
 
     # Add sidesets if required
     if args.omit_sidesets:
         model.numSideSets = 0
-    else:
-        addSideSets(model)
+        return
+
+    addSideSets(model, sideSets)
 
-        # And flip the top and bottom ids if mesh is flipped
+    # And flip the top and bottom ids if mesh is flipped
+    if args.flip_z:
+        model.sideSetSides[0], model.sideSetSides[5] = model.sideSetSides[5], model.sideSetSides[0]
+        model.sideSetNames[0], model.sideSetNames[5] = model.sideSetNames[5], model.sideSetNames[0]
+
+    # Append fault sidesets if requested. Each fault face produces two
+    # sideset entries: one for the "primary" cell's face, one for the
+    # "secondary" cell's face. flip_z swaps the kk_lo/kk_hi side numbers
+    # (5 <-> 6) so k-direction fault entries need the same correction.
+    if fault_data is not None:
+        p_elems, p_sides, s_elems, s_sides = fault_data
         if args.flip_z:
-            model.sideSetSides[0], model.sideSetSides[5] = model.sideSetSides[5], model.sideSetSides[0]
-            model.sideSetNames[0], model.sideSetNames[5] = model.sideSetNames[5], model.sideSetNames[0]
-
-        # Append fault sidesets if requested. Each fault face produces two
-        # sideset entries: one for the "primary" cell's face, one for the
-        # "secondary" cell's face. flip_z swaps the kk_lo/kk_hi side numbers
-        # (5 <-> 6) so k-direction fault entries need the same correction.
-        if fault_data is not None:
-            p_elems, p_sides, s_elems, s_sides = fault_data
-            if args.flip_z:
-                p_sides = [{5: 6, 6: 5}.get(s, s) for s in p_sides]
-                s_sides = [{5: 6, 6: 5}.get(s, s) for s in s_sides]
-            model.sideSets.extend([np.asarray(p_elems, dtype=int),
-                                   np.asarray(s_elems, dtype=int)])
-            model.sideSetSides.extend([p_sides, s_sides])
-            model.sideSetNames.extend(['fault_primary', 'fault_secondary'])
-            model.numSideSets = len(model.sideSets)
+            p_sides = [{5: 6, 6: 5}.get(s, s) for s in p_sides]
+            s_sides = [{5: 6, 6: 5}.get(s, s) for s in s_sides]
+        model.sideSets.extend([np.asarray(p_elems, dtype=int),
+                               np.asarray(s_elems, dtype=int)])
+        model.sideSetSides.extend([p_sides, s_sides])
+        model.sideSetNames.extend(['fault_primary', 'fault_secondary'])
+        model.numSideSets = len(model.sideSets)
+
+    return
+
+def addBoundaryNodeSets(model, args, nodeSets=None):
+    ''' Add the nodesets on the boundaries of the model, unless --no-nodesets
+    is given. The nodesets are found from model.nodeIds unless they are given
+    as `nodeSets`. '''
 
     # Add nodesets if required
     if args.omit_nodesets:
         model.numNodeSets = 0
-    else:
-        addNodeSets(model)
+        return
 
-        # And flip the top and bottom ids if mesh is flipped
-        if args.flip_z:
-            model.nodeSetNames[0], model.nodeSetNames[5] = model.nodeSetNames[5], model.nodeSetNames[0]
+    addNodeSets(model, nodeSets)
 
-    return model
+    # And flip the top and bottom ids if mesh is flipped
+    if args.flip_z:
+        model.nodeSetNames[0], model.nodeSetNames[5] = model.nodeSetNames[5], model.nodeSetNames[0]
+
+    return
 
 # Corner-index permutation between the zcorn (kk, jj, ii) layout (flat index
 # kk*4 + jj*2 + ii) and the eight-corner element ordering used downstream:
@@ -600,61 +1289,51 @@ def parseEclipse(f, args):
 #   element corner 7 -> (kk=1, jj=1, ii=0) flat 6
 _CORNER_TO_KJI = [0, 1, 3, 2, 4, 5, 7, 6]
 
-def elemCornerCoords(corner_coords):
-    ''' Returns coordinates for all eight corners of each element. Input is
-    shape (2*nz, 2*ny, 2*nx); output is shape (nz*ny*nx, 8) ordered in the
-    eight-corner element layout. '''
-    dnz, dny, dnx = corner_coords.shape
-    nz, ny, nx = dnz // 2, dny // 2, dnx // 2
-    # (2nz, 2ny, 2nx) -> (nz, 2, ny, 2, nx, 2) -> (nz, ny, nx, 2_kk, 2_jj, 2_ii)
-    c = (corner_coords.reshape(nz, 2, ny, 2, nx, 2)
-                      .transpose(0, 2, 4, 1, 3, 5)
-                      .reshape(nz * ny * nx, 8))
-    return c[:, _CORNER_TO_KJI]
-
-def coordToCorn(coord, nz):
-    ''' Transform coord data (x, y) coordinates to (x, y) corners for each node '''
-
-    # Extract x and y coordinates from coord data
-    xdata = np.asarray(coord[:,:,0])
-    ydata = np.asarray(coord[:,:,1])
-
-    # Repeat all internal coordinates to double the size of the arrays
-    xcorn = np.repeat(np.repeat(xdata, 2, axis=0), 2, axis=1)[1:-1,1:-1]
-    ycorn = np.repeat(np.repeat(ydata, 2, axis=0), 2, axis=1)[1:-1,1:-1]
-
-    # Pillars do not vary with k, so the (2*ny, 2*nx) layer is the same for
-    # every k-slice. np.broadcast_to returns a zero-copy read-only view of
-    # shape (2*nz, 2*ny, 2*nx); the downstream reshape inside
-    # elemCornerCoords forces a single contiguous copy at use time, rather
-    # than allocating the full layered array up-front.
-    xcorn = np.broadcast_to(xcorn, (2 * nz,) + xcorn.shape)
-    ycorn = np.broadcast_to(ycorn, (2 * nz,) + ycorn.shape)
-
-    return xcorn, ycorn
-
-def elemCornToCoord(elemcorns, elemNodes):
-    ''' Transform coordinate data for each element corner to a unique node ordered
-    list of coordinates '''
-
-    nodes, idx = np.unique(elemNodes, return_index=True)
-    coords = elemcorns.flatten()[idx][np.nonzero(elemNodes.flatten()[idx])]
-
-    return coords
-
 def distortedElem(elemcornx, elemcorny, elemcornz, tol):
     ''' Returns a boolean array (numelems,) that is True for elements where any
     two corners are coincident within tol. Distorted/pinched-out elements have
-    two or more corners at the same (x, y, z) location. '''
-    from itertools import combinations
-    corners = np.stack([elemcornx, elemcorny, elemcornz], axis=2)  # (numelems, 8, 3)
-    distorted = np.zeros(corners.shape[0], dtype=bool)
-    for a, b in combinations(range(8), 2):
-        dist = np.linalg.norm(corners[:, a, :] - corners[:, b, :], axis=1)
-        distorted |= dist < tol
+    two or more corners at the same (x, y, z) location.
+
+    The elements are checked a cache-sized chunk at a time, comparing squared
+    corner distances against tol**2 in reused scratch arrays. The corners on
+    the same pillar are compared first, so a chunk of a pinched-out layer
+    (where every element's top and bottom meet) is done after those pairs. '''
+    n = len(elemcornx)
+    distorted = np.zeros(n, dtype=bool)
+    tol2 = tol * tol
+    size = min(n, _PINCH_CHUNK_CELLS)
+    dist2 = np.empty(size, dtype=np.float64)
+    diff = np.empty(size, dtype=np.float64)
+    close = np.empty(size, dtype=bool)
+
+    for start in range(0, n, _PINCH_CHUNK_CELLS):
+        stop = min(start + _PINCH_CHUNK_CELLS, n)
+        m = stop - start
+        out = distorted[start:stop]
+        for p, (a, b) in enumerate(_CORNER_PAIRS):
+            if p == 4 and out.all():
+                break
+            np.subtract(elemcornx[start:stop, a], elemcornx[start:stop, b], out=diff[:m])
+            np.multiply(diff[:m], diff[:m], out=dist2[:m])
+            for corn in (elemcorny, elemcornz):
+                np.subtract(corn[start:stop, a], corn[start:stop, b], out=diff[:m])
+                diff[:m] *= diff[:m]
+                dist2[:m] += diff[:m]
+            np.less(dist2[:m], tol2, out=close[:m])
+            out |= close[:m]
+
     return distorted
 
 
+# The 28 pairs of corners of an element, those on the same pillar (top and
+# bottom of the element) first
+_CORNER_PAIRS = [(c, c + 4) for c in range(4)] + [
+    (a, b) for a, b in combinations(range(8), 2) if b != a + 4]
+
+# Number of elements distortedElem checks at a time (its scratch arrays fit
+# in cache)
+_PINCH_CHUNK_CELLS = 1 << 13
+
 
 # Pillar (j, i) offsets per element corner — see _CORNER_TO_KJI for the corner
 # layout convention. Each corner sits on the pillar at (j + dj, i + di) of its
@@ -662,83 +1341,460 @@ def distortedElem(elemcornx, elemcorny, elemcornz, tol):
 _CORNER_PILLAR_DJ = np.array([0, 0, 1, 1, 0, 0, 1, 1])
 _CORNER_PILLAR_DI = np.array([0, 1, 1, 0, 0, 1, 1, 0])
 
+# Layer (k) offset per element corner: corners 0 to 3 are on the top of the
+# cell, 4 to 7 on the bottom
+_CORNER_LEVEL_DK = np.array([0, 0, 0, 0, 1, 1, 1, 1])
+
+# Target number of corner slots handled by each pillar chunk when numbering
+# nodes (bounds the temporary memory of the per-pillar sorts)
+_NODE_CHUNK_CORNERS = 1 << 22
+
+# Number of cells whose corner x and y coordinates are gathered at a time by
+# CornerGeometry (bounds the memory of the per-element corner checks)
+_GEOMETRY_CHUNK_CELLS = 1 << 18
 
-def numberNodesInElems(elemcornz, active_elements):
-    ''' Number all unique nodes in the grid, fault-aware.
 
-    Two corners are the same node iff they share a pillar and have equal z
-    within tolerance. Implemented as a single lexsort on (pillar_id, z): every
-    contiguous run in the sorted array (where pillars match and z gaps stay
-    below `np.isclose`'s combined tolerance) is one node. Nodes are numbered
-    by the smallest (k, j, i, corner) flat index at which an active cell first
-    touches them, which matches the order the original loop assigned IDs.
-    Inactive corners stay zero so the downstream filter drops their cells.
+def activeCornerCoords(corner_coords, cells):
+    ''' Coordinates of the eight corners of the cells with flat (k, j, i)
+    indices `cells`, of shape (len(cells), 8) in the eight-corner element
+    layout. Input is shape (2*nz, 2*ny, 2*nx), as ZCORN is; only the corners
+    of the given cells are gathered (the corner x and y coordinates are
+    gathered from the pillars by CornerGeometry instead). The result is
+    column-major, so each corner's coordinates are contiguous (as the
+    pairwise corner checks read them). '''
+    dnz, dny, dnx = corner_coords.shape
+    k, j, i = np.unravel_index(cells, (dnz // 2, dny // 2, dnx // 2))
+
+    values = np.ascontiguousarray(corner_coords).reshape(-1)
+    first = (2 * k * dny + 2 * j) * dnx + 2 * i
+    offsets = (_CORNER_LEVEL_DK * dny + _CORNER_PILLAR_DJ) * dnx + _CORNER_PILLAR_DI
+
+    corners = np.empty((len(cells), 8), dtype=corner_coords.dtype, order='F')
+    for c in range(8):
+        values.take(first + offsets[c], out=corners[:, c])
+    return corners
+
+
+class CornerGeometry(object):
+    '''Class giving the eight corner coordinates of each of the cells with
+    flat (k, j, i) indices `cells`. Every corner lies on a pillar, and its x
+    and y coordinates are those of the top of the pillar, so only the z
+    coordinates (from ZCORN) are held per corner; x and y are kept as the
+    (ny+1, nx+1) pillar tables and gathered for a chunk of cells at a time as
+    they are needed.'''
+
+    def __init__(self, coord, zcorn, cells):
+        dnz, dny, dnx = zcorn.shape
+        self._shape = (dnz // 2, dny // 2, dnx // 2)
+        self._pillarx = np.ascontiguousarray(coord[:, :, 0]).reshape(-1)
+        self._pillary = np.ascontiguousarray(coord[:, :, 1]).reshape(-1)
+        self._cells = cells
+        self._z = activeCornerCoords(zcorn, cells)
+
+    # Flat (k, j, i) indices of the cells
+    @property
+    def cells(self):
+        return self._cells
+
+    # Corner z coordinates of the cells, of shape (len(cells), 8)
+    @property
+    def z(self):
+        return self._z
+
+    def _pillars(self, rows, c):
+        ''' Index into the pillar tables of corners c of the cells `rows` '''
+        nz, ny, nx = self._shape
+        j, i = np.divmod(self._cells[rows] % (ny * nx), nx)
+        return j * (nx + 1) + i + _CORNER_PILLAR_DJ[c] * (nx + 1) + _CORNER_PILLAR_DI[c]
+
+    def corners(self, rows=slice(None), order=None):
+        ''' Corner x, y and z coordinates of the cells `rows`, each of shape
+        (n, 8), with the corners taken in `order` if given. The arrays are
+        column-major, as activeCornerCoords returns. '''
+        order = range(8) if order is None else order
+        first = self._pillars(rows, 0)
+        x = np.empty((len(first), 8), dtype=self._pillarx.dtype, order='F')
+        y = np.empty_like(x)
+        z = np.empty((len(first), 8), dtype=self._z.dtype, order='F')
+        nx = self._shape[2]
+        for n, c in enumerate(order):
+            pillars = first + (_CORNER_PILLAR_DJ[c] * (nx + 1) + _CORNER_PILLAR_DI[c])
+            self._pillarx.take(pillars, out=x[:, n])
+            self._pillary.take(pillars, out=y[:, n])
+            z[:, n] = self._z[rows, c]
+        return x, y, z
+
+    def chunks(self):
+        ''' Slices of at most _GEOMETRY_CHUNK_CELLS consecutive cells '''
+        n = len(self._cells)
+        for start in range(0, n, _GEOMETRY_CHUNK_CELLS):
+            yield slice(start, min(start + _GEOMETRY_CHUNK_CELLS, n))
+
+    def mapChunks(self, function, order=None, jobs=1):
+        ''' function(x, y, z) of the corner coordinates (see corners) of each
+        chunk of cells in turn, concatenated. The chunks are run in `jobs`
+        threads (numpy releases the GIL in its array operations). '''
+        def run(rows):
+            return function(*self.corners(rows, order))
+
+        chunks = list(self.chunks())
+        if jobs > 1 and len(chunks) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(run, chunks))
+        else:
+            results = [run(rows) for rows in chunks]
+        if not results:
+            return function(*(np.zeros((0, 8), dtype=self._z.dtype),) * 3)
+        return np.concatenate(results)
+
+    def remove(self, remove):
+        ''' Drop the cells flagged in the boolean array `remove` '''
+        keep = ~remove
+        self._cells = self._cells[keep]
+        self._z = self._z[keep]
+
+    def cornerCoords(self, corners):
+        ''' x, y and z coordinates of the corners with flat indices `corners`
+        (row * 8 + corner, as into z) '''
+        rows, c = np.divmod(corners, 8)
+        pillars = self._pillars(rows, c)
+        return self._pillarx[pillars], self._pillary[pillars], self._z[rows, c]
+
+
+def numberNodesInSlab(elemcornz, active_elements, boundary=None, first_id=1, jobs=1):
+    ''' numberActiveNodes for a slab of layers given as the corner z values of
+    every cell, of shape (nz*ny*nx, 8), and its active cells. Returns
+    (elemNodes, first_corners, boundary) as numberActiveNodes does, but with
+    elemNodes of shape (nz, ny, nx, 8), zero for inactive cells, and
+    first_corners as flat indices into elemcornz. '''
+    shape = active_elements.shape
+    cells = np.flatnonzero(active_elements)
+    nodes, first_corners, boundary = numberActiveNodes(elemcornz.reshape(-1, 8)[cells], cells, shape,
+                                                       boundary, first_id, jobs)
+
+    first_cell, c = np.divmod(first_corners, 8)
+    return scatterElemNodes(nodes, cells, shape), cells[first_cell] * 8 + c, boundary
+
+
+def _pillarCorners(compact, boundary_ids, n_boundary, pj0, pj1):
+    ''' Indices of the corners on the pillars of rows pj0 to pj1 - 1, as an
+    array of shape ((pj1 - pj0) * (nx + 1), 4 + 8 * nz) with one row per
+    pillar and -1 for the slots of inactive cells or cells outside the grid.
+    `compact` is the index of each cell among the active cells (-1 if
+    inactive), of shape (nz, ny, nx). The first 4 slots are the corners of
+    the boundary layer above with a node id in `boundary_ids` (at indices 0
+    to n_boundary - 1), followed by the 8 corners (one per cell around the
+    pillar, top and bottom) of each layer, at 8 * compact + corner, offset by
+    n_boundary. '''
+    nz, ny, nx = compact.shape
+    pj = np.arange(pj0, pj1)[:, None, None, None]
+    pi = np.arange(nx + 1)[None, :, None, None]
+    k = np.arange(nz)[None, None, :, None]
+    c = np.arange(8)
+
+    # The cell (j, i) each corner slot belongs to
+    j = pj - _CORNER_PILLAR_DJ
+    i = pi - _CORNER_PILLAR_DI
+    inside = (j >= 0) & (j < ny) & (i >= 0) & (i < nx)
+    j = np.clip(j, 0, ny - 1)
+    i = np.clip(i, 0, nx - 1)
+
+    cell = compact[k, j, i]
+    layers = np.where(inside & (cell >= 0), n_boundary + cell * 8 + c, -1)
+    layers = layers.reshape((pj1 - pj0) * (nx + 1), nz * 8)
+
+    top = np.full(((pj1 - pj0) * (nx + 1), 4), -1, dtype=layers.dtype)
+    if n_boundary:
+        j, i, inside = j[..., 0, 4:], i[..., 0, 4:], inside[..., 0, 4:]
+        numbered = inside & (boundary_ids[j, i, c[4:] - 4] > 0)
+        top[:] = np.where(numbered, (j * nx + i) * 4 + c[4:] - 4, -1).reshape(-1, 4)
+
+    return np.concatenate((top, layers), axis=1)
+
+
+def _mergePillarCorners(all_z, compact, boundary_ids, n_boundary, n_corners, pj0, pj1):
+    ''' Merge the corners on the pillars of rows pj0 to pj1 - 1 into nodes.
+
+    Each pillar's corners are sorted by z (a short sort per pillar, rather
+    than one sort of the whole grid), and every run of corners whose z gaps
+    stay below `np.isclose`'s combined tolerance is one node. Returns the
+    indices of the corners in node order, the start of each node in that
+    order, the smallest (active cell) corner index of each node (n_corners
+    if none) and the largest boundary node id in each node (0 if none). '''
+    slots = _pillarCorners(compact, boundary_ids, n_boundary, pj0, pj1)
+    valid = slots >= 0
+
+    # Missing slots sort last, after every corner of the pillar. The z gaps
+    # and tolerances are always evaluated in double precision, so single
+    # precision corners (--precision single) merge exactly as doubles do.
+    z = np.where(valid, all_z[np.maximum(slots, 0)].astype(np.float64, copy=False), np.inf)
+    order = np.argsort(z, axis=1, kind='stable')
+    slots = np.take_along_axis(slots, order, axis=1)
+    z = np.take_along_axis(z, order, axis=1)
+    valid = slots >= 0
+
+    # A new node starts at each pillar's first corner, and wherever the z gap
+    # exceeds np.isclose's combined tolerance (atol + rtol * max(|a|, |b|))
+    atol, rtol = 1e-8, 1e-5
+    new_node = np.ones(z.shape, dtype=bool)
+    abs_z = np.abs(z)
+    tol = np.maximum(abs_z[:, 1:], abs_z[:, :-1])
+    tol *= rtol
+    tol += atol
+    with np.errstate(invalid='ignore'):
+        np.greater(z[:, 1:] - z[:, :-1], tol, out=new_node[:, 1:])
+
+    corners = slots[valid]
+    starts = np.flatnonzero(new_node[valid])
+    if len(corners) == 0:
+        return corners, starts, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Smallest corner index, and largest boundary node id, of each node
+    is_boundary = corners < n_boundary
+    first_active = np.minimum.reduceat(np.where(is_boundary, n_corners, corners - n_boundary), starts)
+    node_id = np.zeros(len(starts), dtype=np.int64)
+    if n_boundary:
+        boundary_flat = boundary_ids.reshape(n_boundary)
+        node_id = np.maximum.reduceat(np.where(is_boundary, boundary_flat[np.minimum(corners, n_boundary - 1)], 0), starts)
+
+    return corners, starts, first_active, node_id
+
+
+def numberActiveNodes(cornz, cells, shape, boundary=None, first_id=1, jobs=1):
+    ''' Number the unique nodes of the active cells of a grid, or of a slab of
+    layers of a grid, joining them to the nodes of the layer above.
+
+    `cells` are the ascending flat (k, j, i) indices of the active cells in a
+    grid of `shape` (nz, ny, nx), and cornz the z values of their corners, of
+    shape (len(cells), 8). Only the corners of active cells are merged, so
+    the work and memory scale with the number of active cells. Corners can
+    only be the same node if they are on the same pillar, so the corners are
+    bucketed by pillar and each pillar's corners are sorted by z: every run
+    in a sorted pillar whose z gaps stay below `np.isclose`'s combined
+    tolerance is one node. Ranges of pillar rows are merged independently,
+    in `jobs` threads, and ranges without active cells are skipped.
+
+    `boundary` is the (z, node ids) of the bottom corners (4 to 7) of the
+    layer above, each of shape (ny, nx, 4) - as returned for the previous
+    slab - or None for the top of the grid. A node containing a boundary
+    corner keeps its id; the other nodes are numbered from `first_id` in
+    order of the smallest (k, j, i, corner) flat index at which an active
+    cell first touches them. Numbering a grid slab by slab therefore gives
+    the same node ids as numbering it in one go.
+
+    Returns (elemNodes, first_corners, boundary):
+      elemNodes     : (len(cells), 8) node ids of the active cells
+      first_corners : flat index into cornz of the first corner of each new
+                      node, in node id order
+      boundary      : (z, node ids) of the bottom-most numbered corners of
+                      each column, for the next slab: those of its lowest
+                      active cell, or the incoming boundary's if it has
+                      none (zero ids if neither)
     '''
-    nz, ny, nx = active_elements.shape
-    n_corners = nz * ny * nx * 8
-    if n_corners == 0:
-        return np.zeros((nz, ny, nx, 8), dtype=int)
-
-    # Per-corner pillar IDs of shape (ny, nx, 8); independent of k, broadcast
-    # across k. pillar_id = (j + dj_c) * (nx+1) + (i + di_c).
-    j_grid = np.arange(ny)[:, None, None]   # (ny, 1, 1)
-    i_grid = np.arange(nx)[None, :, None]   # (1, nx, 1)
-    pillar_per_layer = (j_grid + _CORNER_PILLAR_DJ) * (nx + 1) + (i_grid + _CORNER_PILLAR_DI)
-    pillar_id = np.broadcast_to(pillar_per_layer, (nz, ny, nx, 8))
-
-    # Flatten (pillar, z, active) into per-corner arrays of length 8*N.
-    all_pillars = pillar_id.reshape(n_corners)
-    all_z = elemcornz.reshape(n_corners)
-    all_active = np.repeat(active_elements.astype(bool).flatten(), 8)
-
-    # Sort primarily by pillar, secondarily by z (ascending).
-    sort_key = np.lexsort((all_z, all_pillars))
-    sp = all_pillars[sort_key]
-    sz = all_z[sort_key]
-
-    # Mark group boundaries: pillar changes, or z gap exceeds np.isclose's
-    # combined tolerance (atol + rtol * max(|a|, |b|)). Sorted-ascending z
-    # means gap = sz[1:] - sz[:-1] is non-negative.
+    nz, ny, nx = shape
+    n_cells = len(cells)
+    n_corners = n_cells * 8
+
+    # (z, node ids) of the bottom-most numbered corners of each column. A
+    # column whose last layers are inactive (or pinched out) keeps the
+    # corners of the layers above them, so the layers either side are still
+    # joined where their corners meet.
+    if boundary is None:
+        next_boundary = (np.zeros((ny, nx, 4), dtype=cornz.dtype), np.zeros((ny, nx, 4), dtype=np.int64))
+    else:
+        next_boundary = (np.array(boundary[0], dtype=cornz.dtype).reshape(ny, nx, 4),
+                         np.array(boundary[1], dtype=np.int64).reshape(ny, nx, 4))
+    if n_cells == 0:
+        return np.zeros((0, 8), dtype=int), np.zeros(0, dtype=np.int64), next_boundary
+
+    # Index of each cell among the active cells, or -1 if inactive
+    compact = np.full(nz * ny * nx, -1, dtype=np.int64)
+    compact[cells] = np.arange(n_cells)
+    compact = compact.reshape(nz, ny, nx)
+
+    # Per-corner z, with the corners of the boundary layer (if any) in front
+    all_z = cornz.reshape(n_corners)
+    n_boundary = 0
+    boundary_ids = None
+    if boundary is not None:
+        boundary_z, boundary_ids = boundary
+        n_boundary = boundary_ids.size
+        boundary_ids = boundary_ids.reshape(ny, nx, 4)
+        all_z = np.concatenate((boundary_z.reshape(n_boundary), all_z))
+
+    # Merge the corners of chunks of pillar rows, at least one chunk per job.
+    # The pillars of row pj are shared by the cells of rows pj - 1 and pj, so
+    # a chunk without an active cell in those rows has no corners to merge.
+    rows_per_chunk = max(1, _NODE_CHUNK_CORNERS // ((nx + 1) * (nz * 8 + 4)))
+    rows_per_chunk = min(rows_per_chunk, -(-(ny + 1) // max(jobs, 1)))
+    row_active = (compact >= 0).any(axis=(0, 2))
+    chunks = [(pj0, min(pj0 + rows_per_chunk, ny + 1)) for pj0 in range(0, ny + 1, rows_per_chunk)]
+    chunks = [(pj0, pj1) for pj0, pj1 in chunks if row_active[max(pj0 - 1, 0):pj1].any()]
+
+    def merge(chunk):
+        return _mergePillarCorners(all_z, compact, boundary_ids, n_boundary, n_corners, *chunk)
+
+    if jobs > 1 and len(chunks) > 1:
+        # numpy releases the GIL while sorting, so threads run the chunks in parallel
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            merged = list(pool.map(merge, chunks))
+    else:
+        merged = [merge(chunk) for chunk in chunks]
+
+    # Node (group) number of every corner, boundary corners first
+    group_id = np.empty(n_boundary + n_corners, dtype=np.int64)
+    offset = 0
+    for corners, starts, _, _ in merged:
+        sizes = np.diff(np.append(starts, len(corners)))
+        group_id[corners] = np.repeat(np.arange(offset, offset + len(starts)), sizes)
+        offset += len(starts)
+    first_active = np.concatenate([m[2] for m in merged])
+    node_id = np.concatenate([m[3] for m in merged])
+
+    # Number the new nodes (those with an active corner and no boundary id)
+    # in ascending first-active-index order — same numbering the original loop
+    # produced when walking (k, j, i, corner) and assigning a fresh ID at each
+    # new node it created. As each corner is in one node, the first-active
+    # indices are distinct and can be ranked without sorting.
+    new_groups = np.flatnonzero((first_active < n_corners) & (node_id == 0))
+    group_at = np.full(n_corners, -1, dtype=np.int64)
+    group_at[first_active[new_groups]] = new_groups
+    order = group_at[group_at >= 0]
+    node_id[order] = np.arange(first_id, first_id + len(order))
+
+    elemNodes = node_id[group_id[n_boundary:]].reshape(n_cells, 8).astype(int)
+
+    # The bottom-most active cell of each column: cells are in (k, j, i)
+    # order, so the last one of each column
+    columns = cells % (ny * nx)
+    position, last = np.unique(columns[::-1], return_index=True)
+    last = n_cells - 1 - last
+    next_boundary[0].reshape(-1, 4)[position] = cornz[last, 4:]
+    next_boundary[1].reshape(-1, 4)[position] = elemNodes[last, 4:]
+
+    return elemNodes, first_active[order], next_boundary
+
+
+def conformingLevels(zcorn):
+    ''' Check whether a grid is conforming (unfaulted): every ZCORN value on a
+    pillar equals those of the neighbouring cells on the same pillar, both
+    laterally and between consecutive layers, and the layers' z values are
+    monotonic along each pillar. Returns the z value of every (layer
+    boundary, pillar) point, of shape (nz + 1, ny + 1, nx + 1), or None if the
+    grid isn't conforming. Only whole-array slice comparisons are used, so
+    this is cheap compared to numbering the nodes. '''
+    dnz, dny, dnx = zcorn.shape
+    if 0 in zcorn.shape:
+        return None
+
+    # Neighbouring cells in i, j and k share their corners on the same pillar
+    if not (np.array_equal(zcorn[:, :, 1:-1:2], zcorn[:, :, 2:-1:2]) and
+            np.array_equal(zcorn[:, 1:-1:2, :], zcorn[:, 2:-1:2, :]) and
+            np.array_equal(zcorn[1:-1:2], zcorn[2:-1:2])):
+        return None
+
+    # The tops of the layers and the bottom of the last layer, on each pillar
+    rows = np.r_[0:dny:2, dny - 1]
+    cols = np.r_[0:dnx:2, dnx - 1]
+    levels = np.concatenate((zcorn[0::2], zcorn[-1:]))[:, rows][:, :, cols]
+
+    # The corners on a pillar are merged in order of z, so the levels must be
+    # in order of z on every pillar for the lattice to give the same nodes
+    gaps = np.diff(levels.astype(np.float64, copy=False), axis=0)
+    if not ((gaps >= 0).all(axis=0) | (gaps <= 0).all(axis=0)).all():
+        return None
+
+    return levels
+
+
+def numberLatticeNodes(levels, cells, shape):
+    ''' Number the nodes of the active cells (with flat (k, j, i) indices
+    `cells`) of a conforming grid of `shape` (see conformingLevels) directly
+    from its (layer boundary, pillar) lattice, giving the same node ids as
+    numberActiveNodes: a lattice point is a node if an active cell touches
+    it, and the nodes are numbered in order of the smallest (k, j, i, corner)
+    flat index at which an active cell first touches them. Consecutive
+    levels of a pillar touched by active cells and closer than `np.isclose`'s
+    tolerance (zero thickness layers) are one node, as they are when merging
+    the active cells' corners: levels only inactive cells touch are skipped,
+    so they never join the levels either side of them.
+
+    Returns (elemNodes, first_corners) as numberActiveNodes does. '''
+    nz, ny, nx = shape
+    n_corners = len(cells) * 8
+
+    # The first active corner at each lattice point, from the eight corners
+    # (one per cell around the point) that can be there. Corners are indexed
+    # among the active cells' corners, which are in (k, j, i, corner) order;
+    # any index of n_corners or more is no active corner.
+    corner0 = np.full(nz * ny * nx, n_corners, dtype=np.int64)
+    corner0[cells] = np.arange(0, n_corners, 8)
+    corner0 = corner0.reshape(nz, ny, nx)
+    first = np.full((nz + 1, ny + 1, nx + 1), n_corners, dtype=np.int64)
+    for c in range(8):
+        dk, dj, di = _CORNER_LEVEL_DK[c], _CORNER_PILLAR_DJ[c], _CORNER_PILLAR_DI[c]
+        point = first[dk:dk + nz, dj:dj + ny, di:di + nx]
+        np.minimum(point, corner0 + c, out=point)
+
+    # Runs of the points touched by an active cell on a pillar closer than
+    # np.isclose's combined tolerance (atol + rtol * max(|a|, |b|)) are one
+    # node. Lay the points out pillar by pillar to find them.
     atol, rtol = 1e-8, 1e-5
-    new_grp = np.empty(n_corners, dtype=bool)
-    new_grp[0] = True
-    if n_corners > 1:
-        gap = sz[1:] - sz[:-1]
-        tol_per_pair = atol + rtol * np.maximum(np.abs(sz[1:]), np.abs(sz[:-1]))
-        new_grp[1:] = (sp[1:] != sp[:-1]) | (gap > tol_per_pair)
-    grp_sorted = np.cumsum(new_grp) - 1
-    num_groups = int(grp_sorted[-1]) + 1
-
-    # Scatter group IDs back to original (k, j, i, c) order.
-    group_id = np.empty(n_corners, dtype=np.int64)
-    group_id[sort_key] = grp_sorted
-
-    # For each group, smallest active-corner flat index (sentinel = n_corners
-    # if no active member). Groups without an active member contribute no node.
-    sentinel = n_corners
-    first_active = np.full(num_groups, sentinel, dtype=np.int64)
-    active_flat_idx = np.nonzero(all_active)[0]
-    np.minimum.at(first_active, group_id[active_flat_idx], active_flat_idx)
-    active_group_mask = first_active < sentinel
-
-    # Number active groups in ascending first-active-index order — same numbering
-    # the original loop produced when walking (k, j, i, corner) and assigning a
-    # fresh ID at each new node it created.
-    active_groups = np.nonzero(active_group_mask)[0]
-    order = active_groups[np.argsort(first_active[active_groups])]
-    new_id = np.zeros(num_groups, dtype=np.int64)
-    new_id[order] = np.arange(1, len(order) + 1)
-
-    # Build elemNodes; zero inactive corners so the downstream
-    # ~np.any(elemNodes == 0, axis=1) filter drops inactive cells cleanly.
-    elemNodes_flat = new_id[group_id] * all_active.astype(np.int64)
-    return elemNodes_flat.reshape(nz, ny, nx, 8).astype(int)
-
-
-def _detectFaultFaces(elemNodes, elemIds, active_elements):
+    first = first.transpose(1, 2, 0).reshape(-1)
+    touched = np.flatnonzero(first < n_corners)
+    z = levels.astype(np.float64, copy=False).transpose(1, 2, 0).reshape(-1)[touched]
+    pillar = touched // (nz + 1)
+    new_node = np.ones(len(touched), dtype=bool)
+    new_node[1:] = (pillar[1:] != pillar[:-1]) | \
+        (np.abs(z[1:] - z[:-1]) > atol + rtol * np.maximum(np.abs(z[1:]), np.abs(z[:-1])))
+    starts = np.flatnonzero(new_node)
+    first = np.minimum.reduceat(first[touched], starts) if len(starts) else first[:0]
+
+    # Number the nodes in ascending first-active-index order. The
+    # first-active indices are distinct, so are ranked without sorting.
+    group_at = np.full(n_corners, -1, dtype=np.int64)
+    group_at[first] = np.arange(len(first))
+    order = group_at[group_at >= 0]
+    node_id = np.zeros(len(starts), dtype=np.int64)
+    node_id[order] = np.arange(1, len(order) + 1)
+
+    # Node id of every lattice point (zero if no active cell touches it),
+    # back in (k, j, i) layout
+    point_id = np.zeros((ny + 1) * (nx + 1) * (nz + 1), dtype=np.int64)
+    point_id[touched] = node_id[np.cumsum(new_node) - 1]
+    point_id = point_id.reshape(ny + 1, nx + 1, nz + 1).transpose(2, 0, 1)
+
+    k, j, i = np.unravel_index(cells, shape)
+    elemNodes = np.empty((len(cells), 8), dtype=int)
+    for c in range(8):
+        elemNodes[:, c] = point_id[k + _CORNER_LEVEL_DK[c], j + _CORNER_PILLAR_DJ[c], i + _CORNER_PILLAR_DI[c]]
+
+    return elemNodes, first[order]
+
+
+def latticeNodeCoords(coord, levels, cells, first_corners):
+    ''' Coordinates of the nodes of a conforming grid numbered by
+    numberLatticeNodes, from the pillar (COORD) data and the lattice z values.
+    Each node is at its first active corner, as for any other grid. '''
+    nz, ny, nx = levels.shape[0] - 1, levels.shape[1] - 1, levels.shape[2] - 1
+    cell, c = np.divmod(first_corners, 8)
+    k, j, i = np.unravel_index(cells[cell], (nz, ny, nx))
+    pj = j + _CORNER_PILLAR_DJ[c]
+    pi = i + _CORNER_PILLAR_DI[c]
+
+    xcoords = np.asarray(coord[:, :, 0])[pj, pi]
+    ycoords = np.asarray(coord[:, :, 1])[pj, pi]
+    zcoords = levels[k + _CORNER_LEVEL_DK[c], pj, pi]
+
+    return xcoords, ycoords, zcoords
+
+
+def _detectFaultFaces(elemNodes, elemIds, active_elements, axes=(2, 1, 0)):
     ''' Scan all internal faces of the grid and identify fault faces — those
     where two i, j, or k-adjacent cells fail to share their 4 face-corner
-    node IDs (i.e. numberNodesInElems gave them different nodes because the
+    node IDs (i.e. numberActiveNodes gave them different nodes because the
     z values diverged at the shared pillar).
 
     Returns four equal-length lists describing the paired sidesets:
@@ -749,6 +1805,9 @@ def _detectFaultFaces(elemNodes, elemIds, active_elements):
     in this file: 1=jj_lo, 2=ii_hi, 3=jj_hi, 4=ii_lo, 5=kk_lo, 6=kk_hi. They
     are recorded in the natural pre-flip-z element node order; the caller is
     responsible for swapping 5 <-> 6 for k-direction entries if flip_z is on.
+
+    Only the faces normal to the given array `axes` are scanned (2 = i,
+    1 = j, 0 = k), in that order.
     '''
     nz, ny, nx, _ = elemNodes.shape
     primary_elems, primary_sides = [], []
@@ -768,7 +1827,7 @@ def _detectFaultFaces(elemNodes, elemIds, active_elements):
 
     # I-direction: cell (k, j, i) right face <-> cell (k, j, i+1) left face.
     # Shared corner pairs (left -> right): 1->0, 2->3, 5->4, 6->7.
-    if nx > 1:
+    if 2 in axes and nx > 1:
         left = elemNodes[:, :, :-1, :]
         right = elemNodes[:, :, 1:, :]
         both = active_bool[:, :, :-1] & active_bool[:, :, 1:]
@@ -785,7 +1844,7 @@ def _detectFaultFaces(elemNodes, elemIds, active_elements):
 
     # J-direction: cell (k, j, i) back face <-> cell (k, j+1, i) front face.
     # Shared corner pairs (back -> front): 3->0, 2->1, 7->4, 6->5.
-    if ny > 1:
+    if 1 in axes and ny > 1:
         back = elemNodes[:, :-1, :, :]
         front = elemNodes[:, 1:, :, :]
         both = active_bool[:, :-1, :] & active_bool[:, 1:, :]
@@ -802,7 +1861,7 @@ def _detectFaultFaces(elemNodes, elemIds, active_elements):
 
     # K-direction: cell (k, j, i) kk_hi face <-> cell (k+1, j, i) kk_lo face.
     # Shared corner pairs (lower cell -> upper cell): 4->0, 5->1, 6->2, 7->3.
-    if nz > 1:
+    if 0 in axes and nz > 1:
         lower = elemNodes[:-1, :, :, :]
         upper = elemNodes[1:, :, :, :]
         both = active_bool[:-1, :, :] & active_bool[1:, :, :]
@@ -850,49 +1909,37 @@ def extractSubgrid(coord, zcorn, elemProps, nx, ny, nz,
     Inputs:
         coord     : (ny+1, nx+1, 6)        pillar top/bottom (x, y, z)
         zcorn     : (2*nz, 2*ny, 2*nx)     per-cell corner z values
-        elemProps : dict[name -> flat ndarray of length nx*ny*nz]
+        elemProps : dict[name -> ndarray of nx*ny*nz values]
 
     Returns (coord, zcorn, elemProps, new_nx, new_ny, new_nz) for the subset.
+    zcorn and the properties (of shape (new_nz, new_ny, new_nx)) are views of
+    the input arrays, so nothing is copied until they are used.
     '''
     # Pillars in (j, i): keep one extra pillar past the high end to bound the
     # last cell. .copy() decouples from the original so downstream writes (e.g.
     # the translate block) don't accidentally mutate it.
     coord = coord[j_lo:j_hi+1, i_lo:i_hi+1, :].copy()
-    zcorn = zcorn[2*k_lo:2*k_hi, 2*j_lo:2*j_hi, 2*i_lo:2*i_hi].copy()
+    zcorn = zcorn[2*k_lo:2*k_hi, 2*j_lo:2*j_hi, 2*i_lo:2*i_hi]
 
     new_elemProps = {}
     for name, vals in elemProps.items():
-        p = np.asarray(vals).reshape(nz, ny, nx)[k_lo:k_hi, j_lo:j_hi, i_lo:i_hi]
-        new_elemProps[name] = p.flatten()
+        new_elemProps[name] = np.asarray(vals).reshape(nz, ny, nx)[k_lo:k_hi, j_lo:j_hi, i_lo:i_hi]
 
     return coord, zcorn, new_elemProps, i_hi - i_lo, j_hi - j_lo, k_hi - k_lo
 
 
-def refineLaterally(coord, zcorn, elemProps, nx, ny, nz, rx, ry):
-    ''' Refine the grid laterally by integer factors (rx, ry) without refining
-    vertically. Pillars (and their endpoint x, y, z stored in coord) are linearly
-    interpolated. Per-cell top and bottom faces in zcorn are bilinearly
-    interpolated within each parent cell, which preserves faults (z jumps
-    between adjacent cells along a shared pillar). Element properties are tiled
-    so each child inherits its parent's value.
-
-    Inputs:
-        coord     : ndarray (ny+1, nx+1, 6)     pillar top/bottom (x, y, z)
-        zcorn     : ndarray (2*nz, 2*ny, 2*nx)  per-cell corner z values
-        elemProps : dict[name -> flat ndarray of length nx*ny*nz]
-        nx, ny, nz: int grid sizes
-        rx, ry    : int positive refinement factors
-
-    Returns:
-        (coord, zcorn, elemProps, nx*rx, ny*ry) with refined shapes.
-    '''
-    if rx == 1 and ry == 1:
-        return coord, zcorn, elemProps, nx, ny
-
-    # COORD: linear interpolation between pillars along j then i.
+def refineCoord(coord, rx, ry):
+    ''' Refine the pillars laterally by integer factors (rx, ry): COORD is
+    linearly interpolated between pillars along j then i. '''
     coord = _refine_axis(coord, ry, axis=0)
     coord = _refine_axis(coord, rx, axis=1)
+    return coord
 
+
+def refineZcorn(zcorn, nx, ny, nz, rx, ry):
+    ''' Refine ZCORN laterally by integer factors (rx, ry): the top and bottom
+    of each cell are bilinearly interpolated within the parent cell. Works on
+    any range of nz layers. '''
     # ZCORN: bilinear within each parent cell. Per-cell corner arrays each of
     # shape (nz, ny, nx); naming c<u><v><k> with u, v in {0, 1} for the (i, j)
     # corner and k in {0, 1} for top/bottom.
@@ -908,8 +1955,8 @@ def refineLaterally(coord, zcorn, elemProps, nx, ny, nz, rx, ry):
     # Parametric (u, v) at every sub-cell corner in zcorn order. Interior values
     # appear twice because adjacent sub-cells own their own copy of a shared
     # corner. For rx = 3: [0, 1/3, 1/3, 2/3, 2/3, 1].
-    u_seq = np.repeat(np.arange(rx + 1) / rx, 2)[1:-1]
-    v_seq = np.repeat(np.arange(ry + 1) / ry, 2)[1:-1]
+    u_seq = np.repeat(np.arange(rx + 1) / rx, 2)[1:-1].astype(zcorn.dtype, copy=False)
+    v_seq = np.repeat(np.arange(ry + 1) / ry, 2)[1:-1].astype(zcorn.dtype, copy=False)
     u = u_seq.reshape(1, 1, 1, 1, 2 * rx)
     v = v_seq.reshape(1, 1, 1, 2 * ry, 1)
 
@@ -937,13 +1984,20 @@ def refineLaterally(coord, zcorn, elemProps, nx, ny, nz, rx, ry):
     zcorn_new[0::2] = z_top
     zcorn_new[1::2] = z_bot
 
+    return zcorn_new
+
+
+def refineProps(elemProps, nx, ny, nz, rx, ry):
+    ''' Refine the per-cell properties of nz layers laterally by integer
+    factors (rx, ry), so each child cell inherits its parent's value. Returns
+    flat arrays. '''
     new_elemProps = {}
     for name, vals in elemProps.items():
         p = np.asarray(vals).reshape(nz, ny, nx)
         p = np.repeat(np.repeat(p, ry, axis=1), rx, axis=2)
         new_elemProps[name] = p.flatten()
 
-    return coord, zcorn_new, new_elemProps, nx * rx, ny * ry
+    return new_elemProps
 
 
 def _refine_axis(a, r, axis):
@@ -957,7 +2011,7 @@ def _refine_axis(a, r, axis):
     right = np.expand_dims(right, axis + 1)
     s_shape = [1] * left.ndim
     s_shape[axis + 1] = r
-    s = (np.arange(r) / r).reshape(s_shape)
+    s = (np.arange(r) / r).astype(a.dtype, copy=False).reshape(s_shape)
     blended = (1 - s) * left + s * right
     new_shape = list(blended.shape)
     new_shape[axis] = n * r
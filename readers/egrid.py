@@ -0,0 +1,345 @@
+# Functions to read binary (unformatted) Eclipse EGRID, GRID and INIT files
+
+import numpy as np
+import os
+from readers.eclipse import DEFAULT_KEYWORDS
+
+# On-disk element type and size of each Eclipse binary data type. CHAR items
+# are 8-character strings; C0nn items are nn-character strings.
+_ECLIPSE_TYPES = {
+    'INTE': ('i4', 4),
+    'REAL': ('f4', 4),
+    'DOUB': ('f8', 8),
+    'LOGI': ('i4', 4),
+    'CHAR': ('S8', 8),
+}
+
+# Every keyword is preceded by a 16 byte header record (8 character name,
+# element count, 4 character type), i.e. 24 bytes including record markers
+_HEADER_BYTES = 24
+
+
+def _elementType(ecltype, endian):
+    ''' Returns the numpy dtype and item size for an Eclipse data type, or
+    (None, 0) for types that carry no data (MESS) '''
+    if ecltype.startswith('C0'):
+        return np.dtype('S' + ecltype[2:]), int(ecltype[2:])
+    if ecltype not in _ECLIPSE_TYPES:
+        return None, 0
+    code, size = _ECLIPSE_TYPES[ecltype]
+    return np.dtype(endian + code if code[0] != 'S' else code), size
+
+
+class EclipseBinaryFile(object):
+    '''Memory-mapped view of an unformatted Eclipse file.
+
+    The file is a sequence of Fortran records: a header record for each
+    keyword, followed by its data split across records of at most 1000 numbers
+    (105 strings). Each record is framed by 4 byte length markers. Only the
+    headers are read when the file is opened; keyword data is exposed as
+    strided views onto the memory map, so nothing is copied until a keyword
+    is actually converted.
+    '''
+
+    def __init__(self, f):
+        self._filename = f
+        self._buf = np.memmap(f, dtype=np.uint8, mode='r')
+
+        # Eclipse writes big-endian files, but accept little-endian ones too
+        # (the first record marker is always 16)
+        if self._buf.size < _HEADER_BYTES:
+            raise ValueError('{} is not an unformatted Eclipse file'.format(f))
+        first = self._buf[:4].tobytes()
+        if np.frombuffer(first, '>i4')[0] == 16:
+            self._endian = '>'
+        elif np.frombuffer(first, '<i4')[0] == 16:
+            self._endian = '<'
+        else:
+            raise ValueError('{} is not an unformatted Eclipse file'.format(f))
+
+    @property
+    def filename(self):
+        return self._filename
+
+    # The memory-mapped file contents (uint8)
+    @property
+    def buffer(self):
+        return self._buf
+
+    def keywords(self, offset=0):
+        ''' Iterates over the keywords in the file from byte `offset`,
+        yielding a dict describing each one (see _readHeader) '''
+        while offset < self._buf.size:
+            entry = self._readHeader(offset)
+            yield entry
+            offset = entry['end']
+
+    def _int(self, offset):
+        return int(np.frombuffer(self._buf[offset:offset + 4].tobytes(), self._endian + 'i4')[0])
+
+    def _readHeader(self, offset):
+        ''' Parse the keyword header record at `offset` and locate its data
+        records. Returns a dict describing the keyword. '''
+        if self._int(offset) != 16 or self._int(offset + 20) != 16:
+            raise ValueError('Corrupt keyword header at byte {} in {}'.format(offset, self._filename))
+        header = self._buf[offset + 4:offset + 20].tobytes()
+        keyword = header[:8].decode('ascii', 'replace').strip()
+        count = int(np.frombuffer(header[8:12], self._endian + 'i4')[0])
+        ecltype = header[12:16].decode('ascii', 'replace')
+        dtype, itemsize = _elementType(ecltype, self._endian)
+
+        entry = {'keyword': keyword, 'type': ecltype, 'count': count, 'dtype': dtype,
+                 'header': offset, 'start': offset + _HEADER_BYTES, 'block': 0}
+
+        if dtype is None or count == 0:
+            entry['end'] = entry['start']
+            return entry
+
+        # All data records except the last hold the same number of items, so
+        # the first record's length gives the layout of the whole keyword
+        block = self._int(entry['start']) // itemsize
+        if block <= 0:
+            raise ValueError('Corrupt {} data record in {}'.format(keyword, self._filename))
+        nfull, rem = divmod(count, block)
+        end = entry['start'] + nfull * (block * itemsize + 8)
+        if rem:
+            end += rem * itemsize + 8
+        last = rem if rem else block
+        if end > self._buf.size or self._int(end - 4) != last * itemsize:
+            raise ValueError('Corrupt {} data records in {}'.format(keyword, self._filename))
+
+        entry['block'] = block
+        entry['end'] = end
+        return entry
+
+    def find(self, keyword, stop=None):
+        ''' Returns the first entry for keyword (optionally only looking before
+        the first `stop` keyword), or None if it isn't in the file '''
+        for entry in self.keywords():
+            if entry['keyword'] == stop:
+                return None
+            if entry['keyword'] == keyword:
+                return entry
+        return None
+
+    def views(self, entry):
+        ''' Returns the keyword's data as a list of (at most two) zero-copy
+        views onto the memory map: the full records as a 2D strided array of
+        shape (num_full_records, items_per_record), and the partial last
+        record as a 1D array '''
+        views = []
+        count, block, dtype = entry['count'], entry['block'], entry['dtype']
+        if count == 0 or dtype is None:
+            return views
+        nfull, rem = divmod(count, block)
+        record_bytes = block * dtype.itemsize + 8
+        if nfull:
+            views.append(np.ndarray((nfull, block), dtype=dtype, buffer=self._buf,
+                                    offset=entry['start'] + 4,
+                                    strides=(record_bytes, dtype.itemsize)))
+        if rem:
+            views.append(np.ndarray((rem,), dtype=dtype, buffer=self._buf,
+                                    offset=entry['start'] + nfull * record_bytes + 4))
+        return views
+
+    def array(self, entry, dtype=float):
+        ''' Converts the keyword's data to a native 1D array of `dtype` in a
+        single pass over the memory map '''
+        out = np.empty(entry['count'], dtype=dtype)
+        filled = 0
+        for view in self.views(entry):
+            out[filled:filled + view.size].reshape(view.shape)[...] = view
+            filled += view.size
+        return out
+
+    def strings(self, entry):
+        ''' Returns the keyword's data as a list of stripped strings '''
+        return [s.decode('ascii', 'replace').strip() for s in self.array(entry, entry['dtype'])]
+
+
+def readEgrid(f, eclipse, extra_keywords=()):
+    ''' Read a binary Eclipse EGRID or GRID file (and the INIT file with the
+    same base name, if there is one) and store the data in an Eclipse object.
+    `extra_keywords` is an iterable of additional uppercase keyword names to
+    read from the INIT file as per-cell properties on top of DEFAULT_KEYWORDS. '''
+
+    # EGRID files describe the grid in a GRIDHEAD keyword, old-style GRID
+    # files in DIMENS; both appear before any bulk data
+    grid = EclipseBinaryFile(f)
+    eclipse.files.append(f)
+    layout = None
+    for entry in grid.keywords():
+        if entry['keyword'] in ('GRIDHEAD', 'DIMENS', 'COORDS', 'COORD', 'ZCORN'):
+            layout = entry['keyword']
+            break
+
+    if layout == 'GRIDHEAD':
+        _readEgridGeometry(grid, eclipse)
+    elif layout == 'DIMENS':
+        _readGridGeometry(grid, eclipse)
+    else:
+        print("No GRIDHEAD or DIMENS keyword found in ", f)
+        exit()
+
+    # Per-cell properties come from the INIT file of the same case
+    base = os.path.splitext(f)[0]
+    for ext in ('.INIT', '.init'):
+        if os.path.exists(base + ext):
+            eclipse.files.append(base + ext)
+            _readInitProperties(EclipseBinaryFile(base + ext), eclipse, extra_keywords)
+            break
+
+    return
+
+
+def listKeywords(f):
+    ''' Print the keywords of a binary EGRID or GRID file and of its INIT
+    file, without converting any of the data arrays '''
+    base = os.path.splitext(f)[0]
+    files = [f] + [base + ext for ext in ('.INIT', '.init') if os.path.exists(base + ext)][:1]
+    print('{:<10} {:<6} {:>12} {:>14}  {}'.format('Keyword', 'Type', 'Count', 'Offset', 'File'))
+    for name in files:
+        for entry in EclipseBinaryFile(name).keywords():
+            print('{:<10} {:<6} {:>12} {:>14}  {}'.format(entry['keyword'], entry['type'],
+                                                         entry['count'], entry['header'], name))
+    return
+
+
+def _readEgridGeometry(grid, eclipse):
+    ''' Fill specgrid, mapaxes, gridunit, coord, zcorn and ACTNUM from an
+    EGRID file. Only the global grid is read (local grid refinements, which
+    follow the first ENDGRID, are ignored). '''
+    gridhead = grid.array(grid.find('GRIDHEAD'), int)
+    if gridhead[0] != 1:
+        print("Only corner-point EGRID files are supported (GRIDHEAD type {})".format(gridhead[0]))
+        exit()
+    nx, ny, nz = gridhead[1:4]
+    eclipse.specgrid = [nx, ny, nz, 1, 'F']
+
+    entry = grid.find('MAPAXES', stop='ENDGRID')
+    if entry is not None:
+        eclipse.mapaxes = grid.array(entry)
+
+    # A blank second GRIDUNIT item means GRID, as for an omitted one in grdecl
+    entry = grid.find('GRIDUNIT', stop='ENDGRID')
+    if entry is not None:
+        eclipse.gridunit = [s for s in grid.strings(entry) if s]
+
+    entry = grid.find('COORD', stop='ENDGRID')
+    if entry is not None:
+        eclipse.coord = grid.array(entry)
+
+    entry = grid.find('ZCORN', stop='ENDGRID')
+    if entry is not None:
+        eclipse.zcorn = grid.array(entry)
+
+    entry = grid.find('ACTNUM', stop='ENDGRID')
+    if entry is not None:
+        eclipse.elemProps['ACTNUM'] = grid.array(entry, eclipse.dtype('ACTNUM'))
+
+    return
+
+
+def _readGridGeometry(grid, eclipse):
+    ''' Fill specgrid, mapaxes, gridunit, coord, zcorn and ACTNUM from an
+    old-style GRID file, which stores a COORDS (i, j, k, index, active) and a
+    CORNERS (x, y, z of the eight corners) record per cell. The per-cell
+    records have a fixed layout, so all of them are read as one strided view
+    rather than walking the cells one by one. '''
+    nx, ny, nz = grid.array(grid.find('DIMENS'), int)[:3]
+    eclipse.specgrid = [nx, ny, nz, 1, 'F']
+
+    entry = grid.find('MAPAXES', stop='COORDS')
+    if entry is not None:
+        eclipse.mapaxes = grid.array(entry)
+
+    entry = grid.find('GRIDUNIT', stop='COORDS')
+    if entry is not None:
+        eclipse.gridunit = [s for s in grid.strings(entry) if s]
+
+    # The per-cell records start at the first COORDS keyword. Every cell
+    # repeats the same COORDS + CORNERS layout, so the first pair gives the
+    # stride of the whole run; check that every cell's headers sit where the
+    # stride says they should before viewing the data
+    coords_entry = grid.find('COORDS')
+    if coords_entry is None:
+        print("No COORDS data found in ", grid.filename)
+        exit()
+    corners_entry = next(grid.keywords(coords_entry['end']), None)
+    if corners_entry is None or corners_entry['keyword'] != 'CORNERS' or corners_entry['count'] != 24:
+        print("No CORNERS data found in ", grid.filename)
+        exit()
+
+    ncells = nx * ny * nz
+    stride = corners_entry['end'] - coords_entry['header']
+    if coords_entry['header'] + ncells * stride > grid.buffer.size:
+        print("The number of cells in the GRID file is not correct (expected {})".format(ncells))
+        exit()
+    for entry, name in ((coords_entry, b'COORDS  '), (corners_entry, b'CORNERS ')):
+        names = np.ndarray((ncells,), dtype='S8', buffer=grid.buffer,
+                           offset=entry['header'] + 4, strides=(stride,))
+        if not np.all(names == name):
+            print("Unsupported GRID file layout (cell records are not uniform)")
+            exit()
+
+    num_coords = coords_entry['count']
+    int_type = coords_entry['dtype']
+    real_type = corners_entry['dtype']
+    coords = np.ndarray((ncells, num_coords), dtype=int_type, buffer=grid.buffer,
+                        offset=coords_entry['start'] + 4,
+                        strides=(stride, int_type.itemsize))
+    corners = np.ndarray((ncells, 24), dtype=real_type, buffer=grid.buffer,
+                         offset=corners_entry['start'] + 4,
+                         strides=(stride, real_type.itemsize))
+
+    # Place every cell at its (k, j, i) position; corners are stored in
+    # (kk, jj, ii) order, the same layout ZCORN uses within a cell
+    i, j, k = (coords[:, 0] - 1), (coords[:, 1] - 1), (coords[:, 2] - 1)
+    order = np.empty(ncells, dtype=np.int64)
+    order[(k * ny + j) * nx + i] = np.arange(ncells)
+    c = corners[order].astype(float).reshape(nz, ny, nx, 2, 2, 2, 3)
+
+    eclipse.zcorn = c[..., 2].transpose(0, 3, 1, 4, 2, 5).flatten()
+
+    # Pillars run from the top corners of the first layer to the bottom
+    # corners of the last layer
+    coord = np.empty((ny + 1, nx + 1, 6))
+    for jj in (0, 1):
+        for ii in (0, 1):
+            coord[jj:jj + ny, ii:ii + nx, 0:3] = c[0, :, :, 0, jj, ii]
+            coord[jj:jj + ny, ii:ii + nx, 3:6] = c[-1, :, :, 1, jj, ii]
+    eclipse.coord = coord.flatten()
+
+    if num_coords >= 5:
+        eclipse.elemProps['ACTNUM'] = coords[order, 4].astype(eclipse.dtype('ACTNUM'))
+
+    return
+
+
+def _readInitProperties(init, eclipse, extra_keywords):
+    ''' Read the per-cell properties from an INIT file. Most INIT arrays only
+    hold values for active cells; these are scattered back to the full grid
+    (inactive cells get zero) using ACTNUM. '''
+    keywords = [k for k in DEFAULT_KEYWORDS if k != 'ACTNUM']
+    keywords += [k.upper() for k in extra_keywords if k.upper() not in keywords]
+
+    ncells = eclipse.nx * eclipse.ny * eclipse.nz
+    if 'ACTNUM' in eclipse.elemProps:
+        active = eclipse.elemProps['ACTNUM'] > 0
+    else:
+        active = np.ones(ncells, dtype=bool)
+    num_active = int(active.sum())
+
+    for prop in keywords:
+        entry = init.find(prop)
+        if entry is None:
+            continue
+        # Integer keywords stay integers unless the file stores them as reals
+        values = init.array(entry, eclipse.dtype(prop) if entry['dtype'].kind == 'i' else float)
+        if values.size == num_active and num_active != ncells:
+            full = np.zeros(ncells, dtype=values.dtype)
+            full[active] = values
+            values = full
+        eclipse.elemProps[prop] = values
+
+    return
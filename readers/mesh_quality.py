@@ -0,0 +1,203 @@
+# Mesh quality metrics of HEX8 elements (minimum Jacobian, volume, aspect
+# ratio and skew), computed once per conversion in chunks of elements and
+# shared by --remove-distorted, the Jacobian check and --quality-variables
+
+import numpy as np
+from readers.reader_utils import minElementJacobians
+
+# Names of the metrics, as written by --quality-variables
+QUALITY_METRICS = ('min_jacobian', 'volume', 'aspect_ratio', 'skew')
+
+# Number of elements whose metrics are computed at a time
+_QUALITY_CHUNK_ELEMS = 1 << 16
+
+# The four edges of an element in each of its xi, eta and zeta directions, as
+# (from, to) corners in the HEX8 element corner layout
+_XI_EDGES = ((0, 1), (3, 2), (4, 5), (7, 6))
+_ETA_EDGES = ((0, 3), (1, 2), (4, 7), (5, 6))
+_ZETA_EDGES = ((0, 4), (1, 5), (3, 7), (2, 6))
+
+def _gaussWeights():
+    ''' Weights of the four edges of each direction (in the order of
+    _XI_EDGES, _ETA_EDGES and _ZETA_EDGES) in the derivative of the trilinear
+    map at each of the 2x2x2 Gauss points of the unit cube, as three arrays
+    of shape (4, 8) '''
+    g = np.array([0.5 - 0.5 / np.sqrt(3.0), 0.5 + 0.5 / np.sqrt(3.0)])
+    xi, eta, zeta = [p.reshape(-1) for p in np.meshgrid(g, g, g, indexing='ij')]
+
+    # Each direction's edges are at (0, 0), (1, 0), (0, 1) and (1, 1) in the
+    # other two directions (taken in the order of the edge tables)
+    def bilinear(a, b):
+        return np.stack(((1 - a) * (1 - b), a * (1 - b), (1 - a) * b, a * b))
+
+    return bilinear(eta, zeta), bilinear(xi, zeta), bilinear(xi, eta)
+
+_GAUSS_WEIGHTS = _gaussWeights()
+
+def _edges(P, edges):
+    ''' Edge vectors of shape (n, 4, 3) of the corners P of shape (n, 8, 3) '''
+    return P[:, [b for a, b in edges]] - P[:, [a for a, b in edges]]
+
+def elementVolumes(elemcornx, elemcorny, elemcornz):
+    ''' Volume of each HEX8 element, from its corner coordinate arrays of
+    shape (numelems, 8). The determinant of the Jacobian of the trilinear map
+    is at most quadratic in each direction, so the 2x2x2 Gauss rule gives the
+    volume exactly. Inverted elements have negative volume. '''
+    n = len(elemcornx)
+    J = []
+    for edges, weights in zip((_XI_EDGES, _ETA_EDGES, _ZETA_EDGES), _GAUSS_WEIGHTS):
+        # Edge vectors of shape (3 * n, 4), then their weighted sums at the
+        # Gauss points (one product of the stacked components) as the x, y
+        # and z components of the Jacobian column, each of shape (n, 8)
+        E = np.concatenate([np.asarray(c, dtype=np.float64)[:, [b for a, b in edges]] -
+                            np.asarray(c, dtype=np.float64)[:, [a for a, b in edges]]
+                            for c in (elemcornx, elemcorny, elemcornz)])
+        J.append((E @ weights).reshape(3, n, 8))
+
+    (ax, ay, az), (bx, by, bz), (cx, cy, cz) = J
+    det = ax * (by * cz - bz * cy) + ay * (bz * cx - bx * cz) + az * (bx * cy - by * cx)
+    return det.sum(axis=1) / 8
+
+def elementShape(elemcornx, elemcorny, elemcornz):
+    ''' Aspect ratio and skew of each HEX8 element, from its corner coordinate
+    arrays of shape (numelems, 8). Both are found from the element's three
+    principal axes (the sums of its four edges in each direction): the aspect
+    ratio is the longest axis over the shortest (1 for a cube), and the skew
+    is the largest absolute cosine of the angles between the axes (0 for a
+    rectangular element). Elements with a zero length axis have an infinite
+    aspect ratio and a skew of 1. '''
+    P = np.stack([elemcornx, elemcorny, elemcornz], axis=-1).astype(np.float64, copy=False)
+    axes = [_edges(P, edges).sum(axis=1) for edges in (_XI_EDGES, _ETA_EDGES, _ZETA_EDGES)]
+    lengths = np.stack([np.sqrt(np.einsum('nc,nc->n', a, a)) for a in axes])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect_ratio = lengths.max(axis=0) / lengths.min(axis=0)
+        cosines = [np.abs(np.einsum('nc,nc->n', axes[a], axes[b])) / (lengths[a] * lengths[b])
+                   for a, b in ((0, 1), (0, 2), (1, 2))]
+        skew = np.max(cosines, axis=0)
+
+    degenerate = lengths.min(axis=0) == 0
+    aspect_ratio[degenerate] = np.inf
+    skew[degenerate] = 1.0
+    return aspect_ratio, skew
+
+def elementQuality(elemcornx, elemcorny, elemcornz, metrics=QUALITY_METRICS):
+    ''' The given metrics of each HEX8 element, as a dict of arrays of shape
+    (numelems,), from its corner coordinate arrays of shape (numelems, 8) '''
+    quality = {}
+    if 'min_jacobian' in metrics:
+        quality['min_jacobian'] = minElementJacobians(elemcornx, elemcorny, elemcornz)
+    if 'volume' in metrics:
+        quality['volume'] = elementVolumes(elemcornx, elemcorny, elemcornz)
+    if 'aspect_ratio' in metrics or 'skew' in metrics:
+        aspect_ratio, skew = elementShape(elemcornx, elemcorny, elemcornz)
+        if 'aspect_ratio' in metrics:
+            quality['aspect_ratio'] = aspect_ratio
+        if 'skew' in metrics:
+            quality['skew'] = skew
+    return quality
+
+class MeshQuality(object):
+    '''Class holding the mesh quality metrics of the elements of a model, one
+    value per element (in the row order of the connectivity). Metrics are
+    computed when first asked for, and kept for everything else that uses
+    them.'''
+
+    def __init__(self, num_elems):
+        self._numElems = num_elems
+        self._metrics = {}
+
+    @property
+    def numElems(self):
+        return self._numElems
+
+    # The metrics, each of shape (numElems,)
+    @property
+    def minJacobian(self):
+        return self._metrics['min_jacobian']
+
+    @property
+    def volume(self):
+        return self._metrics['volume']
+
+    @property
+    def aspectRatio(self):
+        return self._metrics['aspect_ratio']
+
+    @property
+    def skew(self):
+        return self._metrics['skew']
+
+    def __contains__(self, metric):
+        return metric in self._metrics
+
+    def metric(self, name):
+        ''' The values of the metric `name` (one of QUALITY_METRICS) '''
+        return self._metrics[name]
+
+    def compute(self, corners, metrics, jobs=1):
+        ''' Compute those of `metrics` not already known, from corners(rows),
+        which gives the (x, y, z) corner coordinates of the elements `rows`
+        (a slice) in their final orientation. The elements are done a chunk at
+        a time, in `jobs` threads. '''
+        metrics = [m for m in metrics if m not in self._metrics]
+        if not metrics:
+            return
+
+        def run(rows):
+            return elementQuality(*corners(rows), metrics=metrics)
+
+        n = self._numElems
+        chunks = [slice(start, min(start + _QUALITY_CHUNK_ELEMS, n))
+                  for start in range(0, n, _QUALITY_CHUNK_ELEMS)]
+        if jobs > 1 and len(chunks) > 1:
+            # numpy releases the GIL in its array operations
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(run, chunks))
+        else:
+            results = [run(rows) for rows in chunks]
+
+        for m in metrics:
+            self._metrics[m] = (np.concatenate([r[m] for r in results]) if results
+                                else np.zeros(0, dtype=np.float64))
+
+    def remove(self, remove):
+        ''' Drop the elements flagged in the boolean array `remove` '''
+        keep = ~remove
+        self._metrics = {m: values[keep] for m, values in self._metrics.items()}
+        self._numElems = int(np.count_nonzero(keep))
+
+def qualityMetrics(args):
+    ''' The metrics needed by the options in args: the minimum Jacobian for
+    the Jacobian check and --remove-distorted, the --quality-variables, and
+    the volume for --pore-volume '''
+    metrics = list(getattr(args, 'quality_variables', None) or ())
+    if (getattr(args, 'check_jacobians', True) or getattr(args, 'remove_distorted', False)) \
+            and 'min_jacobian' not in metrics:
+        metrics.insert(0, 'min_jacobian')
+    if (getattr(args, 'pore_volume', False) or getattr(args, 'volume_regions', None)) \
+            and 'volume' not in metrics:
+        metrics.append('volume')
+    return metrics
+
+def nodeCorners(model):
+    ''' Function giving the (x, y, z) corner coordinates of the elements
+    `rows` of the model from its node coordinates and connectivity '''
+    xcoords = np.asarray(model.xcoords)
+    ycoords = np.asarray(model.ycoords)
+    zcoords = np.asarray(model.zcoords)
+
+    def corners(rows):
+        node_idx = model.elemNodes[rows] - 1   # 0-based node indices
+        return xcoords[node_idx], ycoords[node_idx], zcoords[node_idx]
+
+    return corners
+
+def meshQuality(model, metrics, jobs=1):
+    ''' The model's MeshQuality, with `metrics` computed (from the node
+    coordinates and connectivity) if they aren't already known '''
+    if model.quality is None:
+        model.quality = MeshQuality(model.numElems)
+    model.quality.compute(nodeCorners(model), metrics, jobs)
+    return model.quality
@@ -0,0 +1,136 @@
+# On-disk cache of parsed Eclipse data, so repeated conversions of the same
+# model (e.g. with different --extract-* or --refine-xy options) can skip
+# reading the input file
+
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+
+# Bump when the layout of a cache entry changes, so old entries are ignored
+_CACHE_VERSION = 2
+
+# Name of the metadata file in each cache entry. Its modification time is
+# refreshed on every hit and is used as the last-access time for eviction.
+_META_FILE = 'meta.json'
+
+
+def _fileStamp(f):
+    ''' (absolute path, size, modification time in ns) for a file '''
+    st = os.stat(f)
+    return [os.path.abspath(f), st.st_size, st.st_mtime_ns]
+
+
+def _cacheKey(f, reader, extra_keywords, integer_keywords):
+    ''' Key of the cache entry for reading file f with the given reader, extra
+    property keywords and extra integer keywords. The INCLUDEd files are not known until the file
+    has been read, so they are checked against the stamps recorded in the
+    entry instead (see loadParseCache). '''
+    key = json.dumps([_CACHE_VERSION, _fileStamp(f), reader.__name__,
+                      sorted(k.upper() for k in extra_keywords),
+                      sorted(k.upper() for k in integer_keywords)])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def loadParseCache(cache_dir, f, eclipse, reader, extra_keywords=(), integer_keywords=()):
+    ''' Fill the Eclipse object from the cache entry for file f, if there is a
+    valid one. Arrays are memory-mapped copy-on-write, so they are only read
+    from disk as they are used and can still be modified in memory. Returns
+    True on a cache hit. '''
+    entry = os.path.join(cache_dir, _cacheKey(f, reader, extra_keywords, integer_keywords))
+    meta_file = os.path.join(entry, _META_FILE)
+    if not os.path.exists(meta_file):
+        return False
+
+    with open(meta_file) as fid:
+        meta = json.load(fid)
+
+    # Every file the data came from (including INCLUDEs) must be unchanged
+    for stamp in meta['files']:
+        if not os.path.exists(stamp[0]) or _fileStamp(stamp[0]) != stamp:
+            return False
+
+    def load(name):
+        return np.load(os.path.join(entry, name + '.npy'), mmap_mode='c')
+
+    eclipse.specgrid = meta['specgrid']
+    eclipse.gridunit = meta['gridunit']
+    eclipse.mapaxes = load('MAPAXES') if meta['mapaxes'] else None
+    eclipse.coord = load('COORD')
+    eclipse.zcorn = load('ZCORN')
+    eclipse.elemProps = {prop: load('prop_' + prop) for prop in meta['props']}
+    eclipse.files = [stamp[0] for stamp in meta['files']]
+
+    # Mark the entry as recently used
+    os.utime(meta_file)
+    print("Loaded parsed data for {} from cache {}".format(f, entry))
+    return True
+
+
+def saveParseCache(cache_dir, f, eclipse, reader, extra_keywords=(), integer_keywords=(),
+                   max_size=None):
+    ''' Store the parsed Eclipse data for file f in the cache as a set of
+    .npy files, then evict the least recently used entries until the cache
+    holds at most `max_size` bytes (the new entry is always kept). '''
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _cacheKey(f, reader, extra_keywords, integer_keywords)
+    entry = os.path.join(cache_dir, key)
+
+    # Write into a temporary directory and rename it into place, so an
+    # interrupted run never leaves a partial entry behind
+    tmp = os.path.join(cache_dir, '.tmp-{}-{}'.format(key, os.getpid()))
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    def save(name, array):
+        np.save(os.path.join(tmp, name + '.npy'), np.asarray(array))
+
+    save('COORD', eclipse.coord)
+    save('ZCORN', eclipse.zcorn)
+    if eclipse.mapaxes is not None:
+        save('MAPAXES', eclipse.mapaxes)
+    for prop, values in eclipse.elemProps.items():
+        save('prop_' + prop, values)
+
+    meta = {'specgrid': [str(s) for s in eclipse.specgrid],
+            'gridunit': eclipse.gridunit,
+            'mapaxes': eclipse.mapaxes is not None,
+            'props': list(eclipse.elemProps),
+            'files': [_fileStamp(name) for name in eclipse.files]}
+    with open(os.path.join(tmp, _META_FILE), 'w') as fid:
+        json.dump(meta, fid)
+
+    shutil.rmtree(entry, ignore_errors=True)
+    os.rename(tmp, entry)
+
+    if max_size is not None:
+        _evictParseCache(cache_dir, max_size, keep=key)
+
+    return
+
+
+def _entrySize(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+def _evictParseCache(cache_dir, max_size, keep=None):
+    ''' Remove least recently used cache entries (other than `keep`) until the
+    total size of the cache is at most max_size bytes '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        meta_file = os.path.join(cache_dir, name, _META_FILE)
+        if name.startswith('.') or not os.path.exists(meta_file):
+            continue
+        entries.append((os.path.getmtime(meta_file), name, _entrySize(os.path.join(cache_dir, name))))
+
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_size:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= size
+
+    return
@@ -0,0 +1,158 @@
+# Per-stage wall time, CPU time and peak memory profile of a conversion
+# (enabled with --profile)
+
+from contextlib import contextmanager
+import json
+import os
+import time
+
+# The active profile, or None if profiling is disabled
+_profile = None
+
+def _cpuTime():
+    ''' CPU time of this process and its finished child processes (e.g. the
+    --jobs workers) '''
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def _resetPeakRss():
+    ''' Reset the kernel's peak resident set size counter of this process.
+    Only possible on Linux; returns False elsewhere '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as fid:
+            fid.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peakRss():
+    ''' Peak resident set size of this process in bytes (since the last
+    _resetPeakRss on Linux), or None if it can't be measured '''
+    try:
+        with open('/proc/self/status') as fid:
+            for line in fid:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+        import sys
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Profile(object):
+    '''Class recording the wall time, CPU time and peak memory of the named
+    stages of a conversion. Stages can be nested; a stage's peak memory
+    includes the peaks of the stages inside it'''
+
+    def __init__(self):
+        self._stages = []
+        self._stack = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _cpuTime()
+        # Without a resettable counter, peaks are process-wide high-water marks
+        self._per_stage_peaks = _resetPeakRss()
+        # Peak memory outside of any stage
+        self._outside = {'peak_rss': None}
+
+    @property
+    def stages(self):
+        return self._stages
+
+    @property
+    def perStagePeaks(self):
+        return self._per_stage_peaks
+
+    def _updatePeak(self, record):
+        peak = _peakRss()
+        if peak is not None:
+            record['peak_rss'] = max(record['peak_rss'] or 0, peak)
+
+    def begin(self, name):
+        if self._per_stage_peaks:
+            # Keep the peak so far (of the enclosing stage, or of the run) and
+            # start counting afresh for the new stage
+            self._updatePeak(self._stack[-1] if self._stack else self._outside)
+            _resetPeakRss()
+        record = {'name': name,
+                  'depth': len(self._stack),
+                  'wall': time.perf_counter(),
+                  'cpu': _cpuTime(),
+                  'peak_rss': None}
+        self._stages.append(record)
+        self._stack.append(record)
+
+    def end(self):
+        record = self._stack.pop()
+        record['wall'] = time.perf_counter() - record['wall']
+        record['cpu'] = _cpuTime() - record['cpu']
+        self._updatePeak(record)
+        if self._stack and record['peak_rss'] is not None:
+            parent = self._stack[-1]
+            parent['peak_rss'] = max(parent['peak_rss'] or 0, record['peak_rss'])
+
+    def total(self):
+        ''' The whole run so far, as a stage record '''
+        peaks = [s['peak_rss'] for s in self._stages + [self._outside] if s['peak_rss'] is not None]
+        current = _peakRss()
+        if current is not None:
+            peaks.append(current)
+        return {'name': 'total',
+                'depth': 0,
+                'wall': time.perf_counter() - self._start_wall,
+                'cpu': _cpuTime() - self._start_cpu,
+                'peak_rss': max(peaks) if peaks else None}
+
+    def report(self):
+        ''' Print a table of the stages and the total '''
+        def mb(peak):
+            return '-' if peak is None else '{:.1f}'.format(peak / 1024**2)
+
+        print('{:<36} {:>10} {:>10} {:>14}'.format('Stage', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)'))
+        for s in self._stages + [self.total()]:
+            print('{:<36} {:>10.3f} {:>10.3f} {:>14}'.format('  ' * s['depth'] + s['name'],
+                                                           s['wall'], s['cpu'], mb(s['peak_rss'])))
+        if not self._per_stage_peaks:
+            print('Note: peak RSS is the process high-water mark at the end of each stage')
+
+    def writeJson(self, filename, **info):
+        ''' Write the stages and the total to a JSON file, along with any
+        extra `info` (e.g. the input file name) '''
+        def entry(s):
+            return {'name': s['name'],
+                    'depth': s['depth'],
+                    'wall_s': s['wall'],
+                    'cpu_s': s['cpu'],
+                    'peak_rss_mb': None if s['peak_rss'] is None else s['peak_rss'] / 1024**2}
+
+        report = dict(info)
+        report['per_stage_peaks'] = self._per_stage_peaks
+        report['stages'] = [entry(s) for s in self._stages]
+        report['total'] = entry(self.total())
+        with open(filename, 'w') as fid:
+            json.dump(report, fid, indent=2)
+
+def enableProfile():
+    ''' Start profiling the stages of this run, returning the Profile '''
+    global _profile
+    _profile = Profile()
+    return _profile
+
+@contextmanager
+def stage(name):
+    ''' Context manager recording the enclosed code as a named stage of the
+    active profile. Does nothing if profiling is disabled '''
+    if _profile is None:
+        yield
+        return
+
+    _profile.begin(name)
+    try:
+        yield
+    finally:
+        _profile.end()
@@ -12,30 +12,14 @@ def addNode(array, i, j, k, count):
         # Node has already been numbered
         return count
 
-def addSideSets(model):
-    ''' Utility to determine elements in sidesets from array of element ids '''
+def addSideSets(model, sideSets=None):
+    ''' Utility to determine elements in sidesets from array of element ids.
+    The bottom, front, left, right, back and top sets can be given instead
+    as `sideSets` (e.g. from BoundarySets) '''
 
-    # Sidesets for the boundaries of the model (note: assumes 3D model)
-    sideSets = []
-
-    # Copy the elemIds to avoid changing elemIds (arrays arguments are mutable)
-    ids = np.copy(model.elemIds)
-
-    # XY planes
-    sideSets.append(nonZeroValues(ids))
-    sideSets.append(nonZeroValues(np.flip(ids, axis=0)))
-
-    # YZ planes
-    ids = np.copy(model.elemIds)
-    ids = np.rot90(ids, axes=(0,1))
-    sideSets.insert(1, nonZeroValues(ids))
-    sideSets.insert(1, nonZeroValues(np.flip(ids, axis=0)))
-
-    # XZ planes
-    ids = np.copy(model.elemIds)
-    ids = np.rot90(ids, axes=(0,2))
-    sideSets.insert(2, nonZeroValues(ids))
-    sideSets.insert(2, nonZeroValues(np.flip(ids, axis=0)))
+    if sideSets is None:
+        # Sidesets for the boundaries of the model (note: assumes 3D model)
+        sideSets = boundarySets(model.elemIds)
 
     # Sideset side numbers (note: assumes 3D model)
     sideSetSides = []
@@ -61,30 +45,14 @@ def addSideSets(model):
 
     return
 
-def addNodeSets(model):
-    ''' Utility to determine nodes in nodesets from array of node ids '''
-
-    # Nodesets for the boundaries of the model (note: assumes 3D model)
-    nodeSets = []
-
-    # Copy the elemIds to avoid changing elemIds (arrays arguments are mutable)
-    ids = np.copy(model.nodeIds)
+def addNodeSets(model, nodeSets=None):
+    ''' Utility to determine nodes in nodesets from array of node ids. The
+    bottom, front, left, right, back and top sets can be given instead as
+    `nodeSets` (e.g. from BoundarySets) '''
 
-    # XY planes
-    nodeSets.append(nonZeroValues(ids))
-    nodeSets.append(nonZeroValues(np.flip(ids, axis=0)))
-
-    # YZ planes
-    ids = np.copy(model.nodeIds)
-    ids = np.rot90(ids, axes=(0,1))
-    nodeSets.insert(1, nonZeroValues(ids))
-    nodeSets.insert(1, nonZeroValues(np.flip(ids, axis=0)))
-
-    # XZ planes
-    ids = np.copy(model.nodeIds)
-    ids = np.rot90(ids, axes=(0,2))
-    nodeSets.insert(2, nonZeroValues(ids))
-    nodeSets.insert(2, nonZeroValues(np.flip(ids, axis=0)))
+    if nodeSets is None:
+        # Nodesets for the boundaries of the model (note: assumes 3D model)
+        nodeSets = boundarySets(model.nodeIds)
 
     # Add nodesets to model
     model.nodeSetNames = ['bottom', 'front', 'left', 'right', 'back', 'top']
@@ -114,7 +82,7 @@ _HEX8_JAC_EDGES = [
 ]
 
 
-def checkElementJacobians(model, strict=False):
+def checkElementJacobians(model, strict=False, jobs=1):
     ''' Compute the per-corner Jacobian for every HEX8 element and report any
     elements with non-positive Jacobian (degenerate or inverted).
 
@@ -124,35 +92,82 @@ def checkElementJacobians(model, strict=False):
     when any non-positive Jacobian is detected; otherwise returns False as a
     soft signal but continues execution.
 
+    The minimum Jacobians are taken from the model's mesh quality metrics
+    (see readers.mesh_quality), computed in `jobs` threads if not already
+    known.
+
     Returns True if all elements have positive Jacobian everywhere.
     '''
     if model.elemNodes is None or model.numElems == 0:
         return True
 
-    node_idx = model.elemNodes - 1   # 0-based node indices
-    x = np.asarray(model.xcoords)[node_idx]   # (num_elems, 8)
-    y = np.asarray(model.ycoords)[node_idx]
-    z = np.asarray(model.zcoords)[node_idx]
-    P = np.stack([x, y, z], axis=-1)          # (num_elems, 8, 3)
+    from readers.mesh_quality import meshQuality, nodeCorners
+    min_jac = meshQuality(model, ['min_jacobian'], jobs).minJacobian
 
-    jacobians = np.empty((P.shape[0], 8))
+    # Map elemNodes row -> Exodus element ID. elemIds[k, j, i] holds the
+    # 1-based Exodus ID (0 for inactive); the non-zero values in (k, j, i)
+    # flat order align with elemNodes' row ordering.
+    if model.elemIds is not None:
+        exodus_ids = np.asarray(model.elemIds).flatten()
+        exodus_ids = exodus_ids[exodus_ids > 0]
+    else:
+        exodus_ids = np.arange(1, model.numElems + 1)
+
+    # Only the corners of the elements given as examples are needed
+    rows = np.union1d(np.flatnonzero(min_jac < 0)[:5], np.flatnonzero(min_jac == 0)[:5])
+    x, y, z = nodeCorners(model)(rows)
+    example_ids = rows + 1
+    known = rows < len(exodus_ids)
+    example_ids[known] = exodus_ids[rows[known]]
+
+    return reportElementJacobians(model.numElems,
+                                  int(np.sum(min_jac < 0)),
+                                  int(np.sum(min_jac == 0)),
+                                  jacobianExamples(min_jac[rows], example_ids, x, y, z),
+                                  strict=strict)
+
+
+def minElementJacobians(elemcornx, elemcorny, elemcornz):
+    ''' Return the minimum per-corner Jacobian of each element. Inputs are
+    per-element corner coordinate arrays of shape (numelems, 8), ordered in
+    the HEX8 element corner layout. '''
+    P = np.stack([elemcornx, elemcorny, elemcornz], axis=-1)  # (N, 8, 3)
+    jacobians = np.empty((P.shape[0], 8), dtype=P.dtype)
     for c, ((xi_a, xi_b), (eta_a, eta_b), (zeta_a, zeta_b)) in enumerate(_HEX8_JAC_EDGES):
         e_xi   = P[:, xi_a]   - P[:, xi_b]
         e_eta  = P[:, eta_a]  - P[:, eta_b]
         e_zeta = P[:, zeta_a] - P[:, zeta_b]
         jacobians[:, c] = np.einsum('ij,ij->i', e_xi, np.cross(e_eta, e_zeta))
+    return jacobians.min(axis=1)
+
+
+def jacobianExamples(min_jac, exodus_ids, x, y, z, limit=5):
+    ''' The first `limit` elements with negative and with zero Jacobian, as
+    {'negative': [...], 'zero': [...]} lists of (element ID, centroid x, y, z,
+    min Jacobian). x, y and z are the (numelems, 8) corner coordinates. '''
+    examples = {}
+    for label, mask in (('negative', min_jac < 0), ('zero', min_jac == 0)):
+        examples[label] = []
+        for r in np.where(mask)[0][:limit]:
+            eid = int(exodus_ids[r]) if r < len(exodus_ids) else r + 1
+            examples[label].append((eid, float(x[r].mean()), float(y[r].mean()),
+                                    float(z[r].mean()), min_jac[r]))
+    return examples
 
-    min_jac = jacobians.min(axis=1)
-    num_neg  = int(np.sum(min_jac < 0))
-    num_zero = int(np.sum(min_jac == 0))
-    num_ok   = model.numElems - num_neg - num_zero
+
+def reportElementJacobians(num_elems, num_neg, num_zero, examples, strict=False):
+    ''' Print the Jacobian check summary for num_elems elements, of which
+    num_neg have a negative and num_zero a zero Jacobian, with the examples
+    from jacobianExamples. Exits if `strict` and any are non-positive.
+    Returns True if all elements have positive Jacobian everywhere. '''
+    num_ok = num_elems - num_neg - num_zero
 
     if num_neg == 0 and num_zero == 0:
-        print('Element Jacobian check: {} / {} elements OK'.format(num_ok, model.numElems))
+        print('Element Jacobian check: {} / {} elements OK'.format(num_ok, num_elems))
         return True
 
     print('Element Jacobian check: {} negative, {} zero, {} OK (out of {})'.format(
-        num_neg, num_zero, num_ok, model.numElems))
+        num_neg, num_zero, num_ok, num_elems))
 
     if num_ok == 0:
         print('  All elements have non-positive Jacobians. Possible causes:')
@@ -160,26 +175,14 @@ def checkElementJacobians(model, strict=False):
         print('    - Orientation-reversing coordinate system (e.g. MAPAXES handedness)')
         print('  Use --remove-distorted to remove these elements and proceed anyway.')
 
-    # Map elemNodes row -> Exodus element ID. elemIds[k, j, i] holds the
-    # 1-based Exodus ID (0 for inactive); the non-zero values in (k, j, i)
-    # flat order align with elemNodes' row ordering.
-    if model.elemIds is not None:
-        exodus_ids = np.asarray(model.elemIds).flatten()
-        exodus_ids = exodus_ids[exodus_ids > 0]
-    else:
-        exodus_ids = np.arange(1, model.numElems + 1)
-
-    for label, mask in (('negative', min_jac < 0), ('zero', min_jac == 0)):
-        bad_rows = np.where(mask)[0]
-        if len(bad_rows) == 0:
+    for label, count in (('negative', num_neg), ('zero', num_zero)):
+        if count == 0:
             continue
         print('  Examples of {}-Jacobian elements (showing up to 5 of {}):'.format(
-            label, len(bad_rows)))
-        for r in bad_rows[:5]:
-            eid = int(exodus_ids[r]) if r < len(exodus_ids) else r + 1
-            cx, cy, cz = float(x[r].mean()), float(y[r].mean()), float(z[r].mean())
+            label, count))
+        for eid, cx, cy, cz, jac in examples[label]:
             print('    element {}: centroid ({:.4g}, {:.4g}, {:.4g}), min Jacobian = {:.3e}'.format(
-                eid, cx, cy, cz, min_jac[r]))
+                eid, cx, cy, cz, jac))
 
     if strict:
         print('--strict-jacobians: exiting due to invalid Jacobians')
@@ -193,32 +196,75 @@ def nonPositiveJacobianElems(elemcornx, elemcorny, elemcornz):
     minimum per-corner Jacobian is <= 0 (degenerate or inverted).
 
     Inputs are per-element corner coordinate arrays of shape (numelems, 8),
-    ordered in the HEX8 element corner layout (matching elemCornerCoords output).
+    ordered in the HEX8 element corner layout (as CornerGeometry.corners returns them).
     '''
-    P = np.stack([elemcornx, elemcorny, elemcornz], axis=-1)  # (N, 8, 3)
-    jacobians = np.empty((P.shape[0], 8))
-    for c, ((xi_a, xi_b), (eta_a, eta_b), (zeta_a, zeta_b)) in enumerate(_HEX8_JAC_EDGES):
-        e_xi   = P[:, xi_a]   - P[:, xi_b]
-        e_eta  = P[:, eta_a]  - P[:, eta_b]
-        e_zeta = P[:, zeta_a] - P[:, zeta_b]
-        jacobians[:, c] = np.einsum('ij,ij->i', e_xi, np.cross(e_eta, e_zeta))
-    return jacobians.min(axis=1) <= 0
-
-
-def nonZeroValues(arr):
-    ''' Utility to determine first non-zero values in the top plane of an array '''
-
-    values = []
-
-    for i in range(0, arr.shape[1]):
-        for j in range(0, arr.shape[2]):
-            if arr[0, i, j] > 0:
-                values.append(arr[0,i,j])
-            else:
-                # descend in column [:,i,j] until a non-zero value is found
-                if arr[:, i, j][arr[:, i, j]>0].size > 0:
-                    values.append(arr[:, i, j][arr[:, i, j]>0][0])
-
-    # Sort and make sure the values are unique
-    values = np.array(values, dtype = int)
-    return np.unique(values)
+    return minElementJacobians(elemcornx, elemcorny, elemcornz) <= 0
+
+
+class BoundarySets(object):
+    '''Class accumulating the bottom, front, left, right, back and top
+    boundary sets of a (k, j, i) array of element or node ids - the sets
+    addSideSets and addNodeSets find - from consecutive slabs of k layers'''
+
+    def __init__(self):
+        self._bottom = None
+        self._top = None
+        self._lines = [[], [], [], []]
+
+    def add(self, ids):
+        ''' Add the next slab of layers of ids '''
+        nonzero = ids > 0
+        first = firstNonZeroValues(ids, axis=0, nonzero=nonzero)
+        last = firstNonZeroValues(ids, axis=0, last=True, nonzero=nonzero)
+        if self._bottom is None:
+            self._bottom, self._top = first, last
+        else:
+            self._bottom = np.where(self._bottom > 0, self._bottom, first)
+            self._top = np.where(last > 0, last, self._top)
+
+        # Front, left, right and back: the first or last ids along j and i
+        for lines, axis, last in zip(self._lines, (1, 2, 2, 1), (False, False, True, True)):
+            values = firstNonZeroValues(ids, axis=axis, last=last, nonzero=nonzero)
+            lines.append(values[values > 0])
+
+    def sets(self):
+        ''' The sorted, unique bottom, front, left, right, back and top sets '''
+        def unique(values):
+            return np.unique(np.asarray(values, dtype=int))
+
+        return ([unique(self._bottom[self._bottom > 0])] +
+                [unique(np.concatenate(lines)) for lines in self._lines] +
+                [unique(self._top[self._top > 0])])
+
+
+def firstNonZeroValues(arr, axis=0, last=False, nonzero=None):
+    ''' The first (or with `last`, the last) non-zero value along `axis` of
+    every line through an array parallel to that axis, or zero for lines
+    without one. `nonzero` is arr > 0, if already known. '''
+    if nonzero is None:
+        nonzero = arr > 0
+    if last:
+        # Reversed views, not copies
+        arr = np.flip(arr, axis=axis)
+        nonzero = np.flip(nonzero, axis=axis)
+    # argmax gives the first True, or 0 for a line of False (whose value there
+    # isn't positive, so is zeroed)
+    first = np.expand_dims(nonzero.argmax(axis=axis), axis)
+    values = np.take_along_axis(arr, first, axis=axis).squeeze(axis)
+    return np.where(values > 0, values, 0)
+
+
+# Axis and end of the bottom, front, left, right, back and top boundaries of a
+# (k, j, i) array of ids
+_BOUNDARY_AXES = ((0, False), (1, False), (2, False), (2, True), (1, True), (0, True))
+
+def boundarySets(ids):
+    ''' The sorted, unique bottom, front, left, right, back and top sets of
+    a (k, j, i) array of element or node ids: the first non-zero ids along k,
+    j and i, and the last along i, j and k '''
+    nonzero = ids > 0
+    sets = []
+    for axis, last in _BOUNDARY_AXES:
+        values = firstNonZeroValues(ids, axis=axis, last=last, nonzero=nonzero)
+        sets.append(np.unique(np.asarray(values[values > 0], dtype=int)))
+    return sets
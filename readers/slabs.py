@@ -0,0 +1,430 @@
+# Out-of-core conversion of Eclipse grids that are too large to fit in memory
+# (enabled with --slab-layers). The grid is processed a slab of layers at a
+# time, and the node coordinates, connectivity and element variables are
+# written to the Exodus file slab by slab, so the memory used depends on the
+# size of a slab rather than the size of the grid.
+
+import numpy as np
+import tempfile
+from exodus_model.ExodusModel import ExodusModel
+from readers.eclipse import (readEclipse, loadEclipse, transformGrid, CornerGeometry,
+                             distortedElem, numberNodesInSlab,
+                             cornerNodeIds, addBoundarySideSets, addBoundaryNodeSets,
+                             _detectFaultFaces)
+from readers.reader_utils import (BoundarySets, nonPositiveJacobianElems, jacobianExamples,
+                                  reportElementJacobians)
+from readers.mesh_quality import elementQuality, qualityMetrics
+from readers.volumes import hasPorosity, poreVolumes, VolumeTotals
+from readers.profiling import stage
+
+# Element corner order with the top and bottom faces swapped (used when the
+# z coordinates are flipped)
+_FLIP_Z_CORNERS = [4, 5, 6, 7, 0, 1, 2, 3]
+
+# Flags stored per cell in the active cell file
+_ACTIVE = 1
+_BAD_JACOBIAN = 2
+
+class SlabModel(ExodusModel):
+    '''Class containing the parts of an Exodus II mesh that are found before
+    the file is written (the numbers of nodes and elements, the blocks and
+    the sidesets and nodesets) for a grid converted a slab of layers at a
+    time. The node coordinates, connectivity and element variables are
+    computed again, slab by slab, as they are written by writeSlabs.'''
+
+    def __init__(self, coord, grid, slab_layers, args):
+        super(SlabModel, self).__init__()
+        self._coord = coord
+        self._grid = grid
+        self._args = args
+        self._slabs = [(k0, min(k0 + slab_layers, grid.nz)) for k0 in range(0, grid.nz, slab_layers)]
+        self._remove_distorted = False
+        self._blocks = None
+        self._blockSizes = None
+        self._sideSetValues = {}
+
+        # Element variables found from the mesh (the volumes of --pore-volume
+        # and the metrics of --quality-variables), per active element in
+        # (k, j, i) order, in a temporary file once the nodes are numbered
+        self._volumes = bool(getattr(args, 'pore_volume', False) or getattr(args, 'volume_regions', None))
+        names = []
+        if self._volumes:
+            names += ['volume'] + (['pore_volume'] if hasPorosity(grid.keywords) else [])
+        names += list(getattr(args, 'quality_variables', None) or ())
+        self._derivedNames = list(dict.fromkeys(names))
+        self._derivedFile = None
+        self._derived = None
+
+        # Flags of every cell, in a temporary file rather than in memory
+        self._activeFile = tempfile.TemporaryFile(prefix='em2ex-')
+        self._activeCells = np.memmap(self._activeFile, dtype=np.uint8, mode='w+',
+                                      shape=(grid.nz, grid.ny, grid.nx))
+
+    # Ids of the element blocks (the unique SATNUM values of the active
+    # elements), and the number of elements in each
+    @property
+    def blocks(self):
+        return self._blocks
+
+    @property
+    def blockSizes(self):
+        return self._blockSizes
+
+    # Names of the element variables
+    @property
+    def elemVarNames(self):
+        return self._grid.keywords + [name.upper() for name in self._derivedNames]
+
+    def sideSetValues(self, var, i):
+        ''' Values of element variable `var` in sideset i '''
+        return self._sideSetValues[var][i]
+
+    def _geometry(self, k0, k1):
+        ''' The element corner coordinates (a CornerGeometry of every cell)
+        and the properties of the slab of layers k0 to k1 - 1 '''
+        zcorn, props = self._grid.layers(k0, k1)
+        cells = np.arange((k1 - k0) * self._grid.ny * self._grid.nx)
+        return CornerGeometry(self._coord, zcorn, cells), props
+
+    def _active(self, k0, k1):
+        ''' The active elements of the slab of layers k0 to k1 - 1 '''
+        flags = np.asarray(self._activeCells[k0:k1])
+        active = (flags & _ACTIVE).astype(np.int8)
+        if self._remove_distorted:
+            active[(flags & _BAD_JACOBIAN) > 0] = 0
+        return active
+
+    def _withDerived(self, props, start, elems):
+        ''' The properties of a slab with the element variables found from the
+        mesh added, where the slab's elements are flagged in `elems` and are
+        the elements numbered from `start` in (k, j, i) order '''
+        if self._derived is None:
+            return props
+        props = dict(props)
+        values = np.asarray(self._derived[start:start + int(np.count_nonzero(elems))])
+        for n, name in enumerate(self._derivedNames):
+            props[name.upper()] = np.zeros(len(elems), dtype=values.dtype)
+            props[name.upper()][elems] = values[:, n]
+        return props
+
+    def _cellBlockIds(self, props, shape):
+        ''' Block IDs (SATNUM) of the cells of a slab '''
+        if 'SATNUM' in props:
+            return props['SATNUM'].reshape(shape)
+        return np.zeros(shape, dtype=np.int8)
+
+    def findActiveCells(self):
+        ''' Find the active cells of each slab, removing pinched elements if
+        --pinch is given and elements with non-positive Jacobians if
+        --remove-distorted is given, and count the elements in each block '''
+        args = self._args
+        nz, ny, nx = self._activeCells.shape
+        n_pinched = 0
+        n_active = 0
+        n_bad = 0
+        block_sizes = {}
+        bad_sizes = {}
+
+        for k0, k1 in self._slabs:
+            shape = (k1 - k0, ny, nx)
+            geometry, props = self._geometry(k0, k1)
+
+            # Some elements may be inactive (ACTNUM = 0), so don't count them
+            if 'ACTNUM' in props:
+                active = (props['ACTNUM'].reshape(shape) > 0).astype(np.int8)
+            else:
+                active = np.ones(shape, dtype=np.int8)
+
+            # Check for pinched elements (coincident corners within pinch_tol)
+            distorted = geometry.mapChunks(lambda x, y, z: distortedElem(x, y, z, args.pinch_tol),
+                                           jobs=getattr(args, 'jobs', 1) or 1)
+            distorted = distorted.reshape(shape)
+            n_pinched += int((distorted & (active > 0)).sum())
+            if args.no_pinch:
+                active[distorted] = 0
+
+            flags = active.astype(np.uint8)
+            blocks = self._cellBlockIds(props, shape)
+            _addCounts(block_sizes, blocks[active > 0])
+
+            # Elements with non-positive Jacobian, in the final element orientation
+            if getattr(args, 'remove_distorted', False):
+                order = _FLIP_Z_CORNERS if args.flip_z else None
+                bad_jac = geometry.mapChunks(nonPositiveJacobianElems, order).reshape(shape) & (active > 0)
+                flags[bad_jac] |= _BAD_JACOBIAN
+                n_bad += int(bad_jac.sum())
+                _addCounts(bad_sizes, blocks[bad_jac])
+
+            n_active += int(np.count_nonzero(active))
+            self._activeCells[k0:k1] = flags
+
+        if args.no_pinch:
+            if n_pinched > 0:
+                print('{} pinched element(s) removed'.format(n_pinched))
+        elif n_pinched > 0:
+            print('Note: {} element(s) have coincident corners (pinched) and will be '
+                  'invalid in FEM solvers. Use --pinch to remove them.'.format(n_pinched))
+
+        if n_bad > 0:
+            if n_bad == n_active:
+                print('Warning: --remove-distorted would remove all {} active element(s). '
+                      'Skipping removal — check grid orientation (try --flip).'.format(n_active))
+            else:
+                print('{} element(s) with zero or negative element Jacobian removed'.format(n_bad))
+                self._remove_distorted = True
+                for blkid, count in bad_sizes.items():
+                    block_sizes[blkid] -= count
+
+        self._blocks = np.array(sorted(b for b in block_sizes if block_sizes[b] > 0))
+        self._blockSizes = np.array([block_sizes[b] for b in self._blocks], dtype=int)
+        self.numElems = int(self._blockSizes.sum())
+
+    def _numberedSlabs(self):
+        ''' Number the nodes of each slab in turn, joining them to the nodes of
+        the slab above. Yields (k0, k1, active, elemNodes, geometry, props,
+        first_id, coords, boundary) for each slab, where geometry gives the
+        element corner coordinates, the nodes numbered first_id
+        onwards are new in this slab, with coordinates coords, and boundary
+        holds the node ids shared with the next slab. '''
+        boundary = None
+        first_id = 1
+        jobs = getattr(self._args, 'jobs', 1) or 1
+        for k0, k1 in self._slabs:
+            geometry, props = self._geometry(k0, k1)
+            active = self._active(k0, k1)
+            elemNodes, first_corners, boundary = numberNodesInSlab(geometry.z, active, boundary, first_id, jobs)
+
+            # Each new node is at its first active corner
+            coords = geometry.cornerCoords(first_corners)
+
+            yield (k0, k1, active, elemNodes, geometry, props, first_id, coords, boundary[1])
+            first_id += len(first_corners)
+
+    def numberNodes(self):
+        ''' Number the nodes and elements slab by slab, finding the sidesets,
+        nodesets and fault sidesets and checking the element Jacobians '''
+        args = self._args
+        nz, ny, nx = self._activeCells.shape
+        check_jacobians = getattr(args, 'check_jacobians', True)
+        metrics = qualityMetrics(args)
+        if self._derivedNames:
+            self._derivedFile = tempfile.TemporaryFile(prefix='em2ex-')
+            self._derived = np.memmap(self._derivedFile, dtype=np.float64, mode='w+',
+                                      shape=(max(self.numElems, 1), len(self._derivedNames)))
+        num_elems = 0
+
+        # Totals of the element volumes over the model, blocks and regions
+        totals = None
+        if self._volumes:
+            regions = getattr(args, 'volume_regions', None) or ()
+            for keyword in regions:
+                if keyword not in self._grid.keywords:
+                    print('--volume-regions: keyword {} was not read (add it with --extra-keywords)'.format(keyword))
+                    exit()
+            totals = VolumeTotals(regions)
+        fault_sidesets = getattr(args, 'fault_sidesets', False)
+
+        # Exodus element numbering is for each block in turn, so each block's
+        # elements are numbered from the total size of the blocks before it
+        offsets = np.concatenate(([0], np.cumsum(self._blockSizes)[:-1]))
+        numbered = np.zeros(len(self._blocks), dtype=int)
+
+        side_sets = BoundarySets()
+        node_sets = BoundarySets()
+        faults = {axis: ([], [], [], []) for axis in (2, 1, 0)}
+        previous = None
+
+        # Node ids and coordinates on the boundary with the previous slab
+        known_ids = np.zeros(0, dtype=int)
+        known_xyz = np.zeros((0, 3))
+        num_neg, num_zero = 0, 0
+        examples = {'negative': [], 'zero': []}
+
+        num_nodes = 0
+        for k0, k1, active, elemNodes, geometry, props, first_id, coords, boundary_ids in self._numberedSlabs():
+            shape = (k1 - k0, ny, nx)
+            num_nodes = first_id - 1 + len(coords[0])
+
+            elemIds = _elemIds(self._cellBlockIds(props, shape), active, self._blocks, offsets, numbered)
+            side_sets.add(elemIds)
+            node_sets.add(cornerNodeIds(elemNodes, active))
+
+            # Fault faces within the slab and between it and the previous slab
+            if fault_sidesets:
+                for axis in (2, 1):
+                    _extendFaults(faults[axis], _detectFaultFaces(elemNodes, elemIds, active, axes=(axis,)))
+                if previous is not None:
+                    _extendFaults(faults[0], _detectFaultFaces(
+                        np.concatenate((previous[0], elemNodes)),
+                        np.concatenate((previous[1], elemIds)),
+                        np.concatenate((previous[2], active)), axes=(0,)))
+                else:
+                    _extendFaults(faults[0], _detectFaultFaces(elemNodes, elemIds, active, axes=(0,)))
+                previous = (elemNodes[-1:], elemIds[-1:], active[-1:])
+
+            # Element Jacobians and quality metrics from the node coordinates, as written
+            if metrics:
+                rows = elemNodes.reshape(-1, 8)[active.reshape(-1) > 0]
+                if args.flip_z:
+                    rows = rows[:, _FLIP_Z_CORNERS]
+                all_ids = np.concatenate((known_ids, np.arange(first_id, num_nodes + 1)))
+                all_xyz = np.concatenate((known_xyz, np.stack(coords, axis=-1)))
+                xyz = all_xyz[np.searchsorted(all_ids, rows)]
+                x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+
+                quality = elementQuality(x, y, z, metrics)
+                if totals is not None:
+                    elems = active.reshape(-1) > 0
+                    elem_props = {key: values[elems] for key, values in props.items()}
+                    quality['pore_volume'] = poreVolumes(quality['volume'], elem_props)
+                    totals.add(quality['volume'], quality['pore_volume'],
+                               self._cellBlockIds(props, shape).reshape(-1)[elems], elem_props)
+                for n, name in enumerate(self._derivedNames):
+                    self._derived[num_elems:num_elems + len(rows), n] = quality[name]
+                num_elems += len(rows)
+
+                if check_jacobians:
+                    min_jac = quality['min_jacobian']
+                    num_neg += int(np.sum(min_jac < 0))
+                    num_zero += int(np.sum(min_jac == 0))
+                    slab_examples = jacobianExamples(min_jac, elemIds.reshape(-1)[active.reshape(-1) > 0], x, y, z)
+                    for label in examples:
+                        examples[label].extend(slab_examples[label][:5 - len(examples[label])])
+
+                known_ids = np.unique(boundary_ids[boundary_ids > 0])
+                known_xyz = all_xyz[np.searchsorted(all_ids, known_ids)]
+
+        self.numNodes = num_nodes
+
+        if check_jacobians and self.numElems > 0:
+            with stage('jacobian check'):
+                reportElementJacobians(self.numElems, num_neg, num_zero, examples,
+                                       strict=getattr(args, 'strict_jacobians', False))
+
+        if totals is not None:
+            totals.report()
+
+        fault_data = None
+        if fault_sidesets:
+            fault_data = tuple(faults[2][n] + faults[1][n] + faults[0][n] for n in range(4))
+        addBoundarySideSets(self, args, fault_data, side_sets.sets())
+        addBoundaryNodeSets(self, args, node_sets.sets())
+
+    def findSideSetValues(self):
+        ''' Find the element variable values in each sideset. As for a grid
+        converted in one go, these are the values of the active elements in
+        (k, j, i) order at the positions given by the element ids. '''
+        names = self.elemVarNames
+        if self.numSideSets == 0 or not names:
+            return
+
+        positions = [np.asarray(s, dtype=int) - 1 for s in self.sideSets]
+        self._sideSetValues = {var: [None] * len(positions) for var in names}
+
+        start = 0
+        for k0, k1 in self._slabs:
+            elems = self._active(k0, k1).reshape(-1) > 0
+            props = self._withDerived(self._grid.props(k0, k1), start, elems)
+            active = np.flatnonzero(elems)
+            end = start + len(active)
+            for i, pos in enumerate(positions):
+                in_slab = (pos >= start) & (pos < end)
+                for var in names:
+                    values = props[var][active[pos[in_slab] - start]]
+                    if self._sideSetValues[var][i] is None:
+                        self._sideSetValues[var][i] = np.empty(len(pos), dtype=values.dtype)
+                    self._sideSetValues[var][i][in_slab] = values
+            start = end
+
+    def writeSlabs(self, exodusFile, step):
+        ''' Write the node coordinates, connectivity and element variables of
+        each slab in turn to the Exodus file, in which the blocks and the
+        element variable names have already been defined '''
+        args = self._args
+        nz, ny, nx = self._activeCells.shape
+        names = self.elemVarNames
+        lower_names = [var.lower() for var in names]
+
+        written = np.zeros(len(self._blocks), dtype=int)
+        num_elems = 0
+        for k0, k1, active, elemNodes, geometry, props, first_id, coords, boundary_ids in self._numberedSlabs():
+            if len(coords[0]):
+                exodusFile.put_partial_coords(first_id, *coords)
+
+            elems = active.reshape(-1) > 0
+            props = self._withDerived(props, num_elems, elems)
+            num_elems += int(np.count_nonzero(elems))
+            connectivity = elemNodes.reshape(-1, 8)[elems]
+            if args.flip_z:
+                connectivity = connectivity[:, _FLIP_Z_CORNERS]
+            block_index = np.searchsorted(self._blocks, self._cellBlockIds(props, active.shape).reshape(-1)[elems])
+
+            for b in np.unique(block_index):
+                in_block = block_index == b
+                start = written[b] + 1
+                exodusFile.put_partial_elem_connectivity(self._blocks[b], start, connectivity[in_block])
+                exodusFile.put_partial_element_variable_values_block(self._blocks[b], lower_names, step, start,
+                                                                     [props[var][elems][in_block] for var in names])
+                written[b] += int(in_block.sum())
+
+    def close(self):
+        ''' Remove the temporary active cell and element variable files '''
+        del self._activeCells
+        self._activeFile.close()
+        if self._derivedFile is not None:
+            self._derived = None
+            self._derivedFile.close()
+
+
+def _addCounts(counts, blocks):
+    ''' Add the number of cells in each block to the dict counts '''
+    ids, sizes = np.unique(blocks, return_counts=True)
+    for blkid, size in zip(ids.tolist(), sizes.tolist()):
+        counts[blkid] = counts.get(blkid, 0) + size
+
+def _extendFaults(faults, fault_data):
+    ''' Append the lists of fault faces from _detectFaultFaces to faults '''
+    for lists, new in zip(faults, fault_data):
+        lists.extend(new)
+
+def _elemIds(blocks, active, block_ids, offsets, numbered):
+    ''' Exodus element ids of the cells of a slab (zero for inactive cells).
+    Within each block, elements are numbered in (k, j, i) order following the
+    `numbered` elements of that block in earlier slabs (updated in place). '''
+    ids = np.zeros(active.size, dtype=int)
+    elems = np.flatnonzero(active.reshape(-1) > 0)
+    block_index = np.searchsorted(block_ids, blocks.reshape(-1)[elems])
+
+    # A stable sort by block keeps the (k, j, i) order within each block
+    order = np.argsort(block_index, kind='stable')
+    sorted_index = block_index[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_index, sorted_index)
+    ids[elems[order]] = offsets[sorted_index] + numbered[sorted_index] + rank + 1
+
+    numbered += np.bincount(block_index, minlength=len(block_ids))
+    return ids.reshape(active.shape)
+
+def parseEclipseSlabs(f, args, reader=readEclipse):
+    ''' Parse the ECLIPSE file a slab of args.slab_layers layers at a time,
+    returning a SlabModel to write with writeSlabs. The data is read into
+    disk-backed temporary files (for grdecl files), so only the slab being
+    processed has to fit in memory. Nodes are joined between slabs through
+    the corners shared by the bottom layer of one slab and the top layer of
+    the next, giving the same mesh as converting the grid in one go. '''
+    eclipse = loadEclipse(f, args, reader, out_of_core=True)
+
+    with stage('transform geometry'):
+        coord, grid = transformGrid(eclipse, args)
+
+    model = SlabModel(coord, grid, args.slab_layers, args)
+
+    with stage('active cells'):
+        model.findActiveCells()
+
+    with stage('number nodes'):
+        model.numberNodes()
+
+    with stage('sideset values'):
+        model.findSideSetValues()
+
+    return model
@@ -0,0 +1,91 @@
+# Bulk and pore volumes of the elements, and the volume report of
+# --pore-volume used to reconcile a converted mesh with the simulator
+
+import numpy as np
+
+# Names of the porosity and net-to-gross properties (in any case): the
+# Eclipse keywords, and the porosity of a Leapfrog model
+_POROSITY_NAMES = ('PORO', 'POROSITY')
+_NTG_NAMES = ('NTG',)
+
+def _findProperty(props, names):
+    ''' The values of the first property in props named one of `names`
+    (ignoring case), or None '''
+    for key in props:
+        if key.upper() in names:
+            return props[key]
+    return None
+
+def hasPorosity(names):
+    ''' Whether the properties with these names include a porosity '''
+    return any(name.upper() in _POROSITY_NAMES for name in names)
+
+def poreVolumes(volume, props):
+    ''' Pore volume of each element, volume * PORO * NTG (NTG defaults to 1,
+    as in Eclipse), from the element properties `props`. Returns None if
+    there is no porosity property. '''
+    porosity = _findProperty(props, _POROSITY_NAMES)
+    if porosity is None:
+        return None
+    pore_volume = volume * porosity
+    ntg = _findProperty(props, _NTG_NAMES)
+    if ntg is not None:
+        pore_volume *= ntg
+    return pore_volume
+
+class VolumeTotals(object):
+    '''Class adding up the number of elements and their bulk and pore volumes
+    over the whole model, each block and the regions of each of the given
+    region keywords (e.g. FIPNUM). The elements can be added a part of the
+    model at a time.'''
+
+    def __init__(self, region_keywords=()):
+        self._region_keywords = list(region_keywords)
+        self._pore = False
+        # [number of elements, bulk volume, pore volume] of the field and of
+        # each block and region number
+        self._field = np.zeros(3)
+        self._groups = {name: {} for name in ['Block'] + self._region_keywords}
+
+    @property
+    def regionKeywords(self):
+        return self._region_keywords
+
+    def _addGroups(self, totals, ids, volume, pore_volume):
+        values, inverse = np.unique(ids, return_inverse=True)
+        sums = np.stack((np.bincount(inverse, minlength=len(values)),
+                         np.bincount(inverse, weights=volume, minlength=len(values)),
+                         np.bincount(inverse, weights=pore_volume, minlength=len(values))), axis=1)
+        for value, row in zip(values.tolist(), sums):
+            totals[value] = totals.get(value, 0) + row
+
+    def add(self, volume, pore_volume, blocks, regions):
+        ''' Add elements with the given volumes (pore_volume is None without
+        PORO), block ids and region numbers (a dict of arrays by keyword) '''
+        volume = np.asarray(volume, dtype=np.float64)
+        if pore_volume is None:
+            pore_volume = np.zeros_like(volume)
+        else:
+            self._pore = True
+            pore_volume = np.asarray(pore_volume, dtype=np.float64)
+
+        self._field += (len(volume), volume.sum(), pore_volume.sum())
+        self._addGroups(self._groups['Block'], np.asarray(blocks).reshape(-1), volume, pore_volume)
+        for keyword in self._region_keywords:
+            self._addGroups(self._groups[keyword], np.asarray(regions[keyword]).reshape(-1),
+                            volume, pore_volume)
+
+    def report(self):
+        ''' Print the totals of the field, each block and each region '''
+        def line(name, totals):
+            pore = '{:>16.6e}'.format(totals[2]) if self._pore else '{:>16}'.format('-')
+            print('  {:<20} {:>12d} {:>16.6e} {}'.format(name, int(totals[0]), totals[1], pore))
+
+        print('Volume report (in grid units cubed):')
+        print('  {:<20} {:>12} {:>16} {:>16}'.format('', 'Elements', 'Bulk volume', 'Pore volume'))
+        line('Field', self._field)
+        for name, groups in self._groups.items():
+            for value in sorted(groups):
+                line('{} {}'.format(name, value), groups[value])
+        if not self._pore:
+            print('  No PORO values, so no pore volumes')
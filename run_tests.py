@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 
 import subprocess
+import numpy as np
 import pytest
 import os
+import shutil
+import tempfile
 import yaml
+from readers.compressed import stripCompressionExtension
 
 # Exception class to throw exception for pytest
 class Em2exException(Exception):
@@ -73,6 +77,13 @@ def test_em2ex(key, use_official_api, exodiff):
         else:
             check_output(key)
 
+    # If the test type is cache, check that a second run loads the cache
+    elif tests[key]['type'] == 'cache':
+        if 'gold' not in tests[key].keys() or 'expected_output' not in tests[key].keys():
+            pytest.skip(key + ': Skipped as gold file or expected_output not specified')
+        else:
+            cache_test(key, use_official_api, exodiff)
+
     else:
         # Skip unknown test type
         pytest.skip(key + ': Skipped as unknown test type')
@@ -103,7 +114,7 @@ def exodiff_test(key, use_official_api, exodiff):
 
     # Compare the converted model with a gold file using exodiff
     try:
-        filename_base, file_extension = os.path.splitext(filename)
+        filename_base, file_extension = os.path.splitext(stripCompressionExtension(filename))
         exodus_filename = os.path.join(filepath, filename_base + '.e')
         gold_filename = os.path.join(filepath, 'gold', tests[key]['gold'])
         subprocess.check_output([exodiff, '--quiet', exodus_filename, gold_filename])
@@ -113,6 +124,26 @@ def exodiff_test(key, use_official_api, exodiff):
 
     return
 
+def cache_test(key, use_official_api, exodiff):
+    ''' Convert reservoir model twice with a temporary --cache-dir: the first
+    run fills the cache, and the second must load it (printing
+    expected_output) and give the same result as the gold file '''
+
+    cache_dir = tempfile.mkdtemp(prefix='em2ex_cache_')
+    cli_args = tests[key].get('cli_args', '')
+    tests[key]['cli_args'] = '{} --cache-dir {}'.format(cli_args, cache_dir)
+
+    try:
+        exodiff_test(key, use_official_api, exodiff)
+        check_output(key)
+        exodiff_test(key, use_official_api, exodiff)
+
+    finally:
+        tests[key]['cli_args'] = cli_args
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return
+
 def expected_error(key):
     ''' Raise an exception when an error is thrown while em2ex is running '''
 
@@ -153,3 +184,42 @@ def check_output(key):
             key, tests[key]['expected_output'], combined)
 
     return
+
+def test_netcdf4_define_mode(tmp_path, monkeypatch):
+    ''' pyexodus keeps a NETCDF3 file written with netCDF4 in define mode by
+    overriding the private Dataset._enddef, which netCDF4 calls after every
+    definition. For the versions this is done for, check that netCDF4 still
+    calls _enddef while the layout is defined, and that the file is written
+    correctly '''
+    netCDF4 = pytest.importorskip('netCDF4')
+    from pyexodus import pyexodus
+
+    # Other versions are used without the override (see pyexodus._Dataset)
+    if not pyexodus._OVERRIDE_ENDDEF:
+        pytest.skip('netCDF4 {} is outside the versions the define mode override is used for'.format(
+            netCDF4.__version__))
+
+    calls = []
+    enddef = pyexodus._Dataset._enddef
+    def counting_enddef(self):
+        calls.append(self.defining)
+        enddef(self)
+    monkeypatch.setattr(pyexodus._Dataset, '_enddef', counting_enddef)
+
+    filename = str(tmp_path / 'define_mode.nc')
+    rootgrp = pyexodus._Dataset(filename, 'w', format='NETCDF3_64BIT')
+    rootgrp.set_fill_off()
+    rootgrp.begin_definitions()
+    for i in range(3):
+        rootgrp.createDimension('n{}'.format(i), 4)
+        rootgrp.createVariable('x{}'.format(i), 'f8', ('n{}'.format(i),))
+    assert calls and all(calls), 'netCDF4 no longer calls _enddef after each definition'
+
+    rootgrp.end_definitions()
+    for i in range(3):
+        rootgrp.variables['x{}'.format(i)][:] = np.arange(4) + i
+    rootgrp.close()
+
+    with netCDF4.Dataset(filename) as written:
+        for i in range(3):
+            assert np.array_equal(written.variables['x{}'.format(i)][:], np.arange(4) + i)